@@ -1,79 +1,76 @@
 # app.py
 
 from f1_score import compute_f1_score, generate_model_evaluation_metrics
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS  # Import CORS for cross-origin requests
+import json
 import os
-
-
-try:
-    import pyodbc
-    PYODBC_AVAILABLE = True
-except ImportError:
-    print("WARNING: pyodbc module not available. Database functionality will be disabled.")
-    PYODBC_AVAILABLE = False
-
-from classifier_sentiment import classify_sentiment
-from classifier_sarcasm import detect_sarcasm
-from classifier_emotion import detect_emotion
-# Where is aspect-based classifier?
-from phi3resgen import generate_response
+import time
+
+from db import PYODBC_AVAILABLE, get_db_connection
+from classifier_sentiment import classify_sentiment_batch
+from classifier_sarcasm import detect_sarcasm_batch
+from classifier_emotion import detect_emotion_batch, preprocess_text
+from classifier_emotion import active_model as emotion_model
+from classifier_aspect import extract_aspects_batch, format_aspects
+from fused_classifier import score_heads
+from phi3resgen import score_empathy_batch
+from generation_backends import get_generation_backend
+from online_learner import start_online_learner
+from coalesce import SingleFlight, dedupe, normalize_text
+from columnar import available_formats, encode_results
+from write_behind import QueueFullError, get_write_behind, start_write_behind
+from response_index import get_response_index, start_response_index
+from near_duplicates import get_near_duplicates, start_near_duplicates
+from ingest import (INGEST_MAX_BYTES, MAX_JSON_BYTES, RETRY_AFTER_SECONDS, IngestError, ingest_slots,
+                    iter_chunks, iter_texts, ndjson_line, parser_for)
+from scheduler import (BULK, CLASSIFY_SLICE, INTERACTIVE, admission, admit_request, classify_scheduler, client_id,
+                       llm_scheduler, retry_later, scheduler_metrics)
+from retention import SqlServerPartitions, ensure_partitions, get_retention_manager, start_retention_manager
+import model_store
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-# Clear FeedbackResponses table on startup if it has data
 def initialize_database():
-    print("[INIT] Checking and cleaning FeedbackResponses table if needed...")
-    conn = get_db_connection()
-    if conn is None:
-        print("[INIT ERROR] Could not connect to DB for initialization.")
-        return
+    """
+    Makes sure the upcoming monthly partitions of FeedbackResponses exist.
+    A metadata-only change: startup never reads or deletes rows; old data
+    leaves the table through retention (see retention.py).
+    """
+    print("[INIT] Checking FeedbackResponses partitions...")
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM FeedbackResponses;")
-        row_count = cursor.fetchone()[0]
-        print(f"[INIT] Found {row_count} records in FeedbackResponses.")
-        if row_count > 0:
-            print("[INIT] Clearing the table...")
-            cursor.execute("DELETE FROM FeedbackResponses;")
-            conn.commit()
-            print("[INIT] Table cleared.")
-        cursor.close()
-        conn.close()
+        ensure_partitions(SqlServerPartitions(get_db_connection))
     except Exception as e:
-        print(f"[INIT ERROR] Failed to initialize database: {str(e)}")
+        print(f"[INIT ERROR] Failed to check partitions: {str(e)}")
 
 
-# Production DB config for Azure SQL
-DB_CONFIG = {
-    'server': '1sqlcapsenseserver.database.windows.net',
-    'database': 'SentimentAnalysisDB',
-    'username': 'capsenseadmin',
-    'password': 'Access@Capsense1'
-}
 
-def get_db_connection():
-    """
-    Returns a database connection or None if pyodbc is not available
-    """
-    if not PYODBC_AVAILABLE:
-        print("WARNING: Database connection requested but pyodbc is not available")
-        return None
-        
-    conn_str = (
-        f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-        f"SERVER={DB_CONFIG['server']};"
-        f"DATABASE={DB_CONFIG['database']};"
-        f"UID={DB_CONFIG['username']};"
-        f"PWD={DB_CONFIG['password']};"
-        "Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;"
-    )
-    try:
-        return pyodbc.connect(conn_str)
-    except Exception as e:
-        print(f"ERROR connecting to database: {str(e)}")
-        return None
+# Pick up newly published model versions without a restart (see model_store.py)
+if os.getenv("CAPSENSE_MODEL_WATCH", "1") != "0":
+    model_store.start_watcher()
+
+# Incremental learning from approved feedback (see online_learner.py)
+if os.getenv("CAPSENSE_ONLINE_LEARNING") == "1":
+    start_online_learner(get_db_connection)
+
+# Reuse approved responses for near-identical feedback (see response_index.py)
+if PYODBC_AVAILABLE and os.getenv("CAPSENSE_REUSE_RESPONSES", "1") != "0":
+    # The emotion vectorizer was fitted on preprocess_text output, so the index prepares texts the same way
+    start_response_index(emotion_model.get()[1], get_db_connection, prepare=preprocess_text)
+
+# Pick the response generator now, so a local model loads before the first request (see generation_backends.py)
+if get_generation_backend().max_concurrency:
+    # A local model runs one text per instance; the scheduler hands out exactly those (see scheduler.py)
+    llm_scheduler.resize(get_generation_backend().max_concurrency)
+
+# Near-duplicate texts share one analysis (see near_duplicates.py)
+if os.getenv("CAPSENSE_DEDUP", "1") != "0":
+    start_near_duplicates()
+
+# Archive and drop expired monthly partitions of FeedbackResponses (see retention.py)
+if PYODBC_AVAILABLE and os.getenv("CAPSENSE_RETENTION") == "1":
+    start_retention_manager(SqlServerPartitions(get_db_connection))
 
 
 # Validation functions
@@ -92,12 +89,399 @@ def validate_request_payload(payload):
     # Add more checks here if needed
     return (True, None)
 
+def validate_batch_payload(payload, query_format=None):
+    """
+    Checks a respond_batch payload.
+    Returns (texts, response_format, None) if valid, or (None, None, error_message).
+    """
+    if not payload or "customer_texts" not in payload:
+        return (None, None, "Field 'customer_texts' is required.")
+
+    texts = payload["customer_texts"]
+    if not isinstance(texts, list):
+        return (None, None, "'customer_texts' must be a list of strings.")
+
+    response_format = query_format or payload.get("format") or "rows"
+    if response_format not in available_formats():
+        return (None, None, f"Unsupported format '{response_format}'. "
+                            f"Available: {', '.join(available_formats())}.")
+    return (texts, response_format, None)
+
+def read_json_body(content_length, read):
+    """
+    A JSON request body of at most MAX_JSON_BYTES; larger bodies are refused
+    before they are read (see ingest.py).
+    """
+    if content_length is not None and content_length > MAX_JSON_BYTES:
+        raise IngestError(body_too_large_message(), 413)
+    data = read(MAX_JSON_BYTES + 1)
+    if len(data) > MAX_JSON_BYTES:
+        raise IngestError(body_too_large_message(), 413)
+    return json.loads(data)
+
+def body_too_large_message():
+    return (f"The request body is larger than {MAX_JSON_BYTES} bytes. "
+            f"Upload large batches to /api/ingest instead.")
+
 def log_invalid_input(error_message):
     """
     Logs the invalid request (to console or a file).
     """
     print(f"[INVALID INPUT] {error_message}")
 
+def classify_texts(texts):
+    """
+    Runs the sentiment, sarcasm and emotion classifiers over a list of texts:
+    one fused sparse product for all three heads when the active models
+    allow it (see fused_classifier.py), otherwise one batched predict_proba
+    pass per classifier.
+    Returns a list of classification_data dicts aligned with texts.
+    """
+    scores = score_heads(texts)
+    sentiment_labels, sentiment_proba = classify_sentiment_batch(texts, scores.get("sentiment"))
+    sarcasm_labels, sarcasm_proba = detect_sarcasm_batch(texts, scores.get("sarcasm"))
+    emotion_labels, emotion_proba = detect_emotion_batch(texts, scores.get("emotion"))
+
+    sentiment_confidence = sentiment_proba.max(axis=1)
+    emotion_confidence = emotion_proba.max(axis=1)
+
+    return [
+        {
+            "sentiment": sentiment_labels[i],
+            "sentiment_confidence": float(sentiment_confidence[i]),
+            "sarcasm": sarcasm_labels[i],
+            "sarcasm_confidence": float(sarcasm_proba[i, 1]),
+            "emotion": emotion_labels[i],
+            "emotion_confidence": float(emotion_confidence[i])
+        }
+        for i in range(len(texts))
+    ]
+
+def find_reusable_responses(texts, classifications):
+    """
+    The approved response to reuse for each text (a ResponseMatch), or None
+    where the LLM has to be called; all None when response reuse is off.
+    """
+    response_index = get_response_index()
+    if response_index is None:
+        return [None] * len(texts)
+    return response_index.lookup_batch(texts, [c["sentiment"] for c in classifications])
+
+def reused_responses(matches):
+    """
+    The ai_response built from each approved response instead of a Phi-3
+    call, with their empathy scores computed in one pass.
+    """
+    scores, _ = score_empathy_batch([match.response_text for match in matches])
+    return [{
+        "response_text": match.response_text,
+        "empathy_score": score,
+        "reused_from": match.entry_id,
+        "similarity": round(match.similarity, 4)
+    } for match, score in zip(matches, scores)]
+
+# Identical texts being analyzed by concurrent requests share one computation (see coalesce.py)
+analysis_flight = SingleFlight("analysis")
+
+def classify_slice(texts):
+    """
+    Classification, aspects and reusable response matches for texts, in
+    one pass per classifier: the work done under one classifier slot.
+    """
+    classifications = classify_texts(texts)
+    return classifications, extract_aspects_batch(texts), find_reusable_responses(texts, classifications)
+
+def classify_scheduled(texts, work_class):
+    """
+    classify_slice for texts of any number, CLASSIFY_SLICE texts per
+    classifier slot, so a large batch leaves room for interactive work
+    between slices (see scheduler.py).
+    """
+    classifications, aspects, reuse = [], [], []
+    for start in range(0, len(texts), CLASSIFY_SLICE):
+        with classify_scheduler.slot(work_class):
+            part = classify_slice(texts[start:start + CLASSIFY_SLICE])
+        classifications.extend(part[0])
+        aspects.extend(part[1])
+        reuse.extend(part[2])
+    return classifications, aspects, reuse
+
+def classify_near_duplicates(texts, work_class):
+    """
+    classify_texts for the texts a DuplicatePlan needs labels for (see
+    near_duplicates.py), CLASSIFY_SLICE texts per classifier slot.
+    """
+    classifications = []
+    for start in range(0, len(texts), CLASSIFY_SLICE):
+        with classify_scheduler.slot(work_class):
+            classifications.extend(classify_texts(texts[start:start + CLASSIFY_SLICE]))
+    return classifications
+
+def analyze_texts(texts, work_class=BULK):
+    """
+    Classification, aspects and AI response for each text.
+    Duplicates within the batch are analyzed once and fanned back out, and
+    near-duplicates of recent texts with the same labels reuse their
+    analysis (tagged with "near_duplicate"). A text another request is already analyzing is
+    waited on instead of being sent to Phi-3 again. The batched classifier
+    pass only runs if at least one text actually has to be computed here.
+    The classifier and Phi-3 are shared with other requests by work_class
+    (INTERACTIVE or BULK, see scheduler.py).
+    Returns a list of {"classification", "aspects", "ai_response"} aligned with texts.
+    """
+    unique_texts, positions = dedupe(texts)
+    near_duplicates = get_near_duplicates()
+    if near_duplicates is None:
+        analyses = run_pipeline(unique_texts, work_class)
+    else:
+        plan = near_duplicates.plan(unique_texts)
+        plan.decide(classify_near_duplicates(plan.to_classify, work_class))
+        analyses = plan.complete(run_pipeline(plan.texts, work_class))
+    return [analyses[position] for position in positions]
+
+def run_pipeline(unique_texts, work_class):
+    """
+    analyze_texts for distinct texts. The texts no other request is
+    computing get one batched classifier pass and one generate_batch call
+    on the generation backend (see generation_backends.py); the others are
+    waited on.
+    """
+    if not unique_texts:
+        return []
+
+    def analyze_batch(indexes):
+        texts = [unique_texts[i] for i in indexes]
+        classifications, aspects, reuse = classify_scheduled(texts, work_class)
+        pending = [j for j, match in enumerate(reuse) if not match]
+        reused = [j for j, match in enumerate(reuse) if match]
+        generated = get_generation_backend().generate_batch([(texts[j], classifications[j]) for j in pending],
+                                                            gate=lambda: llm_scheduler.slot(work_class))
+        responses = dict(zip(pending, generated))
+        responses.update(zip(reused, reused_responses([reuse[j] for j in reused])))
+        return [{
+            "classification": classifications[j],
+            "aspects": aspects[j],
+            "ai_response": responses[j]
+        } for j in range(len(texts))]
+
+    return analysis_flight.do_many([normalize_text(text) for text in unique_texts], analyze_batch)
+
+def build_batch_results(texts, analyses):
+    """
+    The /api/respond_batch rows: one result per text with its F1 score.
+    """
+    results = []
+    for text, analysis in zip(texts, analyses):
+        classification_data = analysis["classification"]
+
+        # Calculate F1 score
+        f1_score = compute_f1_score(classification_data)
+
+        result = {
+            "input_text": text,
+            "classification": classification_data,
+            "aspects": analysis["aspects"],
+            "ai_response": analysis["ai_response"],
+            "f1_score": f1_score
+        }
+        if "near_duplicate" in analysis:
+            result["near_duplicate"] = analysis["near_duplicate"]
+        results.append(result)
+    return results
+
+def batch_analysis_result(text, analysis):
+    """
+    The /batch-analyze payload the frontend expects for one text.
+    """
+    classification_data = analysis["classification"]
+    aspects = analysis["aspects"]
+
+    # Calculate F1 score
+    f1_score = compute_f1_score(classification_data)
+
+    return {
+        "emotion": classification_data["emotion"],
+        "sarcasm": "Yes" if classification_data["sarcasm"] else "No",
+        "aspects": format_aspects(aspects),
+        "aspectDetails": aspects,
+        "classification": classification_data["sentiment"],
+        "response": analysis["ai_response"]["response_text"],
+        "originalText": text,
+        "f1Score": f1_score
+    }
+
+# Streaming /batch-analyze/stream: server-sent events, classification first (see stream_analysis)
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class StreamingAnalysis:
+    """
+    One text analyzed for /batch-analyze/stream. prepare() classifies the
+    text (or finds a reusable analysis) and returns the "classification"
+    event; the response is then streamed as "token" events (only when it
+    has to be generated) and finish() returns the "done" event with the
+    full response and the server-side timings.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.started = time.perf_counter()
+        self.plan = None
+        self.analysis = None        # complete analysis when nothing needs generating
+        self.classification_data = None
+        self.aspects = None
+        self.classified_ms = None
+
+    def elapsed_ms(self):
+        return round(1000 * (time.perf_counter() - self.started), 1)
+
+    def prepare(self, classify=None):
+        """
+        classify, when given, replaces classify_scheduled(texts, INTERACTIVE)
+        for a caller that already holds a classifier slot.
+        """
+        classify = classify or (lambda texts: classify_scheduled(texts, INTERACTIVE))
+        classified = None
+        near_duplicates = get_near_duplicates()
+        if near_duplicates is not None:
+            self.plan = near_duplicates.plan([self.text])
+            if self.plan.to_classify:
+                classified = classify([self.text])
+            self.plan.decide(classified[0] if classified else [])
+            if not self.plan.texts:
+                self.analysis = self.plan.complete([])[0]
+        if self.analysis is None:
+            classifications, aspects, reuse = classified or classify([self.text])
+            self.classification_data = classifications[0]
+            self.aspects = aspects[0]
+            match = reuse[0]
+            if match:
+                self.analysis = self.analysis_with(reused_responses([match])[0])
+        else:
+            self.classification_data = self.analysis["classification"]
+            self.aspects = self.analysis["aspects"]
+        self.classified_ms = self.elapsed_ms()
+
+        event = batch_analysis_result(self.text, self.analysis_with({"response_text": ""}))
+        del event["response"]
+        return sse_event("classification", event)
+
+    def analysis_with(self, ai_response):
+        return {"classification": self.classification_data, "aspects": self.aspects, "ai_response": ai_response}
+
+    def finish(self, stream=None):
+        if self.analysis is None:
+            self.analysis = self.analysis_with(stream.result())
+            if self.plan is not None:
+                self.analysis = self.plan.complete([self.analysis])[0]
+        first_token_ms = (round(1000 * stream.first_chunk_seconds + self.classified_ms, 1)
+                          if stream is not None and stream.first_chunk_seconds is not None else None)
+        done = batch_analysis_result(self.text, self.analysis)
+        done["empathyScore"] = self.analysis["ai_response"]["empathy_score"]
+        done["timings"] = {
+            "classification_ms": self.classified_ms,
+            "first_token_ms": first_token_ms,
+            "total_ms": self.elapsed_ms()
+        }
+        return sse_event("done", done)
+
+FEEDBACK_INSERT_QUERY = """
+INSERT INTO FeedbackResponses 
+    (CustomerText, Sentiment, ResponseText, EmpathyScore, SarcasmDetected, Emotion, F1Score)
+VALUES (?, ?, ?, ?, ?, ?, ?);
+"""
+
+def feedback_row(result):
+    """
+    The FEEDBACK_INSERT_QUERY parameters for one respond_batch result.
+    """
+    classification_data = result["classification"]
+    return (
+        result["input_text"],
+        classification_data["sentiment"],
+        result["ai_response"]["response_text"],
+        result["ai_response"]["empathy_score"],
+        classification_data["sarcasm"],
+        classification_data["emotion"],
+        result["f1_score"]
+    )
+
+def store_batch_results(results):
+    """
+    Inserts respond_batch results into FeedbackResponses in one transaction.
+    Skipped (with a log line) when the database is not available.
+    Returns the number of rows written.
+    """
+    # Get DB connection (might be None if not available)
+    conn = get_db_connection()
+    if not conn:
+        print("Database connection not available - skipping DB operations")
+        return 0
+
+    try:
+        cursor = conn.cursor()
+        cursor.executemany(FEEDBACK_INSERT_QUERY, [feedback_row(result) for result in results])
+        conn.commit()
+        cursor.close()
+        return len(results)
+    finally:
+        conn.close()
+
+# Feedback on a result that was still in the write-behind queue found no row, so
+# handle_feedback inserted a stand-in (no classification). Once the result is
+# flushed, this moves that feedback onto it and deletes the stand-in, in the same
+# transaction. FeedbackDate is set to now so the online learner and the response
+# index, which read past a FeedbackDate watermark, pick the row up.
+EARLY_FEEDBACK_QUERY = """
+DECLARE @since DATETIME = DATEADD(second, -?, GETDATE());
+UPDATE r
+SET r.approved = f.approved, r.FeedbackDate = GETDATE()
+FROM FeedbackResponses r
+CROSS APPLY (
+    SELECT TOP 1 e.approved FROM FeedbackResponses e
+    WHERE e.FeedbackDate >= @since AND e.Sentiment IS NULL AND e.approved IS NOT NULL AND e.Id < r.Id
+      AND LOWER(LTRIM(RTRIM(e.CustomerText))) = LOWER(LTRIM(RTRIM(r.CustomerText)))
+      AND LOWER(LTRIM(RTRIM(e.ResponseText))) = LOWER(LTRIM(RTRIM(r.ResponseText)))
+    ORDER BY e.FeedbackDate DESC, e.Id DESC
+) f
+WHERE r.approved IS NULL AND r.Sentiment IS NOT NULL
+  AND r.Id > (SELECT MIN(Id) FROM FeedbackResponses
+              WHERE FeedbackDate >= @since AND Sentiment IS NULL AND approved IS NOT NULL);
+DELETE e FROM FeedbackResponses e
+WHERE e.FeedbackDate >= @since AND e.Sentiment IS NULL AND e.approved IS NOT NULL
+  AND EXISTS (SELECT 1 FROM FeedbackResponses r
+              WHERE r.Id > e.Id AND r.Sentiment IS NOT NULL AND r.approved IS NOT NULL
+                AND LOWER(LTRIM(RTRIM(r.CustomerText))) = LOWER(LTRIM(RTRIM(e.CustomerText)))
+                AND LOWER(LTRIM(RTRIM(r.ResponseText))) = LOWER(LTRIM(RTRIM(e.ResponseText))));
+"""
+
+# Feedback can only follow its result, so the stand-ins to look at are no older than the
+# flushed rows' time in the queue; the margin covers clock steps between app and database
+EARLY_FEEDBACK_MARGIN_SECONDS = 60
+
+def attach_early_feedback(cursor, pending_seconds):
+    cursor.execute(EARLY_FEEDBACK_QUERY, (int(pending_seconds) + EARLY_FEEDBACK_MARGIN_SECONDS,))
+
+# Results are journaled and inserted in bulk in the background (see write_behind.py)
+if PYODBC_AVAILABLE and os.getenv("CAPSENSE_WRITE_BEHIND", "1") != "0":
+    start_write_behind(get_db_connection, FEEDBACK_INSERT_QUERY, after_insert=attach_early_feedback)
+
+def persist_batch_results(results):
+    """
+    Hands results to the write-behind queue, which acknowledges them once
+    they are journaled. Falls back to a synchronous insert when write-behind
+    is off or its queue stays full.
+    """
+    write_behind = get_write_behind()
+    if write_behind is not None:
+        try:
+            return write_behind.enqueue([feedback_row(result) for result in results])
+        except QueueFullError as e:
+            print(f"[WRITE-BEHIND] {e} Inserting synchronously.")
+    return store_batch_results(results)
+
 # Updated static file serving paths
 @app.route('/')
 def serve_index():
@@ -153,6 +537,8 @@ def handle_feedback():
                     """
                     cursor.execute(update_query, (1 if feedback_type == "approved" else 0, row[0]))
                 else:
+                    # No row yet (possibly still in the write-behind queue): a stand-in
+                    # the flush merges into the result (see EARLY_FEEDBACK_QUERY)
                     insert_query = """
                     INSERT INTO FeedbackResponses 
                         (CustomerText, ResponseText, approved, FeedbackDate)
@@ -275,90 +661,132 @@ def respond_batch():
     2) Classify & respond to each text
     3) Insert each into DB
     4) Return array of results
+    Optional "format" (body or query string): rows (default), columnar,
+    msgpack or arrow; see columnar.py.
+    Bodies over CAPSENSE_MAX_JSON_BYTES are refused with 413; larger
+    batches go to /api/ingest.
     """
     try:
-        payload = request.get_json(force=True)
-        if not payload or "customer_texts" not in payload:
-            return jsonify({"error": "Field 'customer_texts' is required."}), 400
+        payload = read_json_body(request.content_length, request.stream.read)
+        texts, response_format, error_message = validate_batch_payload(payload, request.args.get("format"))
+        if error_message:
+            return jsonify({"error": error_message}), 400
 
-        texts = payload["customer_texts"]
-        if not isinstance(texts, list):
-            return jsonify({"error": "'customer_texts' must be a list of strings."}), 400
-    
+    except IngestError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    ticket, rejection = admit_request(request, BULK, len(texts))
+    if rejection:
+        return rejection
+
     results = []
     
-    # Get DB connection (might be None if not available)
-    conn = get_db_connection()
-    cursor = None
-    
     try:
-        # Only set up DB operations if connection is available
-        if conn:
-            cursor = conn.cursor()
-            insert_query = """
-            INSERT INTO FeedbackResponses 
-                (CustomerText, Sentiment, ResponseText, EmpathyScore, SarcasmDetected, Emotion, F1Score)
-            VALUES (?, ?, ?, ?, ?, ?, ?);
-            """
-        else:
-            print("Database connection not available - skipping DB operations")
-
-        for text in texts:
-            sentiment_result = classify_sentiment(text)
-            sarcasm_result = detect_sarcasm(text)
-            emotion_result = detect_emotion(text)
-
-            classification_data = {
-                "sentiment": sentiment_result["sentiment"],
-                "sentiment_confidence": sentiment_result["confidence"],
-                "sarcasm": sarcasm_result["sarcasm"],
-                "sarcasm_confidence": sarcasm_result["confidence"],
-                "emotion": emotion_result["emotion"],
-                "emotion_confidence": emotion_result["confidence"]
-            }
-
-            # Generate AI-based response
-            ai_response = generate_response(text, classification_data)
-            
-            # Calculate F1 score
-            f1_score = compute_f1_score(sentiment_result)
-
-            # Insert in DB only if connection is available
-            if conn and cursor:
-                cursor.execute(
-                    insert_query,
-                    (
-                        text,
-                        classification_data["sentiment"],
-                        ai_response["response_text"],
-                        ai_response["empathy_score"],
-                        classification_data["sarcasm"],
-                        classification_data["emotion"],
-                        f1_score
-                    )
-                )
+        # Classify the distinct texts in one model pass per classifier and generate
+        # one response each; duplicates share the result
+        analyses = analyze_texts(texts, BULK)
+        results = build_batch_results(texts, analyses)
 
-            results.append({
-                "input_text": text,
-                "classification": classification_data,
-                "ai_response": ai_response,
-                "f1_score": f1_score
-            })
-        
-        # Commit and close DB resources if they were opened
-        if conn and cursor:
-            conn.commit()
-            cursor.close()
-            conn.close()
+        # Queue the rows for the database; the writer inserts them in the background
+        persist_batch_results(results)
             
     except Exception as e:
         print(f"Error processing batch: {str(e)}")
         # Continue processing even if DB operations fail
+    finally:
+        ticket.close()
+
+    if response_format == "rows":
+        return jsonify(results), 200
+    body, media_type = encode_results(results, response_format)
+    return Response(body, status=200, mimetype=media_type)
+
+def check_ingest_request(mimetype, content_length):
+    """
+    (error_message, status) for an upload /api/ingest cannot take, else (None, None).
+    """
+    if parser_for(mimetype) is None:
+        return ("Unsupported Content-Type. Use application/json, application/x-ndjson or text/csv.", 415)
+    if content_length is not None and content_length > INGEST_MAX_BYTES:
+        return (f"The upload is larger than {INGEST_MAX_BYTES} bytes.", 413)
+    return (None, None)
+
+def ingest_busy_response():
+    return retry_later("Too many uploads in progress, retry later.", RETRY_AFTER_SECONDS, 503)
+
+def process_ingest_chunk(texts, client):
+    """
+    Analyzes and stores one chunk of an upload; returns its result rows.
+    Pauses first if the upload is running ahead of the client's bulk quota.
+    """
+    time.sleep(admission.charge(client, BULK, len(texts)))
+    results = build_batch_results(texts, analyze_texts(texts, BULK))
+    try:
+        persist_batch_results(results)
+    except Exception as e:
+        print(f"Error storing ingested batch: {str(e)}")
+    return results
 
-    return jsonify(results), 200
+@app.route('/api/ingest', methods=['POST'])
+def ingest_batch():
+    """
+    /api/respond_batch for uploads of any size (see ingest.py).
+    The body (JSON, NDJSON or CSV) is parsed as it is read, analyzed
+    INGEST_CHUNK_TEXTS texts at a time and stored; the response is
+    {"count": n, "seconds": s}. With ?results=rows the respond_batch rows
+    are streamed back as NDJSON while the upload is read, ending with
+    {"done": true, "count": n}.
+    """
+    error_message, status = check_ingest_request(request.mimetype, request.content_length)
+    if error_message:
+        return jsonify({"error": error_message}), status
+    # The number of texts is unknown up front; the quota is charged chunk by chunk
+    ticket, rejection = admit_request(request, BULK, 0)
+    if rejection:
+        return rejection
+    if not ingest_slots.acquire(blocking=False):
+        ticket.close()
+        return ingest_busy_response()
+    client = client_id(request)
+    chunks = iter_chunks(iter_texts(request.stream.read, parser_for(request.mimetype)))
+
+    def finished():
+        ingest_slots.release()
+        ticket.close()
+
+    if request.args.get("results") == "rows":
+        def rows():
+            count = 0
+            try:
+                for texts in chunks:
+                    for result in process_ingest_chunk(texts, client):
+                        yield ndjson_line(result)
+                    count += len(texts)
+                yield ndjson_line({"done": True, "count": count})
+            except Exception as e:
+                print(f"Error ingesting upload: {str(e)}")
+                yield ndjson_line({"error": str(e), "count": count})
+
+        response = Response(stream_with_context(rows()), mimetype="application/x-ndjson")
+        response.call_on_close(finished)
+        return response
+
+    count = 0
+    started = time.perf_counter()
+    try:
+        for texts in chunks:
+            process_ingest_chunk(texts, client)
+            count += len(texts)
+    except IngestError as e:
+        return jsonify({"error": str(e), "count": count}), e.status
+    except Exception as e:
+        print(f"Error ingesting upload: {str(e)}")
+        return jsonify({"error": str(e), "count": count}), 500
+    finally:
+        finished()
+    return jsonify({"count": count, "seconds": round(time.perf_counter() - started, 3)}), 200
 
 @app.route('/batch-analyze', methods=['POST'])
 def batch_analyze():
@@ -372,43 +800,153 @@ def batch_analyze():
             return jsonify({"error": "Field 'text' is required."}), 400
 
         text = payload["text"]
+
+        ticket, rejection = admit_request(request, INTERACTIVE, 1)
+        if rejection:
+            return rejection
         
-        # Classification
-        sentiment_result = classify_sentiment(text)
-        sarcasm_result = detect_sarcasm(text)
-        emotion_result = detect_emotion(text)
-        
-        # Generate response
-        classification_data = {
-            "sentiment": sentiment_result["sentiment"],
-            "sentiment_confidence": sentiment_result["confidence"],
-            "sarcasm": sarcasm_result["sarcasm"],
-            "sarcasm_confidence": sarcasm_result["confidence"],
-            "emotion": emotion_result["emotion"],
-            "emotion_confidence": emotion_result["confidence"]
-        }
-        
-        ai_response = generate_response(text, classification_data)
-        
-        # Calculate F1 score
-        f1_score = compute_f1_score(sentiment_result)
+        # Classification and response, shared with concurrent requests for the same text
+        try:
+            analysis = analyze_texts([text], INTERACTIVE)[0]
+        finally:
+            ticket.close()
         
         # Note: This endpoint doesn't use the database at all, so no changes needed here
         
-        return jsonify({
-            "emotion": emotion_result["emotion"],
-            "sarcasm": "Yes" if sarcasm_result["sarcasm"] else "No",
-            "aspects": "Product quality, Customer service", # Placeholder
-            "classification": sentiment_result["sentiment"],
-            "response": ai_response["response_text"],
-            "originalText": text,
-            "f1Score": f1_score
-        }), 200
+        return jsonify(batch_analysis_result(text, analysis)), 200
         
     except Exception as e:
         print(f"Error in batch analysis: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/batch-analyze/stream', methods=['POST'])
+def batch_analyze_stream():
+    """
+    /batch-analyze as server-sent events, so the response can be shown
+    while Phi-3 is still writing it:
+      event: classification  emotion, sarcasm, aspects, classification, f1Score
+      event: token           {"text": "..."} for each chunk of the response
+      event: done            the full /batch-analyze payload plus timings
+    """
+    payload = request.get_json(force=True, silent=True)
+    if not payload or "text" not in payload:
+        return jsonify({"error": "Field 'text' is required."}), 400
+    ticket, rejection = admit_request(request, INTERACTIVE, 1)
+    if rejection:
+        return rejection
+    analysis = StreamingAnalysis(payload["text"])
+
+    def events():
+        try:
+            yield analysis.prepare()
+            stream = None
+            if analysis.analysis is None:
+                with llm_scheduler.slot(INTERACTIVE):
+                    stream = get_generation_backend().stream(analysis.text, analysis.classification_data)
+                    for chunk in stream:
+                        yield sse_event("token", {"text": chunk})
+            else:
+                yield sse_event("token", {"text": analysis.analysis["ai_response"]["response_text"]})
+            yield analysis.finish(stream)
+        except Exception as e:
+            print(f"Error in streaming analysis: {str(e)}")
+            yield sse_event("error", {"error": str(e)})
+
+    response = Response(stream_with_context(events()), mimetype="text/event-stream", headers=STREAM_HEADERS)
+    response.call_on_close(ticket.close)
+    return response
+
+@app.route('/api/models', methods=['GET'])
+def list_models():
+    """
+    Reports the model version each classifier is serving in this worker,
+    the version published on disk and the versions available for rollback.
+    """
+    return jsonify({
+        "models_dir": model_store.MODELS_DIR,
+        "models": model_store.describe_active_models()
+    }), 200
+
+@app.route('/api/models/<head>/rollback', methods=['POST'])
+def rollback_model(head):
+    """
+    Rolls a classifier back to an earlier model version.
+    JSON payload (optional): {"version": "20241118-153012-4821"}
+    Without a version, the one published before the active version is used.
+    """
+    if head not in model_store.HEADS:
+        return jsonify({"error": f"Unknown model '{head}'."}), 404
+    payload = request.get_json(silent=True) or {}
+    try:
+        version = model_store.rollback(head, payload.get("version"))
+    except (ValueError, FileNotFoundError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"head": head, "active_version": version, "status": "success"}), 200
+
+@app.route('/api/persistence/metrics', methods=['GET'])
+def persistence_metrics():
+    """
+    Write-behind queue depth, flush latency and failure counts for this worker.
+    """
+    write_behind = get_write_behind()
+    if write_behind is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(write_behind.metrics(), enabled=True)), 200
+
+@app.route('/api/response-index/metrics', methods=['GET'])
+def response_index_metrics():
+    """
+    Size, hit rate and lookup latency of the approved-response index in this worker.
+    """
+    response_index = get_response_index()
+    if response_index is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(response_index.metrics(), enabled=True)), 200
+
+@app.route('/api/near-duplicates/metrics', methods=['GET'])
+def near_duplicate_metrics():
+    """
+    How many recent texts were near-duplicates and how many analyses were reused.
+    """
+    near_duplicates = get_near_duplicates()
+    if near_duplicates is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(near_duplicates.metrics(), enabled=True)), 200
+
+@app.route('/api/retention/metrics', methods=['GET'])
+def retention_metrics():
+    """
+    Partitions dropped and rows archived by this worker's retention runs.
+    """
+    retention_manager = get_retention_manager()
+    if retention_manager is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(retention_manager.metrics(), enabled=True)), 200
+
+@app.route('/api/scheduler/metrics', methods=['GET'])
+def scheduler_metrics_endpoint():
+    """
+    Per-queue waits and slot use of the classifier and LLM schedulers, and
+    admission counts, for this worker.
+    """
+    return jsonify(dict(scheduler_metrics(), enabled=True)), 200
+
+@app.route('/api/aspects', methods=['POST'])
+def analyze_aspects():
+    """
+    Aspect-based sentiment for many texts, without response generation.
+    JSON payload example: {"customer_texts": ["...", "..."]}
+    Returns one list of {"aspect", "sentiment", "confidence", "mentions"} per text.
+    """
+    payload = request.get_json(silent=True)
+    if not payload or "customer_texts" not in payload:
+        return jsonify({"error": "Field 'customer_texts' is required."}), 400
+    texts = payload["customer_texts"]
+    if not isinstance(texts, list):
+        return jsonify({"error": "'customer_texts' must be a list of strings."}), 400
+
+    return jsonify(extract_aspects_batch(texts)), 200
+
 @app.route('/api/dashboard', methods=['GET'])
 def view_dashboard():
     """
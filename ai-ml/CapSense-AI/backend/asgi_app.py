@@ -0,0 +1,434 @@
+"""
+asgi_app.py
+Async (ASGI) serving mode for the CapSense API.
+
+Under gunicorn's sync workers every request holds a worker for as long as it
+waits on Phi-3 or on the database, so a handful of slow LLM calls can stall
+the whole worker. This module serves the same API on Quart, an async
+reimplementation of Flask:
+
+  - /api/respond_batch, /api/ingest, /batch-analyze, /batch-analyze/stream
+    and /api/aspects run as coroutines.
+    Phi-3 calls are awaited (httpx when installed, otherwise a worker
+    thread), all responses of a batch are generated concurrently, and at
+    most CAPSENSE_LLM_CONCURRENCY calls are in flight per worker.
+  - Classification is CPU-bound, so it runs on a bounded thread pool
+    (CAPSENSE_CLASSIFY_WORKERS) instead of on the event loop.
+  - LLM calls and classifier passes are handed out by the same schedulers
+    as in app.py, interactive work ahead of bulk work (scheduler.py). A
+    classifier slot is taken before its task is queued on the pool, so the
+    pool's own first-come order never overrides the scheduler.
+  - Database work (pyodbc has no async API) runs on its own bounded pool
+    (CAPSENSE_DB_WORKERS), so a slow login never blocks the event loop.
+  - Every other route (feedback, dashboard, models, static files) is handed
+    to the Flask app in app.py on the DB pool, so both modes share one
+    implementation of them.
+
+Identical texts in flight are coalesced and near-duplicates share one
+analysis as in app.py (coalesce.py, near_duplicates.py).
+
+Run (from backend/):
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000 --workers 2
+    hypercorn asgi_app:app --bind 0.0.0.0:5000
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from quart import Quart, Request, Response, jsonify, request
+from quart.wrappers.request import Body
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+import app as flask_backend
+from classifier_aspect import extract_aspects_batch
+from coalesce import AsyncSingleFlight, dedupe, normalize_text
+from columnar import encode_results
+from near_duplicates import get_near_duplicates
+from generation_backends import get_generation_backend
+from ingest import INGEST_CHUNK_TEXTS, MAX_JSON_BYTES, BodyReader, IngestError, ingest_slots, ndjson_line, parser_for
+from phi3resgen import HTTPX_AVAILABLE
+from scheduler import (BULK, CLASSIFY_SLICE, CLASSIFY_WORKERS, INTERACTIVE, LLM_CONCURRENCY, admission,
+                       admit_request, classify_scheduler, client_id, llm_scheduler)
+
+if HTTPX_AVAILABLE:
+    import httpx
+
+DB_WORKERS = int(os.getenv("CAPSENSE_DB_WORKERS", "16"))
+
+
+
+class ReadAheadBody(Body):
+    """
+    Quart's request body without its up-front Content-Length check, which
+    would refuse any /api/ingest upload over MAX_CONTENT_LENGTH; the routes
+    check the length themselves. The data received but not yet read by the
+    route is still capped at MAX_CONTENT_LENGTH.
+    """
+
+    def __init__(self, expected_content_length, max_content_length):
+        super().__init__(None, max_content_length)
+
+
+class CapSenseRequest(Request):
+    body_class = ReadAheadBody
+
+
+app = Quart(__name__)
+app.request_class = CapSenseRequest
+app.config["MAX_CONTENT_LENGTH"] = MAX_JSON_BYTES
+
+classify_executor = ThreadPoolExecutor(max_workers=CLASSIFY_WORKERS, thread_name_prefix="classify")
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+analysis_flight = AsyncSingleFlight("analysis")
+
+# Created on the serving event loop in startup()
+http_client = None
+
+
+@app.before_serving
+async def startup():
+    global http_client
+    if HTTPX_AVAILABLE:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=LLM_CONCURRENCY, max_keepalive_connections=LLM_CONCURRENCY)
+        )
+    print(f"[ASGI] classify workers={CLASSIFY_WORKERS}, db workers={DB_WORKERS}, "
+          f"llm concurrency={LLM_CONCURRENCY}, async http={'httpx' if http_client else 'threads'}")
+
+
+@app.after_serving
+async def shutdown():
+    if http_client is not None:
+        await http_client.aclose()
+    classify_executor.shutdown(wait=False)
+    db_executor.shutdown(wait=False)
+
+
+@app.after_request
+async def add_cors_headers(response):
+    # Same open CORS policy as flask_cors.CORS(app) in app.py
+    response.headers.setdefault("Access-Control-Allow-Origin", "*")
+    response.headers.setdefault("Access-Control-Allow-Headers", "Content-Type")
+    return response
+
+
+async def run_in(executor, func, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+async def classify_scheduled_async(texts, work_class):
+    """
+    Async counterpart of app.classify_scheduled.
+    """
+    classifications, aspects, reuse = [], [], []
+    for start in range(0, len(texts), CLASSIFY_SLICE):
+        async with classify_scheduler.slot_async(work_class):
+            part = await run_in(classify_executor, flask_backend.classify_slice, texts[start:start + CLASSIFY_SLICE])
+        classifications.extend(part[0])
+        aspects.extend(part[1])
+        reuse.extend(part[2])
+    return classifications, aspects, reuse
+
+
+async def classify_near_duplicates_async(texts, work_class):
+    """
+    Async counterpart of app.classify_near_duplicates.
+    """
+    classifications = []
+    for start in range(0, len(texts), CLASSIFY_SLICE):
+        async with classify_scheduler.slot_async(work_class):
+            classifications.extend(await run_in(classify_executor, flask_backend.classify_texts,
+                                                texts[start:start + CLASSIFY_SLICE]))
+    return classifications
+
+
+async def analyze_texts_async(texts, work_class=BULK):
+    """
+    Async counterpart of app.analyze_texts: same results, but the batch's
+    Phi-3 calls run concurrently and nothing blocks the event loop.
+    """
+    unique_texts, positions = dedupe(texts)
+    near_duplicates = get_near_duplicates()
+    if near_duplicates is None:
+        analyses = await run_pipeline_async(unique_texts, work_class)
+    else:
+        plan = await run_in(classify_executor, near_duplicates.plan, unique_texts)
+        plan.decide(await classify_near_duplicates_async(plan.to_classify, work_class))
+        analyses = plan.complete(await run_pipeline_async(plan.texts, work_class))
+    return [analyses[position] for position in positions]
+
+
+async def run_pipeline_async(unique_texts, work_class):
+    """
+    Async counterpart of app.run_pipeline.
+    """
+    if not unique_texts:
+        return []
+    led = []
+    batch = {}
+
+    def lead(i):
+        # analysis_flight calls this synchronously, and only for the texts this request computes;
+        # their coroutines run after every text of the batch has been led or joined
+        led.append(i)
+        return analyze(i)
+
+    async def batch_results(i):
+        # One classifier pass over the texts this request computes, started by the first of them
+        if "task" not in batch:
+            batch["rows"] = {index: row for row, index in enumerate(led)}
+            batch["task"] = asyncio.ensure_future(
+                classify_scheduled_async([unique_texts[index] for index in led], work_class)
+            )
+        classifications, aspects_per_text, reuse = await batch["task"]
+        row = batch["rows"][i]
+        return classifications[row], aspects_per_text[row], reuse[row]
+
+    async def analyze(i):
+        classification_data, aspects, reuse = await batch_results(i)
+        if reuse:
+            ai_response = flask_backend.reused_responses([reuse])[0]
+        else:
+            async with llm_scheduler.slot_async(work_class):
+                ai_response = await get_generation_backend().generate_async(
+                    unique_texts[i], classification_data, http_client
+                )
+        return {
+            "classification": classification_data,
+            "aspects": aspects,
+            "ai_response": ai_response
+        }
+
+    return list(await asyncio.gather(*(
+        analysis_flight.do(normalize_text(text), lambda i=i: lead(i))
+        for i, text in enumerate(unique_texts)
+    )))
+
+
+@app.route('/api/respond_batch', methods=['POST'])
+async def respond_batch():
+    """
+    Async /api/respond_batch; same payload and response as app.respond_batch.
+    """
+    if request.content_length is not None and request.content_length > MAX_JSON_BYTES:
+        return jsonify({"error": flask_backend.body_too_large_message()}), 413
+    try:
+        payload = await request.get_json(force=True)
+        texts, response_format, error_message = flask_backend.validate_batch_payload(
+            payload, request.args.get("format")
+        )
+        if error_message:
+            return jsonify({"error": error_message}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    ticket, rejection = admit_request(request, BULK, len(texts))
+    if rejection:
+        return rejection
+
+    results = []
+    try:
+        analyses = await analyze_texts_async(texts, BULK)
+        results = flask_backend.build_batch_results(texts, analyses)
+        await run_in(db_executor, flask_backend.persist_batch_results, results)
+    except Exception as e:
+        print(f"Error processing batch: {str(e)}")
+    finally:
+        ticket.close()
+
+    if response_format == "rows":
+        return jsonify(results), 200
+    body, media_type = await run_in(classify_executor, encode_results, results, response_format)
+    return Response(body, status=200, mimetype=media_type)
+
+
+@app.route('/api/ingest', methods=['POST'])
+async def ingest_batch():
+    """
+    Async /api/ingest; same uploads and responses as app.ingest_batch.
+    Quart buffers the body as it arrives rather than applying TCP
+    backpressure, so up to MAX_CONTENT_LENGTH (CAPSENSE_MAX_JSON_BYTES) of
+    unread upload may be held in memory before the upload is cut off.
+    """
+    error_message, status = flask_backend.check_ingest_request(request.mimetype, request.content_length)
+    if error_message:
+        return jsonify({"error": error_message}), status
+    ticket, rejection = admit_request(request, BULK, 0)
+    if rejection:
+        return rejection
+    if not ingest_slots.acquire(blocking=False):
+        ticket.close()
+        return flask_backend.ingest_busy_response()
+    client = client_id(request)
+    reader = BodyReader(parser_for(request.mimetype))
+    body = request.body
+
+    def finished():
+        ingest_slots.release()
+        ticket.close()
+
+    async def process(texts):
+        await asyncio.sleep(admission.charge(client, BULK, len(texts)))
+        results = flask_backend.build_batch_results(texts, await analyze_texts_async(texts, BULK))
+        try:
+            await run_in(db_executor, flask_backend.persist_batch_results, results)
+        except Exception as e:
+            print(f"Error storing ingested batch: {str(e)}")
+        return results
+
+    async def processed_chunks():
+        pending = []
+        async for data in body:
+            pending.extend(reader.feed(data))
+            while len(pending) >= INGEST_CHUNK_TEXTS:
+                texts, pending = pending[:INGEST_CHUNK_TEXTS], pending[INGEST_CHUNK_TEXTS:]
+                yield await process(texts)
+        pending.extend(reader.close())
+        while pending:
+            texts, pending = pending[:INGEST_CHUNK_TEXTS], pending[INGEST_CHUNK_TEXTS:]
+            yield await process(texts)
+
+    if request.args.get("results") == "rows":
+        async def rows():
+            count = 0
+            try:
+                async for results in processed_chunks():
+                    yield "".join(ndjson_line(result) for result in results)
+                    count += len(results)
+                yield ndjson_line({"done": True, "count": count})
+            except Exception as e:
+                print(f"Error ingesting upload: {str(e)}")
+                yield ndjson_line({"error": str(e), "count": count})
+            finally:
+                finished()
+
+        response = Response(rows(), mimetype="application/x-ndjson")
+        response.timeout = None  # the upload takes as long as it takes
+        return response
+
+    count = 0
+    started = time.perf_counter()
+    try:
+        async for results in processed_chunks():
+            count += len(results)
+    except IngestError as e:
+        return jsonify({"error": str(e), "count": count}), e.status
+    except RequestEntityTooLarge:
+        return jsonify({"error": "The upload arrived faster than it could be processed.", "count": count}), 413
+    except Exception as e:
+        print(f"Error ingesting upload: {str(e)}")
+        return jsonify({"error": str(e), "count": count}), 500
+    finally:
+        finished()
+    return jsonify({"count": count, "seconds": round(time.perf_counter() - started, 3)}), 200
+
+
+@app.route('/batch-analyze', methods=['POST'])
+async def batch_analyze():
+    """
+    Async /batch-analyze; same payload and response as app.batch_analyze.
+    """
+    try:
+        payload = await request.get_json(force=True)
+        if not payload or "text" not in payload:
+            return jsonify({"error": "Field 'text' is required."}), 400
+        text = payload["text"]
+        ticket, rejection = admit_request(request, INTERACTIVE, 1)
+        if rejection:
+            return rejection
+        try:
+            analysis = (await analyze_texts_async([text], INTERACTIVE))[0]
+        finally:
+            ticket.close()
+        return jsonify(flask_backend.batch_analysis_result(text, analysis)), 200
+    except Exception as e:
+        print(f"Error in batch analysis: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/batch-analyze/stream', methods=['POST'])
+async def batch_analyze_stream():
+    """
+    Async /batch-analyze/stream; same events as app.batch_analyze_stream,
+    with the Phi-3 tokens relayed as httpx receives them.
+    """
+    payload = await request.get_json(force=True, silent=True)
+    if not payload or "text" not in payload:
+        return jsonify({"error": "Field 'text' is required."}), 400
+    ticket, rejection = admit_request(request, INTERACTIVE, 1)
+    if rejection:
+        return rejection
+    analysis = flask_backend.StreamingAnalysis(payload["text"])
+
+    async def events():
+        try:
+            async with classify_scheduler.slot_async(INTERACTIVE):
+                classified = await run_in(classify_executor, analysis.prepare, flask_backend.classify_slice)
+            yield classified
+            stream = None
+            if analysis.analysis is None:
+                stream = get_generation_backend().stream(analysis.text, analysis.classification_data, http_client)
+                async with llm_scheduler.slot_async(INTERACTIVE):
+                    async for chunk in stream:
+                        yield flask_backend.sse_event("token", {"text": chunk})
+            else:
+                yield flask_backend.sse_event("token", {"text": analysis.analysis["ai_response"]["response_text"]})
+            yield analysis.finish(stream)
+        except Exception as e:
+            print(f"Error in streaming analysis: {str(e)}")
+            yield flask_backend.sse_event("error", {"error": str(e)})
+        finally:
+            ticket.close()
+
+    response = Response(events(), mimetype="text/event-stream", headers=flask_backend.STREAM_HEADERS)
+    response.timeout = None  # the stream lasts as long as the generation
+    return response
+
+
+@app.route('/api/aspects', methods=['POST'])
+async def analyze_aspects():
+    """
+    Async /api/aspects; the classifier pass runs on the classify pool.
+    """
+    payload = await request.get_json(silent=True)
+    if not payload or "customer_texts" not in payload:
+        return jsonify({"error": "Field 'customer_texts' is required."}), 400
+    texts = payload["customer_texts"]
+    if not isinstance(texts, list):
+        return jsonify({"error": "'customer_texts' must be a list of strings."}), 400
+    return jsonify(await run_in(classify_executor, extract_aspects_batch, texts)), 200
+
+
+def call_flask(environ):
+    """
+    Runs one request through the Flask app; returns (body, status, headers).
+    """
+    app_iter, status, headers = run_wsgi_app(flask_backend.app, environ, buffered=True)
+    try:
+        body = b"".join(app_iter)
+    finally:
+        if hasattr(app_iter, "close"):
+            app_iter.close()
+    return body, int(status.split(" ", 1)[0]), headers
+
+
+@app.route('/', defaults={'path': ''}, methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'])
+@app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'])
+async def forward_to_flask(path):
+    """
+    Every route without an async version is served by the Flask app on the
+    DB pool (these are the database-bound and static-file routes).
+    """
+    environ = EnvironBuilder(
+        path=request.path,
+        method=request.method,
+        headers=[(name, value) for name, value in request.headers.items() if name.lower() != "content-length"],
+        data=await request.get_data(),
+        query_string=request.query_string,
+    ).get_environ()
+    body, status, headers = await run_in(db_executor, call_flask, environ)
+    return Response(body, status=status, headers=[(name, value) for name, value in headers.items()
+                                                  if name.lower() != "content-length"])
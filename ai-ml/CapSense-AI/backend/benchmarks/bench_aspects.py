@@ -0,0 +1,114 @@
+"""
+bench_aspects.py
+Throughput of the aspect extractor on a 100k-review corpus.
+
+Measures the lexicon scan alone and the full extraction with per-aspect
+sentiment, and compares the KeywordIndex scan with the naive approach of
+testing every lexicon phrase against every review. --lexicon-size pads the
+lexicon with generated product phrases to show how both scale with it.
+
+Usage (from backend/):
+    python benchmarks/bench_aspects.py
+    python benchmarks/bench_aspects.py --lexicon-size 10000
+    python benchmarks/bench_aspects.py --reviews 100000 --csv reviews.csv --column text
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import classifier_aspect  # noqa: E402
+from classifier_aspect import extract_aspects_batch  # noqa: E402
+
+OPENERS = ["Honestly,", "Well,", "So", "To be fair,", "", "", "Overall,"]
+SUBJECTS = ["the delivery", "the price", "customer service", "the app", "the refund", "my invoice",
+            "the support team", "the product quality", "the website", "the technician", "the checkout"]
+VERDICTS = ["was great", "was terrible", "took forever", "was fine I guess", "is way too expensive",
+            "kept crashing", "was really helpful", "never arrived", "was quick and easy", "was confusing"]
+JOINERS = [" but ", ". ", " and ", ", although "]
+
+
+def synthetic_reviews(count, seed=42):
+    rng = random.Random(seed)
+    reviews = []
+    for _ in range(count):
+        parts = [f"{rng.choice(OPENERS)} {rng.choice(SUBJECTS)} {rng.choice(VERDICTS)}".strip()]
+        for _ in range(rng.randint(0, 2)):
+            parts.append(rng.choice(JOINERS) + f"{rng.choice(SUBJECTS)} {rng.choice(VERDICTS)}")
+        reviews.append("".join(parts) + ".")
+    return reviews
+
+
+def load_reviews(path, column, limit):
+    import pandas as pd
+    data = pd.read_csv(path, usecols=[column], nrows=limit)
+    return data[column].dropna().astype(str).tolist()
+
+
+def padded_lexicon(lexicon, size, seed=7):
+    """
+    Adds generated phrases ("model 4821 charger", ...) until the lexicon holds size phrases.
+    """
+    rng = random.Random(seed)
+    lexicon = {aspect: list(phrases) for aspect, phrases in lexicon.items()}
+    aspects = list(lexicon)
+    nouns = ["charger", "router", "laptop", "licence", "adapter", "headset", "dock", "plan"]
+    total = sum(len(phrases) for phrases in lexicon.values())
+    while total < size:
+        lexicon[aspects[total % len(aspects)]].append(f"model {rng.randint(1000, 99999)} {rng.choice(nouns)}")
+        total += 1
+    return lexicon
+
+
+def naive_scan(texts, lexicon):
+    phrases = [(aspect, phrase.lower()) for aspect, phrases in lexicon.items() for phrase in phrases]
+    hits = 0
+    for text in texts:
+        lowered = text.lower()
+        hits += len({aspect for aspect, phrase in phrases if phrase in lowered})
+    return hits
+
+
+def timed(label, func, count):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<38} {elapsed:8.2f}s  {count / elapsed:12,.0f} reviews/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reviews", type=int, default=100000)
+    parser.add_argument("--csv", help="use reviews from this CSV instead of synthetic ones")
+    parser.add_argument("--column", default="text")
+    parser.add_argument("--lexicon-size", type=int, default=0,
+                        help="pad the lexicon with generated phrases up to this many")
+    args = parser.parse_args()
+
+    lexicon = classifier_aspect.ASPECT_LEXICON
+    if args.lexicon_size:
+        lexicon = padded_lexicon(lexicon, args.lexicon_size)
+        start = time.perf_counter()
+        classifier_aspect.aspect_index = classifier_aspect.build_index(lexicon)
+        print(f"Compiled {args.lexicon_size:,}-phrase index in {time.perf_counter() - start:.2f}s")
+
+    texts = load_reviews(args.csv, args.column, args.reviews) if args.csv else synthetic_reviews(args.reviews)
+    characters = sum(len(text) for text in texts)
+    print(f"{len(texts):,} reviews, {characters / 1e6:.1f}M characters, "
+          f"{len(classifier_aspect.aspect_index):,} lexicon phrases over {len(lexicon)} aspects")
+
+    timed("naive phrase-in-text scan", lambda: naive_scan(texts, lexicon), len(texts))
+    timed("KeywordIndex scan only", lambda: extract_aspects_batch(texts, with_sentiment=False), len(texts))
+    results = timed("scan + per-aspect sentiment", lambda: extract_aspects_batch(texts), len(texts))
+
+    mentioned = sum(len(aspects) for aspects in results)
+    print(f"{mentioned:,} aspect mentions, {mentioned / len(texts):.2f} per review")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+bench_async.py
+How many concurrent clients one worker sustains: sync Flask vs ASGI.
+
+Starts the mock Phi-3 endpoint (benchmarks/mock_phi3.py) with a fixed
+latency, then for each server mode starts one worker:
+
+    sync   gunicorn -w 1 app:app            (the production setup, sync worker)
+    async  uvicorn --workers 1 asgi_app:app
+
+and drives /batch-analyze with N concurrent clients for a fixed time, each
+client sending a distinct text per request (so nothing is coalesced).
+Reports completed requests/s, median and p95 latency, and errors/timeouts.
+
+Needs gunicorn, uvicorn and httpx (pip install gunicorn uvicorn httpx quart).
+
+Usage (from backend/):
+    python benchmarks/bench_async.py
+    python benchmarks/bench_async.py --clients 1,10,50,200 --llm-latency 1.0 --duration 15
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "sync": lambda port: ["gunicorn", "-w", "1", "-k", "sync", "--timeout", "120",
+                          "-b", f"127.0.0.1:{port}", "app:app"],
+    "async": lambda port: [sys.executable, "-m", "uvicorn", "--workers", "1", "--log-level", "warning",
+                           "--host", "127.0.0.1", "--port", str(port), "asgi_app:app"],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_process(command, env):
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_until_up(url, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=2)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.5)
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+async def run_clients(base_url, clients, duration, request_timeout):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client(client_id, http):
+        nonlocal errors
+        sent = 0
+        while time.perf_counter() < deadline:
+            text = f"Client {client_id} request {sent}: my delivery was late and nobody answered."
+            sent += 1
+            start = time.perf_counter()
+            try:
+                response = await http.post(f"{base_url}/batch-analyze", json={"text": text})
+                if response.status_code != 200:
+                    errors += 1
+                    continue
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(timeout=request_timeout, limits=limits) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(i, http) for i in range(clients)))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def report(mode, clients, latencies, errors, elapsed):
+    if latencies:
+        ordered = sorted(latencies)
+        p50 = statistics.median(ordered)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        print(f"{mode:<6} {clients:>7}  {len(latencies) / elapsed:8.1f} req/s  "
+              f"p50 {p50:6.2f}s  p95 {p95:6.2f}s  errors {errors}")
+    else:
+        print(f"{mode:<6} {clients:>7}  no request completed  errors {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", default="1,10,50,200", help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="mock Phi-3 latency in seconds")
+    parser.add_argument("--timeout", type=float, default=30.0, help="client timeout per request")
+    parser.add_argument("--modes", default="sync,async")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.clients.split(",")]
+    mock_port = free_port()
+    env = dict(os.environ,
+               MOCK_PHI3_LATENCY=str(args.llm_latency),
+               MOCK_PHI3_TOKEN_SECONDS="0",
+               PHI3_ENDPOINT=f"http://127.0.0.1:{mock_port}/score",
+               PHI3_KEY="mock-key",
+               CAPSENSE_MODEL_WATCH="0")
+
+    mock = start_process([sys.executable, "-m", "uvicorn", "--log-level", "warning", "--port", str(mock_port),
+                          "--app-dir", os.path.join(BACKEND_DIR, "benchmarks"), "mock_phi3:app"], env)
+    try:
+        wait_until_up(f"http://127.0.0.1:{mock_port}/")
+        print(f"Mock Phi-3 latency {args.llm_latency}s; {args.duration}s per level")
+        print(f"{'mode':<6} {'clients':>7}  {'throughput':>14}  {'latency':>24}")
+        for mode in args.modes.split(","):
+            port = free_port()
+            server = start_process(MODES[mode](port), env)
+            try:
+                base_url = f"http://127.0.0.1:{port}"
+                wait_until_up(f"{base_url}/api/models")
+                for clients in levels:
+                    latencies, errors, elapsed = asyncio.run(
+                        run_clients(base_url, clients, args.duration, args.timeout)
+                    )
+                    report(mode, clients, latencies, errors, elapsed)
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+    finally:
+        mock.terminate()
+        mock.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
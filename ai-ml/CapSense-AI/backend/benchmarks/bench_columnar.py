@@ -0,0 +1,106 @@
+"""
+bench_columnar.py
+Encode time and payload size of the /api/respond_batch response formats.
+
+Builds synthetic respond_batch rows (the same shape app.py returns) and
+times the original row-per-text JSON against the columnar JSON, MessagePack
+and Arrow encodings from columnar.py. Sizes are reported raw and gzipped,
+since responses usually go out compressed.
+
+Usage (from backend/):
+    python benchmarks/bench_columnar.py
+    python benchmarks/bench_columnar.py --texts 50000 --repeat 5
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import columnar  # noqa: E402
+
+SENTIMENTS = ["Positive", "Neutral", "Negative"]
+EMOTIONS = ["anger", "anticipation", "disgust", "joy", "neutral", "sadness"]
+ASPECTS = ["Delivery", "Price", "Customer Service", "App", "Refund"]
+RESPONSES = [
+    "Thank you for your feedback. We're sorry to hear about your experience and will look into it right away.",
+    "We're delighted to hear you enjoyed our service! Thank you for taking the time to share this.",
+    "Thank you for reaching out. We understand your frustration and our team will contact you shortly.",
+]
+
+
+def synthetic_results(count, seed=42):
+    rng = random.Random(seed)
+    results = []
+    for i in range(count):
+        aspects = [
+            {"aspect": aspect, "mentions": [aspect.lower()], "sentiment": rng.choice(SENTIMENTS),
+             "confidence": round(rng.random(), 4)}
+            for aspect in rng.sample(ASPECTS, rng.randint(0, 2))
+        ]
+        results.append({
+            "input_text": f"Review {i}: the delivery was {rng.choice(['late', 'fine', 'great'])} "
+                          f"and the price {rng.choice(['hurt', 'was fair', 'was a bargain'])}.",
+            "classification": {
+                "sentiment": rng.choice(SENTIMENTS),
+                "sentiment_confidence": rng.random(),
+                "sarcasm": rng.random() < 0.1,
+                "sarcasm_confidence": rng.random(),
+                "emotion": rng.choice(EMOTIONS),
+                "emotion_confidence": rng.random(),
+            },
+            "aspects": aspects,
+            "ai_response": {"response_text": rng.choice(RESPONSES), "empathy_score": round(rng.random(), 2)},
+            "f1_score": 0.85,
+        })
+    return results
+
+
+def encode_rows_like_flask(results):
+    # flask.jsonify in production mode: compact separators, keys kept in order
+    return json.dumps(results, separators=(",", ":")).encode("utf-8")
+
+
+def bench(label, encode, results, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = encode(results)
+        best = min(best, time.perf_counter() - start)
+    gzipped = len(gzip.compress(body, compresslevel=6))
+    print(f"{label:<16} {best * 1000:9.1f} ms  {len(body) / 1e6:8.2f} MB  {gzipped / 1e6:8.2f} MB gzip")
+    return len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3, help="best of N runs")
+    args = parser.parse_args()
+
+    results = synthetic_results(args.texts)
+    print(f"{args.texts:,} results; best of {args.repeat}")
+    print(f"{'format':<16} {'encode':>12}  {'size':>11}  {'':>13}")
+
+    baseline = bench("rows (json)", encode_rows_like_flask, results, args.repeat)
+    sizes = {"columnar (json)": bench("columnar (json)", columnar.encode_columnar_json, results, args.repeat)}
+    if columnar.MSGPACK_AVAILABLE:
+        sizes["msgpack"] = bench("msgpack", columnar.encode_msgpack, results, args.repeat)
+    else:
+        print("msgpack          skipped (pip install msgpack)")
+    if columnar.PYARROW_AVAILABLE:
+        sizes["arrow"] = bench("arrow", columnar.encode_arrow, results, args.repeat)
+    else:
+        print("arrow            skipped (pip install pyarrow)")
+
+    for label, size in sizes.items():
+        print(f"{label}: {size / baseline:.0%} of the row format")
+
+
+if __name__ == "__main__":
+    main()
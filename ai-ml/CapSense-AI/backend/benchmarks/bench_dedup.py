@@ -0,0 +1,118 @@
+"""
+bench_dedup.py
+Speed and accuracy of MinHash/LSH near-duplicate detection (near_duplicates.py).
+
+Generates a stream of complaints in which a share are perturbed copies of
+earlier ones (punctuation, casing, a word added or dropped), then assigns
+the stream in batches against a growing history. Reports per-text assign
+time as the history grows next to an exact all-pairs Jaccard scan over
+the same history, and the recall / false-positive rate against the true
+Jaccard similarity of the shingle sets.
+
+Usage (from backend/):
+    python benchmarks/bench_dedup.py
+    python benchmarks/bench_dedup.py --texts 50000 --duplicate-share 0.3
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from near_duplicates import DEDUP_THRESHOLD, NearDuplicateDetector, shingles
+
+WORDS = ("delivery order package refund product invoice support agent app account replacement "
+         "late damaged missing charged twice broken wrong slow rude crashing cancelled waiting "
+         "emails phone tracking weeks days hours nobody answered again still never received").split()
+EXTRA_WORDS = ["really", "again", "honestly", "today", "please", "still"]
+
+
+def new_complaint(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 25)))
+
+
+def perturb(text, rng):
+    words = text.split()
+    change = rng.random()
+    if change < 0.3:
+        words.insert(rng.randrange(len(words) + 1), rng.choice(EXTRA_WORDS))
+    elif change < 0.5 and len(words) > 10:
+        del words[rng.randrange(len(words))]
+    text = " ".join(words)
+    if rng.random() < 0.5:
+        text = text.capitalize() + rng.choice(["!", "!!", ".", "?!"])
+    return text.upper() if rng.random() < 0.2 else text
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=20000)
+    parser.add_argument("--duplicate-share", type=float, default=0.3)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--exact-sample", type=int, default=200,
+                        help="texts per checkpoint checked with an exact all-pairs scan")
+    parser.add_argument("--accuracy-sample", type=float, default=0.02,
+                        help="share of texts whose best match is checked exactly")
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    stream = []
+    for _ in range(args.texts):
+        if stream and rng.random() < args.duplicate_share:
+            stream.append(perturb(rng.choice(stream), rng))
+        else:
+            stream.append(new_complaint(rng))
+
+    detector = NearDuplicateDetector(capacity=args.texts)
+    history_shingles = []
+    checkpoints = {args.texts // 10, args.texts // 2, args.texts}
+    true_positives = false_positives = missed = 0
+
+    print(f"{args.texts} texts, {args.duplicate_share:.0%} perturbed copies, threshold {DEDUP_THRESHOLD}")
+    print(f"{'history':>8}  {'LSH assign/text':>15}  {'exact scan/text':>15}")
+    for offset in range(0, len(stream), args.batch):
+        batch = stream[offset:offset + args.batch]
+        start = time.perf_counter()
+        assignments = detector.assign(batch)
+        lsh_seconds = (time.perf_counter() - start) / len(batch)
+
+        # Accuracy against the exact best Jaccard over the history before each text
+        for text, assignment in zip(batch, assignments):
+            text_shingles = shingles(text)
+            if rng.random() < args.accuracy_sample:
+                best = max((jaccard(text_shingles, other) for other in history_shingles), default=0.0)
+                if assignment.is_duplicate and best >= DEDUP_THRESHOLD:
+                    true_positives += 1
+                elif assignment.is_duplicate and best < DEDUP_THRESHOLD - 0.1:
+                    false_positives += 1   # MinHash estimates within 0.1 of the threshold are expected
+                elif not assignment.is_duplicate and best >= DEDUP_THRESHOLD:
+                    missed += 1
+            history_shingles.append(text_shingles)
+
+        seen = offset + len(batch)
+        if any(offset < checkpoint <= seen for checkpoint in checkpoints):
+            sample = stream[seen - min(args.exact_sample, len(batch)):seen]
+            start = time.perf_counter()
+            for text in sample:
+                text_shingles = shingles(text)
+                max(jaccard(text_shingles, other) for other in history_shingles)
+            exact_seconds = (time.perf_counter() - start) / len(sample)
+            print(f"{seen:>8}  {lsh_seconds * 1000:13.3f}ms  {exact_seconds * 1000:13.3f}ms")
+
+    found = true_positives + missed
+    if found:
+        print(f"Sampled accuracy: recall {true_positives / found:.1%} ({true_positives}/{found}), "
+              f"false positives {false_positives}")
+    print(detector.metrics())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+bench_empathy.py
+Response post-processing per text vs in batch (phi3resgen.py).
+
+On a corpus of synthetic responses, or the ResponseText column of --csv:
+
+    empathy     the former per-text scan (each phrase tested with `in`)
+                against score_empathy_batch (one automaton pass over the
+                whole batch), checked for identical scores
+    fallback    generate_fallback_response per item against
+                generate_fallback_responses, with INFO logging on as in
+                production
+
+then prints the per-phrase hit breakdown that score_empathy_batch returns
+alongside the scores. Exits with status 1 if any score differs.
+
+Usage (from backend/):
+    python benchmarks/bench_empathy.py
+    python benchmarks/bench_empathy.py --responses 200000 --csv responses.csv
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import phi3resgen
+from keyword_index import AHOCORASICK_AVAILABLE
+from phi3resgen import (EMPATHY_PHRASES, generate_fallback_response, generate_fallback_responses,
+                        score_empathy_batch)
+
+OPENINGS = ("Thank you for reaching out about order {i}.", "We're sorry to hear about ticket {i}.",
+            "Hi, thanks for the feedback on case {i}.", "We apologize for the trouble with invoice {i}.")
+MIDDLES = ("We understand how frustrating the delay must be.", "Your concern is important to us.",
+           "Our team will resolve this right away.", "We appreciate your patience while we look into it.",
+           "A replacement has been shipped.", "The refund was issued today.", "We value your business.")
+CLOSINGS = ("Let us know if we can help with anything else.", "Feel free to reply to this email.",
+            "Our agents are happy to assist.", "")
+
+
+def make_corpus(count, seed=5):
+    rng = random.Random(seed)
+    return [" ".join([rng.choice(OPENINGS).format(i=i)] + rng.sample(MIDDLES, rng.randint(0, 3))
+                     + [rng.choice(CLOSINGS)]).strip() for i in range(count)]
+
+
+def per_text_score(response_text):
+    # The scan calculate_empathy_score did before score_empathy_batch
+    score = 0.5
+    length = len(response_text)
+    if 50 <= length <= 200:
+        score += 0.2
+    elif length > 200:
+        score += 0.1
+    response_lower = response_text.lower()
+    phrase_count = sum(1 for phrase in EMPATHY_PHRASES if phrase in response_lower)
+    score += min(0.3, phrase_count * 0.05)
+    return round(min(max(score, 0), 1), 2)
+
+
+def timed(func, repeat=3):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--responses", type=int, default=50000)
+    parser.add_argument("--csv", help="CSV with a ResponseText or response_text column to score instead")
+    args = parser.parse_args()
+
+    if args.csv:
+        frame = pd.read_csv(args.csv)
+        column = next(c for c in ("ResponseText", "response_text") if c in frame.columns)
+        texts = [str(text) for text in frame[column].fillna("")][:args.responses]
+    else:
+        texts = make_corpus(args.responses)
+    print(f"{len(texts)} responses; matcher {'pyahocorasick' if AHOCORASICK_AVAILABLE else 'pure Python'}")
+
+    per_text_seconds, expected = timed(lambda: [per_text_score(text) for text in texts])
+    batch_seconds, (scores, hits) = timed(lambda: score_empathy_batch(texts))
+    mismatches = sum(1 for a, b in zip(expected, scores) if a != b)
+    print(f"{'empathy':<9} per text {per_text_seconds:7.3f}s   batch {batch_seconds:7.3f}s "
+          f"({per_text_seconds / batch_seconds:.2f}x)   scores differ {mismatches}")
+
+    # The fallback path logs at INFO, so the per-item logging is part of its cost
+    items = [(text, {"sentiment": random.choice(("Positive", "Negative", "Neutral")),
+                     "emotion": random.choice(("anger", "joy", "sadness", "fear")),
+                     "sarcasm": random.random() < 0.1}) for text in texts]
+    handler_levels = [(handler, handler.level) for handler in logging.getLogger().handlers]
+    for handler, _ in handler_levels:
+        # Keep the records flowing through logging but off the terminal
+        handler.setLevel(logging.CRITICAL)
+    try:
+        single_seconds, _ = timed(lambda: [generate_fallback_response(*item) for item in items])
+        batched_seconds, _ = timed(lambda: generate_fallback_responses(items))
+    finally:
+        for handler, level in handler_levels:
+            handler.setLevel(level)
+    print(f"{'fallback':<9} per item {single_seconds:7.3f}s   batch {batched_seconds:7.3f}s "
+          f"({single_seconds / batched_seconds:.2f}x)   logger level {logging.getLevelName(phi3resgen.logger.getEffectiveLevel())}")
+
+    totals = {}
+    responses_with = {}
+    for text_hits in hits:
+        for phrase, occurrences in text_hits.items():
+            totals[phrase] = totals.get(phrase, 0) + occurrences
+            responses_with[phrase] = responses_with.get(phrase, 0) + 1
+    print("phrase hits")
+    for phrase in sorted(EMPATHY_PHRASES, key=lambda p: -totals.get(p, 0)):
+        print(f"  {phrase:<12} {totals.get(phrase, 0):>8} occurrences in {responses_with.get(phrase, 0):>8} responses")
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
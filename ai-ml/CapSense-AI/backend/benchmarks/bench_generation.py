@@ -0,0 +1,112 @@
+"""
+bench_generation.py
+Latency and throughput of the response generation backends (generation_backends.py).
+
+For each backend it generates responses for the same synthetic feedback:
+
+    one by one    median and p95 latency of generate()
+    batch         texts per second of one generate_batch() call
+
+The remote backend runs against the mock Phi-3 endpoint
+(benchmarks/mock_phi3.py) with a fixed latency, so it measures the
+network-bound path without Azure. The local backend needs
+llama-cpp-python and a GGUF model (--model); it is skipped otherwise.
+The template backend is the floor.
+
+Usage (from backend/):
+    python benchmarks/bench_generation.py
+    python benchmarks/bench_generation.py --model models/Phi-3-mini-4k-instruct-q4.gguf --threads 8 --instances 2
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_async import BACKEND_DIR, free_port, start_process, wait_until_up
+
+TEXTS = [
+    "My order arrived two weeks late and nobody answered my emails.",
+    "The replacement part was the wrong size again, very frustrating.",
+    "Great service, the agent solved my problem in five minutes!",
+    "Oh wonderful, another invoice charged twice. Just what I needed.",
+    "The app keeps crashing whenever I try to track my delivery.",
+    "I am happy with the product but the packaging was damaged.",
+]
+CLASSIFICATIONS = [
+    {"sentiment": "Negative", "emotion": "anger", "sarcasm": False},
+    {"sentiment": "Negative", "emotion": "sadness", "sarcasm": False},
+    {"sentiment": "Positive", "emotion": "joy", "sarcasm": False},
+    {"sentiment": "Negative", "emotion": "anger", "sarcasm": True},
+    {"sentiment": "Negative", "emotion": "fear", "sarcasm": False},
+    {"sentiment": "Neutral", "emotion": "neutral", "sarcasm": False},
+]
+
+
+def items(count):
+    return [(TEXTS[i % len(TEXTS)], CLASSIFICATIONS[i % len(TEXTS)]) for i in range(count)]
+
+
+def measure(name, backend, count):
+    latencies = []
+    for text, classification_data in items(count):
+        start = time.perf_counter()
+        backend.generate(text, classification_data)
+        latencies.append(time.perf_counter() - start)
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    start = time.perf_counter()
+    backend.generate_batch(items(count))
+    batch_seconds = time.perf_counter() - start
+    print(f"{name:<10} {1000 * statistics.median(ordered):10.1f}ms {1000 * p95:10.1f}ms "
+          f"{count / batch_seconds:12.2f}/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=16, help="responses per measurement")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="mock Phi-3 latency in seconds")
+    parser.add_argument("--model", help="GGUF model for the local backend")
+    parser.add_argument("--threads", type=int, help="threads per local model instance")
+    parser.add_argument("--instances", type=int, default=1, help="local model instances")
+    parser.add_argument("--max-tokens", type=int, default=150)
+    args = parser.parse_args()
+
+    import generation_backends
+
+    print(f"{args.count} responses per measurement")
+    print(f"{'backend':<10} {'p50':>12} {'p95':>12} {'batch':>13}")
+    measure("template", generation_backends.TemplateBackend(), args.count)
+
+    mock_port = free_port()
+    env = dict(os.environ, MOCK_PHI3_LATENCY=str(args.llm_latency), MOCK_PHI3_TOKEN_SECONDS="0")
+    mock = start_process([sys.executable, "-m", "uvicorn", "--log-level", "warning", "--port", str(mock_port),
+                          "--app-dir", os.path.join(BACKEND_DIR, "benchmarks"), "mock_phi3:app"], env)
+    try:
+        wait_until_up(f"http://127.0.0.1:{mock_port}/")
+        os.environ["PHI3_ENDPOINT"] = f"http://127.0.0.1:{mock_port}/score"
+        os.environ["PHI3_KEY"] = "mock-key"
+        measure("remote", generation_backends.RemoteBackend(), args.count)
+    finally:
+        mock.terminate()
+        mock.wait(timeout=30)
+
+    if not args.model:
+        print("local      skipped (pass --model with a GGUF file)")
+    elif not generation_backends.LLAMA_CPP_AVAILABLE:
+        print("local      skipped (pip install llama-cpp-python)")
+    else:
+        threads = args.threads or max(1, (os.cpu_count() or 1) // args.instances)
+        backend = generation_backends.LocalBackend(args.model, instances=args.instances, threads=threads,
+                                                   max_tokens=args.max_tokens)
+        print(f"local model loaded in {backend.load_seconds:.1f}s ({args.instances} x {threads} threads)")
+        measure("local", backend, args.count)
+
+
+if __name__ == "__main__":
+    main()
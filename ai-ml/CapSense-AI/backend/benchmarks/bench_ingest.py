@@ -0,0 +1,141 @@
+"""
+bench_ingest.py
+Peak memory of one large upload: /api/respond_batch vs the streaming /api/ingest.
+
+For each server mode (sync gunicorn, async uvicorn; see bench_async.py) and
+each endpoint it starts a fresh worker, warms it up with a small batch and
+then uploads the same N synthetic texts:
+
+    /api/respond_batch   one JSON body, one JSON array of results
+    /api/ingest          the same JSON body sent chunked as it is generated,
+                         a summary in response (results are stored)
+
+and reports the upload size, the time taken and the worker's peak resident
+memory (VmHWM) before and after the upload. Responses come from the template
+backend, so the numbers are about parsing and buffering, not Phi-3.
+
+Needs Linux (/proc), gunicorn, uvicorn and httpx.
+
+Usage (from backend/):
+    python benchmarks/bench_ingest.py
+    python benchmarks/bench_ingest.py --texts 200000 --text-bytes 400
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_async import MODES, free_port, start_process, wait_until_up
+
+WORDS = ("delivery late refund broken package agent helpful rude invoice charged twice app crash "
+         "replacement wrong size waited weeks happy great service support email answer").split()
+
+
+def make_text(i, text_bytes):
+    words = []
+    length = 0
+    while length < text_bytes:
+        word = WORDS[(i * 7 + len(words) * 13) % len(WORDS)]
+        words.append(word)
+        length += len(word) + 1
+    return f"Ticket {i}: " + " ".join(words)
+
+
+def json_body_parts(count, text_bytes):
+    yield b'{"customer_texts": ['
+    for i in range(count):
+        yield (", " if i else "").encode() + json.dumps(make_text(i, text_bytes)).encode()
+    yield b"]}"
+
+
+def worker_pid(pid):
+    """
+    The process serving requests: gunicorn's single worker, or the server itself.
+    """
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = f.read().split()
+    except OSError:
+        children = []
+    return int(children[0]) if children else pid
+
+
+def peak_rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def upload_respond_batch(base_url, count, text_bytes, timeout):
+    body = b"".join(json_body_parts(count, text_bytes))
+    response = httpx.post(f"{base_url}/api/respond_batch", content=body,
+                          headers={"Content-Type": "application/json"}, timeout=timeout)
+    response.raise_for_status()
+    return len(body), len(response.json())
+
+
+def upload_ingest(base_url, count, text_bytes, timeout):
+    sent = 0
+
+    def parts():
+        nonlocal sent
+        for part in json_body_parts(count, text_bytes):
+            sent += len(part)
+            yield part
+
+    response = httpx.post(f"{base_url}/api/ingest", content=parts(),
+                          headers={"Content-Type": "application/json"}, timeout=timeout)
+    response.raise_for_status()
+    return sent, response.json()["count"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=50000, help="texts per upload")
+    parser.add_argument("--text-bytes", type=int, default=300, help="approximate length of each text")
+    parser.add_argument("--timeout", type=float, default=1800.0)
+    parser.add_argument("--modes", default="sync,async")
+    args = parser.parse_args()
+
+    env = dict(os.environ,
+               CAPSENSE_GENERATION_BACKEND="template",
+               CAPSENSE_MODEL_WATCH="0",
+               CAPSENSE_DEDUP="0",
+               CAPSENSE_REUSE_RESPONSES="0",
+               # Let respond_batch take the whole upload so the two can be compared
+               CAPSENSE_MAX_JSON_BYTES=str(4 * 1024 * 1024 * 1024))
+
+    print(f"{args.texts} texts of ~{args.text_bytes} bytes per upload")
+    print(f"{'mode':<6} {'endpoint':<19} {'upload':>9} {'results':>8} {'seconds':>8} "
+          f"{'peak RSS before':>16} {'after':>9}")
+    for mode in args.modes.split(","):
+        for endpoint, upload in (("/api/respond_batch", upload_respond_batch), ("/api/ingest", upload_ingest)):
+            port = free_port()
+            server = start_process(MODES[mode](port), env)
+            try:
+                base_url = f"http://127.0.0.1:{port}"
+                wait_until_up(f"{base_url}/api/models")
+                upload(base_url, 100, args.text_bytes, args.timeout)
+                pid = worker_pid(server.pid)
+                before = peak_rss_mb(pid)
+                start = time.perf_counter()
+                sent, results = upload(base_url, args.texts, args.text_bytes, args.timeout)
+                seconds = time.perf_counter() - start
+                after = peak_rss_mb(pid)
+                print(f"{mode:<6} {endpoint:<19} {sent / 1024 / 1024:7.1f}MB {results:>8} {seconds:8.1f} "
+                      f"{before:14.0f}MB {after:7.0f}MB")
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
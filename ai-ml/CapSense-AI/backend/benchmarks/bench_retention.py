@@ -0,0 +1,153 @@
+"""
+bench_retention.py
+Startup and retention cost: one flat FeedbackResponses table with DELETE vs
+the monthly partitions of retention.py, on the SQLite stand-in (db_fallback.py).
+
+Both databases get the same N rows spread over --months months. Then:
+
+    startup     the old initialize_database (SELECT COUNT(*) + DELETE of
+                every row) vs ensure_partitions (metadata only)
+    retention   DELETE of the rows older than --keep months vs
+                RetentionManager.run (archive each expired month, then
+                DROP TABLE), with the time spent dropping shown apart
+
+and checks that the archives hold exactly the rows that left the table.
+SQLite only hints at the gap on SQL Server, where a large DELETE is fully
+logged and locks the table while TRUNCATE/MERGE of a partition is a
+metadata change.
+
+Usage (from backend/):
+    python benchmarks/bench_retention.py
+    python benchmarks/bench_retention.py --rows 2000000 --months 24 --keep 12
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_fallback import COLUMNS, SqlitePartitions, sqlite_datetime
+from retention import PYARROW_AVAILABLE, RetentionManager, add_months, ensure_partitions, month_start
+
+INSERT_QUERY = """
+INSERT INTO FeedbackResponses
+    (CustomerText, Sentiment, ResponseText, EmpathyScore, SarcasmDetected, Emotion, F1Score, CreatedAt)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+"""
+
+
+def make_rows(count, months, now, seed=7):
+    rng = random.Random(seed)
+    first = add_months(month_start(now), -months + 1)
+    span = (now - first).total_seconds()
+    for i in range(count):
+        created = first + timedelta(seconds=rng.uniform(0, span))
+        yield (f"Ticket {i}: the delivery was late and the box was damaged.", rng.choice(["Negative", "Positive"]),
+               "We are sorry to hear about your experience.", round(rng.random(), 3), rng.randint(0, 1),
+               rng.choice(["anger", "joy", "sadness"]), round(rng.random(), 3), sqlite_datetime(created))
+
+
+def fill(conn, rows, batch=50000):
+    batch_rows = []
+    for row in rows:
+        batch_rows.append(row)
+        if len(batch_rows) == batch:
+            conn.executemany(INSERT_QUERY, batch_rows)
+            batch_rows = []
+    if batch_rows:
+        conn.executemany(INSERT_QUERY, batch_rows)
+    conn.commit()
+
+
+class TimedDrops:
+    """
+    A partition store that adds up the time spent dropping partitions.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.drop_seconds = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def drop(self, partition):
+        start = time.perf_counter()
+        self.store.drop(partition)
+        self.drop_seconds += time.perf_counter() - start
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=500000)
+    parser.add_argument("--months", type=int, default=24, help="months the rows are spread over")
+    parser.add_argument("--keep", type=int, default=12, help="months kept by retention")
+    args = parser.parse_args()
+
+    now = datetime.now()
+    workdir = tempfile.mkdtemp(prefix="bench-retention-")
+    try:
+        flat_path = os.path.join(workdir, "flat.db")
+        flat = sqlite3.connect(flat_path)
+        flat.execute(f"CREATE TABLE FeedbackResponses ({', '.join(f'{n} {d}' for n, d in COLUMNS)});")
+        flat.execute("CREATE INDEX IX_FeedbackResponses_CreatedAt ON FeedbackResponses (CreatedAt);")
+        fill(flat, make_rows(args.rows, args.months, now))
+
+        store = SqlitePartitions(os.path.join(workdir, "partitioned.db"))
+        store.ensure(now, history=args.months - 1)
+        partitioned = store.connect()
+        fill(partitioned, make_rows(args.rows, args.months, now))
+        partitioned.close()
+        print(f"{args.rows} rows over {args.months} months, keeping {args.keep}; "
+              f"archives as {'parquet' if PYARROW_AVAILABLE else 'csv.gz'}")
+
+        cutoff = sqlite_datetime(add_months(month_start(now), -args.keep))
+        expected = flat.execute("SELECT COUNT(*) FROM FeedbackResponses WHERE CreatedAt < ?;", (cutoff,)).fetchone()[0]
+
+        def flat_retention():
+            deleted = flat.execute("DELETE FROM FeedbackResponses WHERE CreatedAt < ?;", (cutoff,)).rowcount
+            flat.commit()
+            return deleted
+
+        timed_store = TimedDrops(store)
+        manager = RetentionManager(timed_store, retention_months=args.keep, archive_dir=os.path.join(workdir, "archive"))
+        flat_seconds, deleted = timed(flat_retention)
+        partition_seconds, dropped = timed(lambda: manager.run(now))
+        archived = sum(rows for _, rows in dropped)
+        archive_bytes = sum(os.path.getsize(path) for path, _ in dropped if path)
+        print(f"{'retention':<10} flat DELETE {flat_seconds:8.2f}s ({deleted} rows)")
+        print(f"{'':<10} partitions  {partition_seconds:8.2f}s ({len(dropped)} partitions; "
+              f"{timed_store.drop_seconds:.3f}s dropping, the rest archiving {archived} rows "
+              f"to {archive_bytes / 1024 / 1024:.1f}MB)")
+        if deleted != expected or archived != expected:
+            raise RuntimeError(f"expected {expected} rows to leave the table, got {deleted} / {archived}")
+
+        def old_startup():
+            count = flat.execute("SELECT COUNT(*) FROM FeedbackResponses;").fetchone()[0]
+            if count > 0:
+                flat.execute("DELETE FROM FeedbackResponses;")
+                flat.commit()
+
+        flat_seconds, _ = timed(old_startup)
+        partition_seconds, _ = timed(lambda: ensure_partitions(store, now))
+        print(f"{'startup':<10} flat COUNT+DELETE {flat_seconds:8.2f}s   ensure_partitions {partition_seconds:8.3f}s")
+        flat.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+bench_reuse.py
+Hit rate and lookup cost of the approved-response index (response_index.py).
+
+Builds a synthetic corpus of approved feedback from complaint templates,
+then queries it with a stream where a share of the texts are near-duplicates
+of approved ones (reworded, reordered, extra filler) and the rest are new
+complaints. For each threshold it reports the index build time, lookup
+latency per text, the hit rate and the false-hit rate (a near-duplicate
+matched to the wrong complaint, or a new complaint matched at all), and the
+effective response latency when every miss costs one simulated LLM call.
+
+Uses the emotion classifier's vectorizer from models/ and its
+preprocess_text, as app.py does.
+
+Usage (from backend/):
+    python benchmarks/bench_reuse.py
+    python benchmarks/bench_reuse.py --corpus 20000 --queries 5000 --thresholds 0.6,0.7,0.8,0.9,0.95
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import joblib
+
+from classifier_emotion import preprocess_text
+from response_index import ResponseIndex
+
+SUBJECTS = ["my order", "the delivery", "the package", "my refund", "the product", "the invoice",
+            "customer service", "the app", "my account", "the replacement"]
+PROBLEMS = ["arrived two weeks late", "was damaged when it arrived", "never showed up",
+            "was charged twice", "stopped working after a day", "was missing several items",
+            "took forever to process", "was completely wrong", "keeps crashing on login",
+            "was cancelled without any notice"]
+FOLLOWUPS = ["and nobody answered my emails", "and the support line kept me waiting for an hour",
+             "and I had to ask three times for an update", "and the tracking page showed nothing",
+             "and the agent was rude to me", "and I still have not received any refund"]
+FILLER = ["honestly", "really", "again", "today", "please help", "this is frustrating"]
+
+
+def complaint(rng):
+    return rng.choice(SUBJECTS), rng.choice(PROBLEMS), rng.choice(FOLLOWUPS)
+
+
+def render(parts):
+    subject, problem, followup = parts
+    return f"{subject.capitalize()} {problem} {followup}."
+
+
+def paraphrase(parts, rng):
+    subject, problem, followup = parts
+    text = f"{subject} {problem} {followup}"
+    if rng.random() < 0.5:
+        text = f"{rng.choice(FILLER)}, {text}"
+    if rng.random() < 0.5:
+        text = f"{text} {rng.choice(FILLER)}"
+    return text.upper() if rng.random() < 0.2 else text
+
+
+def build_corpus(size, rng):
+    """
+    (entry_id, customer_text, response_text, sentiment) items and the
+    complaint each was made from; one response per distinct complaint.
+    """
+    corpus, parts_per_entry = [], []
+    for entry_id in range(size):
+        parts = complaint(rng)
+        customer_text = f"{render(parts)} Order #{rng.randint(10000, 99999)}."
+        corpus.append((entry_id, customer_text, "Response to: " + " / ".join(parts), "negative"))
+        parts_per_entry.append(parts)
+    return corpus, parts_per_entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=int, default=5000, help="approved responses in the index")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--duplicate-share", type=float, default=0.6,
+                        help="share of queries that reword an approved text")
+    parser.add_argument("--thresholds", default="0.6,0.7,0.8,0.9,0.95")
+    parser.add_argument("--llm-latency", type=float, default=1.5, help="simulated Phi-3 latency in seconds")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vectorizer = joblib.load(os.path.join(BACKEND_DIR, "models", "emotion_vectorizer.pkl"))
+    corpus, parts_per_entry = build_corpus(args.corpus, rng)
+
+    queries, expected = [], []
+    for _ in range(args.queries):
+        if rng.random() < args.duplicate_share:
+            entry_id = rng.randrange(len(corpus))
+            queries.append(paraphrase(parts_per_entry[entry_id], rng))
+            expected.append(corpus[entry_id][2])
+        else:
+            queries.append(f"I wanted to say {rng.choice(FILLER)} that {rng.choice(SUBJECTS)} "
+                           f"is fine but {rng.choice(SUBJECTS)} could be better")
+            expected.append(None)
+
+    print(f"Corpus {args.corpus} approved responses, {args.queries} queries "
+          f"({args.duplicate_share:.0%} near-duplicates), simulated LLM latency {args.llm_latency}s")
+    print(f"{'threshold':>9}  {'build':>8}  {'lookup/text':>11}  {'hit rate':>8}  {'false hits':>10}  "
+          f"{'avg latency':>11}")
+    for threshold in [float(t) for t in args.thresholds.split(",")]:
+        index = ResponseIndex(vectorizer, threshold, preprocess_text)
+        start = time.perf_counter()
+        index.add_many(corpus)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        matches = []
+        for offset in range(0, len(queries), 64):
+            chunk = queries[offset:offset + 64]
+            matches.extend(index.lookup_batch(chunk, ["negative"] * len(chunk)))
+        lookup_seconds = (time.perf_counter() - start) / len(queries)
+
+        hits = sum(match is not None for match in matches)
+        false_hits = sum(match is not None and match.response_text != wanted
+                         for match, wanted in zip(matches, expected))
+        misses = len(queries) - hits
+        avg_latency = lookup_seconds + args.llm_latency * misses / len(queries)
+        print(f"{threshold:>9.2f}  {build_seconds * 1000:6.0f}ms  {lookup_seconds * 1000:9.3f}ms  "
+              f"{hits / len(queries):8.1%}  {false_hits / len(queries):10.1%}  {avg_latency:10.3f}s")
+
+
+if __name__ == "__main__":
+    main()
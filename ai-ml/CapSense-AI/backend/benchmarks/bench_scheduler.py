@@ -0,0 +1,114 @@
+"""
+bench_scheduler.py
+Interactive latency while a bulk batch is running: one shared queue vs the
+weighted scheduler of scheduler.py.
+
+A bulk thread analyzes a large batch (as /api/respond_batch would) while an
+interactive thread analyzes one text at a time (as /batch-analyze would).
+Phi-3 is replaced by a backend that sleeps --llm-ms per response, with
+--llm-slots responses in flight at most, so the numbers are about queueing,
+not the model. Modes:
+
+    fifo    interactive work queued behind bulk work, first come first served
+            (the behaviour without scheduler.py)
+    fair    the default weights, interactive 8 : bulk 1
+
+For each mode it reports the interactive latency percentiles, the scheduler's
+per-queue waits and how long the bulk batch took.
+
+Usage (from backend/):
+    python benchmarks/bench_scheduler.py
+    python benchmarks/bench_scheduler.py --bulk-texts 2000 --llm-ms 50 --llm-slots 8
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("CAPSENSE_MODEL_WATCH", "0")
+os.environ.setdefault("CAPSENSE_DEDUP", "0")
+os.environ.setdefault("CAPSENSE_REUSE_RESPONSES", "0")
+os.environ.setdefault("CAPSENSE_GENERATION_BACKEND", "template")
+
+import app
+import generation_backends
+from phi3resgen import generate_fallback_response
+from scheduler import BULK, CLASSIFY_WORKERS, INTERACTIVE, WEIGHTS, FairScheduler
+
+
+class SlowBackend(generation_backends.RemoteBackend):
+    """
+    The remote backend's batching with a fixed delay standing in for a Phi-3 call.
+    """
+    name = "slow"
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def generate(self, customer_text, classification_data):
+        time.sleep(self.seconds)
+        return generate_fallback_response(customer_text, classification_data)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run(mode, args):
+    weights = WEIGHTS if mode == "fair" else {INTERACTIVE: 1.0, BULK: 1.0}
+    app.classify_scheduler = FairScheduler("classify", CLASSIFY_WORKERS, weights)
+    app.llm_scheduler = FairScheduler("llm", args.llm_slots, weights)
+    # Without the scheduler interactive work joins the same queue as bulk work
+    interactive_class = INTERACTIVE if mode == "fair" else BULK
+
+    bulk_texts = [f"Order {i}: the parcel arrived late and the box was damaged." for i in range(args.bulk_texts)]
+    bulk_seconds = {}
+
+    def bulk():
+        start = time.perf_counter()
+        app.analyze_texts(bulk_texts, BULK)
+        bulk_seconds["total"] = time.perf_counter() - start
+
+    bulk_thread = threading.Thread(target=bulk)
+    bulk_thread.start()
+    time.sleep(0.2)  # let the batch fill the queues
+
+    latencies = []
+    for i in range(args.interactive):
+        if not bulk_thread.is_alive():
+            break
+        start = time.perf_counter()
+        app.analyze_texts([f"Support call {mode} {i}: the agent was very helpful, thanks!"], interactive_class)
+        latencies.append(time.perf_counter() - start)
+    bulk_thread.join()
+
+    waits = app.llm_scheduler.metrics()["queues"]
+    if latencies:
+        print(f"{mode:<5} interactive p50 {1000 * percentile(latencies, 0.5):8.0f}ms  "
+              f"p95 {1000 * percentile(latencies, 0.95):8.0f}ms  ({len(latencies)} requests)   "
+              f"bulk batch {bulk_seconds['total']:6.1f}s")
+    print(f"{'':<5} llm queue wait p95: " + ", ".join(
+        f"{work_class} {waits[work_class]['wait_p95_ms']}ms" for work_class in (INTERACTIVE, BULK)
+        if waits[work_class]["granted"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bulk-texts", type=int, default=1000)
+    parser.add_argument("--interactive", type=int, default=30, help="interactive requests per mode")
+    parser.add_argument("--llm-ms", type=float, default=40.0, help="simulated Phi-3 latency")
+    parser.add_argument("--llm-slots", type=int, default=4, help="responses generated at once")
+    args = parser.parse_args()
+
+    generation_backends._backend = SlowBackend(args.llm_ms / 1000)
+    print(f"bulk batch of {args.bulk_texts} texts, {args.llm_slots} LLM slots of {args.llm_ms:.0f}ms")
+    for mode in ("fifo", "fair"):
+        run(mode, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+bench_stream.py
+Time to first byte of /batch-analyze vs the streaming /batch-analyze/stream.
+
+Starts the mock Phi-3 endpoint (benchmarks/mock_phi3.py) with a fixed
+time to first token and per-token delay, then for each server mode
+(sync gunicorn, async uvicorn; see bench_async.py) sends the same texts
+one at a time to both endpoints and reports the median of:
+
+    first byte    the first bytes of the HTTP response body
+    first token   the first "token" event (stream only)
+    complete      the whole response (the "done" event for the stream)
+
+Needs gunicorn, uvicorn and httpx (pip install gunicorn uvicorn httpx quart).
+
+Usage (from backend/):
+    python benchmarks/bench_stream.py
+    python benchmarks/bench_stream.py --requests 20 --llm-latency 0.8 --token-seconds 0.04
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_async import BACKEND_DIR, MODES, free_port, start_process, wait_until_up
+
+
+def time_plain(base_url, text, timeout):
+    start = time.perf_counter()
+    first_byte = None
+    with httpx.stream("POST", f"{base_url}/batch-analyze", json={"text": text}, timeout=timeout) as response:
+        for _ in response.iter_bytes():
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+    return first_byte, None, time.perf_counter() - start
+
+
+def time_stream(base_url, text, timeout):
+    start = time.perf_counter()
+    first_byte = first_token = None
+    with httpx.stream("POST", f"{base_url}/batch-analyze/stream", json={"text": text}, timeout=timeout) as response:
+        for line in response.iter_lines():
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            if first_token is None and line == "event: token":
+                first_token = time.perf_counter() - start
+            if line == "event: error":
+                raise RuntimeError("stream reported an error")
+    return first_byte, first_token, time.perf_counter() - start
+
+
+def median_ms(values):
+    values = [value for value in values if value is not None]
+    return f"{1000 * statistics.median(values):8.0f}ms" if values else f"{'-':>10}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=10, help="texts per endpoint and mode")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="mock time to first token in seconds")
+    parser.add_argument("--token-seconds", type=float, default=0.04, help="mock delay between tokens")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--modes", default="sync,async")
+    args = parser.parse_args()
+
+    mock_port = free_port()
+    env = dict(os.environ,
+               MOCK_PHI3_LATENCY=str(args.llm_latency),
+               MOCK_PHI3_TOKEN_SECONDS=str(args.token_seconds),
+               PHI3_ENDPOINT=f"http://127.0.0.1:{mock_port}/score",
+               PHI3_KEY="mock-key",
+               CAPSENSE_MODEL_WATCH="0",
+               CAPSENSE_DEDUP="0")
+
+    mock = start_process([sys.executable, "-m", "uvicorn", "--log-level", "warning", "--port", str(mock_port),
+                          "--app-dir", os.path.join(BACKEND_DIR, "benchmarks"), "mock_phi3:app"], env)
+    try:
+        wait_until_up(f"http://127.0.0.1:{mock_port}/")
+        print(f"Mock Phi-3: first token after {args.llm_latency}s, then {args.token_seconds}s per token; "
+              f"median of {args.requests} requests")
+        print(f"{'mode':<6} {'endpoint':<22} {'first byte':>10} {'first token':>11} {'complete':>10}")
+        for mode in args.modes.split(","):
+            port = free_port()
+            server = start_process(MODES[mode](port), env)
+            try:
+                base_url = f"http://127.0.0.1:{port}"
+                wait_until_up(f"{base_url}/api/models")
+                for endpoint, measure in (("/batch-analyze", time_plain), ("/batch-analyze/stream", time_stream)):
+                    timings = [measure(base_url, f"Request {i}: my parcel arrived late and the box was damaged.",
+                                       args.timeout)
+                               for i in range(args.requests)]
+                    first_bytes, first_tokens, totals = zip(*timings)
+                    print(f"{mode:<6} {endpoint:<22} {median_ms(first_bytes)} {median_ms(first_tokens):>11} "
+                          f"{median_ms(totals)}")
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+    finally:
+        mock.terminate()
+        mock.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+check_fused_parity.py
+Checks that the fused kernel (fused_classifier.py) gives exactly sklearn's
+answers, and times it against the per-head path.
+
+On a corpus of synthetic feedback plus edge cases (blank, unknown words,
+repeated words, punctuation only, non-ASCII), or the texts of --csv:
+
+    sklearn     each head's labels and predict_proba from the active models
+                against FusedClassifier.predict, compared for exact equality
+    heads       classify_sentiment_batch / detect_sarcasm_batch /
+                detect_emotion_batch with and without the fused scores
+    logistic    the same comparison with the sentiment and sarcasm heads
+                replaced by LogisticRegression models fitted here on the
+                naive Bayes labels, for the coef_/intercept_ path
+
+then times the three per-head calls against the fused call, with and
+without the emotion head's NLTK preprocessing, which both paths share.
+Exits with status 1 on any mismatch.
+
+Usage (from backend/):
+    python benchmarks/check_fused_parity.py
+    python benchmarks/check_fused_parity.py --texts 20000 --csv feedback.csv
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LogisticRegression
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("CAPSENSE_MODEL_WATCH", "0")
+
+from classifier_emotion import detect_emotion_batch
+from classifier_sarcasm import detect_sarcasm_batch
+from classifier_sentiment import classify_sentiment_batch
+from fused_classifier import HEAD_INPUTS, HEADS, FusedClassifier
+import model_store
+
+WORDS = ("delivery late refund broken package agent helpful rude invoice charged twice app crash "
+         "replacement wrong size waited weeks happy great service support email answer love terrible "
+         "oh sure fantastic another delay exactly what needed thanks nothing works again amazing").split()
+
+EDGE_CASES = ["", "   ", "!!!", "the and of", "zzzz qqqq xxyyzz", "great great great great great",
+              "Ünïcödé façade café naïve", "12345 67890", "a b c d", "The SERVICE was Excellent!!!"]
+
+
+def make_corpus(count, seed=11):
+    rng = random.Random(seed)
+    texts = list(model_store.WARMUP_TEXTS) + EDGE_CASES
+    while len(texts) < count:
+        texts.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 40))))
+    return texts[:count]
+
+
+def compare(name, expected_labels, expected, labels, probabilities):
+    """
+    Prints and returns the number of rows that differ at all.
+    """
+    label_mismatches = int(np.sum(np.asarray(expected_labels) != np.asarray(labels)))
+    exact = np.asarray(expected) == np.asarray(probabilities)
+    rows = int(np.sum(~exact.all(axis=1)))
+    max_diff = float(np.max(np.abs(np.asarray(expected, dtype=np.float64) - probabilities))) if len(exact) else 0.0
+    status = "ok" if label_mismatches == 0 and rows == 0 else "MISMATCH"
+    print(f"  {name:<22} labels differ {label_mismatches:>6}   probabilities differ {rows:>6} "
+          f"(max {max_diff:.3g})   {status}")
+    return label_mismatches + rows
+
+
+def check_sklearn(fused, heads, texts):
+    predicted = fused.predict(texts)
+    mismatches = 0
+    for name, model, vectorizer, prepare in heads:
+        X = vectorizer.transform([prepare(text) for text in texts])
+        mismatches += compare(name, model.predict(X), model.predict_proba(X),
+                              predicted[name].labels, predicted[name].probabilities)
+    return mismatches
+
+
+def timed(func, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=5000)
+    parser.add_argument("--csv", help="CSV with a customer_text, text or feedback column to check instead")
+    args = parser.parse_args()
+
+    if args.csv:
+        frame = pd.read_csv(args.csv)
+        column = next(c for c in ("customer_text", "text", "feedback") if c in frame.columns)
+        texts = [str(text) for text in frame[column].fillna("")][:args.texts]
+    else:
+        texts = make_corpus(args.texts)
+
+    snapshots = {head: model_store.ACTIVE_MODELS[head].get() for head in HEADS}
+    heads = [(head, model, vectorizer, HEAD_INPUTS[head]) for head, (model, vectorizer, _) in snapshots.items()]
+    fused = FusedClassifier(heads)
+    print(f"{len(texts)} texts; {len(fused.groups)} analyzers, {fused.n_features} fused features, "
+          f"{fused.weights.shape[1]} scores")
+
+    print("sklearn")
+    mismatches = check_sklearn(fused, heads, texts)
+
+    print("heads")
+    predicted = fused.predict(texts)
+    for name, batch in (("sentiment", classify_sentiment_batch), ("sarcasm", detect_sarcasm_batch),
+                        ("emotion", detect_emotion_batch)):
+        expected_labels, expected = batch(texts)
+        labels, probabilities = batch(texts, predicted[name])
+        mismatches += compare(name, expected_labels, expected, labels, probabilities)
+
+    print("logistic")
+    logistic_heads = []
+    for name, model, vectorizer, prepare in heads:
+        if name != "emotion":
+            X = vectorizer.transform([prepare(text) for text in texts])
+            model = LogisticRegression(max_iter=200).fit(X, model.predict(X))
+        logistic_heads.append((name, model, vectorizer, prepare))
+    mismatches += check_sklearn(FusedClassifier(logistic_heads), logistic_heads, texts)
+
+    def per_head():
+        classify_sentiment_batch(texts)
+        detect_sarcasm_batch(texts)
+        detect_emotion_batch(texts)
+
+    def fused_heads():
+        scores = fused.predict(texts)
+        classify_sentiment_batch(texts, scores["sentiment"])
+        detect_sarcasm_batch(texts, scores["sarcasm"])
+        detect_emotion_batch(texts, scores["emotion"])
+
+    per_head_seconds = timed(per_head)
+    fused_seconds = timed(fused_heads)
+    # NLTK's preprocess_text for the emotion head costs the same on both paths
+    preprocess_seconds = timed(lambda: [HEAD_INPUTS["emotion"](text) for text in texts])
+    print(f"per head {per_head_seconds:7.3f}s   fused {fused_seconds:7.3f}s ({per_head_seconds / fused_seconds:.2f}x); "
+          f"without the {preprocess_seconds:.3f}s of emotion preprocessing "
+          f"{(per_head_seconds - preprocess_seconds) / (fused_seconds - preprocess_seconds):.2f}x")
+
+    if mismatches:
+        print(f"{mismatches} mismatches")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
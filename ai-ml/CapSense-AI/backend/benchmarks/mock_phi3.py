@@ -0,0 +1,83 @@
+"""
+mock_phi3.py
+A stand-in for the Azure AI Foundry Phi-3 endpoint, for benchmarks.
+
+Answers every POST after a fixed delay with a short response in the same
+shape as the real endpoint ({"output": "..."}), so generate_response can run
+unchanged against it. It is a plain ASGI app and sleeps with asyncio, so a
+single process can hold thousands of slow requests open at once.
+
+A request with "stream": true (as sent by generate_response_stream) is
+answered with server-sent events instead: the first token after
+MOCK_PHI3_LATENCY, then one OpenAI-style delta chunk per word every
+MOCK_PHI3_TOKEN_SECONDS, then "data: [DONE]". A plain request waits for
+the same generation time (latency plus every token) before answering.
+
+Usage (from backend/):
+    MOCK_PHI3_LATENCY=1.0 MOCK_PHI3_TOKEN_SECONDS=0.03 uvicorn benchmarks.mock_phi3:app --port 8901
+    PHI3_ENDPOINT=http://127.0.0.1:8901/score PHI3_KEY=mock python app.py
+"""
+
+import asyncio
+import json
+import os
+
+LATENCY_SECONDS = float(os.getenv("MOCK_PHI3_LATENCY", "1.0"))
+TOKEN_SECONDS = float(os.getenv("MOCK_PHI3_TOKEN_SECONDS", "0.03"))
+
+RESPONSE_TEXT = ("Thank you for your feedback. We're sorry to hear about your experience "
+                 "and we appreciate you letting us know; our team will help resolve it.")
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    # Read the request body
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    try:
+        stream = bool(json.loads(body or b"{}").get("stream"))
+    except ValueError:
+        stream = False
+
+    await asyncio.sleep(LATENCY_SECONDS)
+    if stream:
+        await send_stream(send)
+        return
+    await asyncio.sleep(TOKEN_SECONDS * (len(RESPONSE_TEXT.split(" ")) - 1))
+    body = json.dumps({"output": RESPONSE_TEXT}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_stream(send):
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")],
+    })
+    words = RESPONSE_TEXT.split(" ")
+    for i, word in enumerate(words):
+        if i:
+            await asyncio.sleep(TOKEN_SECONDS)
+        chunk = {"choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}}]}
+        await send({"type": "http.response.body", "body": f"data: {json.dumps(chunk)}\n\n".encode(),
+                    "more_body": True})
+    await send({"type": "http.response.body", "body": b"data: [DONE]\n\n"})
@@ -0,0 +1,152 @@
+"""
+classifier_aspect.py
+Aspect-based sentiment: which aspects of the service a piece of feedback
+talks about (delivery, price, customer service, ...) and how the customer
+feels about each one.
+
+Aspects come from a lexicon mapping each aspect to its keywords and phrases
+(aspect_lexicon.json, or the file named by CAPSENSE_ASPECT_LEXICON). All
+phrases are compiled into one KeywordIndex at startup, so each text is
+scanned once no matter how large the lexicon is. The sentiment of an aspect
+is the sentiment classifier's verdict on the clauses that mention it, and
+all clauses of a batch are classified in a single call.
+"""
+
+import bisect
+import json
+import os
+import re
+
+from classifier_sentiment import classify_sentiment_batch
+from keyword_index import KeywordIndex
+
+LEXICON_PATH = os.getenv("CAPSENSE_ASPECT_LEXICON") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "aspect_lexicon.json"
+)
+
+# Sentence ends and contrast words start a new clause:
+# "Delivery was fast but the price is too high" -> two clauses, two sentiments
+CLAUSE_BREAK = re.compile(r"[.!?;\n]+|,?\s+\b(?:but|however|although|though|whereas|yet)\b")
+
+
+def load_lexicon(path=LEXICON_PATH):
+    """
+    Returns {aspect: [phrase, ...]} from a JSON lexicon file.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        lexicon = json.load(f)
+    if not isinstance(lexicon, dict):
+        raise ValueError("Aspect lexicon must map aspect names to lists of phrases.")
+    return {aspect: [str(phrase) for phrase in phrases] for aspect, phrases in lexicon.items()}
+
+
+def build_index(lexicon):
+    """
+    Compiles the lexicon into a KeywordIndex of phrase -> aspects using it.
+    """
+    phrase_aspects = {}
+    for aspect, phrases in lexicon.items():
+        for phrase in phrases:
+            aspects = phrase_aspects.setdefault(phrase.lower(), [])
+            if aspect not in aspects:
+                aspects.append(aspect)
+    return KeywordIndex({phrase: tuple(aspects) for phrase, aspects in phrase_aspects.items()})
+
+
+try:
+    ASPECT_LEXICON = load_lexicon()
+    print(f"Loaded {len(ASPECT_LEXICON)} aspects from {LEXICON_PATH}")
+except Exception as e:
+    print(f"Warning: Failed to load aspect lexicon from {LEXICON_PATH}: {str(e)}")
+    ASPECT_LEXICON = {}
+
+aspect_index = build_index(ASPECT_LEXICON)
+
+
+def find_aspect_mentions(text, with_clauses=True):
+    """
+    Scans one text. Returns {aspect: {"mentions": [...], "clauses": [...]}}
+    in order of appearance, where clauses are the lowercased clauses that
+    mention the aspect (only computed when with_clauses is True).
+    """
+    matches = aspect_index.find_all(text)
+    if not matches:
+        return {}
+
+    found = {}
+    for start, _, phrase, aspects in matches:
+        for aspect in aspects:
+            entry = found.get(aspect)
+            if entry is None:
+                entry = found[aspect] = {"mentions": [], "starts": []}
+            if phrase not in entry["mentions"]:
+                entry["mentions"].append(phrase)
+            entry["starts"].append(start)
+
+    if not with_clauses:
+        return {aspect: {"mentions": entry["mentions"]} for aspect, entry in found.items()}
+
+    # Clause i spans lowered[starts[i]:ends[i]]
+    lowered = text.lower()
+    starts, ends = [0], []
+    for boundary in CLAUSE_BREAK.finditer(lowered):
+        ends.append(boundary.start())
+        starts.append(boundary.end())
+    ends.append(len(lowered))
+
+    mentions = {}
+    for aspect, entry in found.items():
+        clause_ids = sorted({bisect.bisect_right(starts, start) - 1 for start in entry["starts"]})
+        mentions[aspect] = {
+            "mentions": entry["mentions"],
+            "clauses": [lowered[starts[i]:ends[i]].strip() for i in clause_ids],
+        }
+    return mentions
+
+
+def extract_aspects_batch(texts, with_sentiment=True):
+    """
+    Returns, for each text, a list like
+    [{"aspect": "Delivery", "sentiment": "Negative", "confidence": 0.91,
+      "mentions": ["late", "delivery"]}, ...]
+    All aspect clauses of the batch go through the sentiment classifier in
+    one call. With with_sentiment=False only the lexicon scan runs.
+    """
+    per_text = []
+    clause_texts = []
+    for text in texts:
+        text = text if isinstance(text, str) else str(text)
+        aspects = []
+        for aspect, entry in find_aspect_mentions(text, with_clauses=with_sentiment).items():
+            aspects.append({"aspect": aspect, "mentions": entry["mentions"]})
+            if with_sentiment:
+                clause_texts.append(" ".join(entry["clauses"]))
+        per_text.append(aspects)
+
+    if with_sentiment and clause_texts:
+        labels, probabilities = classify_sentiment_batch(clause_texts)
+        confidences = probabilities.max(axis=1)
+        position = 0
+        for aspects in per_text:
+            for aspect in aspects:
+                aspect["sentiment"] = labels[position]
+                aspect["confidence"] = round(float(confidences[position]), 4)
+                position += 1
+
+    return per_text
+
+
+def extract_aspects(text):
+    return extract_aspects_batch([text])[0]
+
+
+def format_aspects(aspects):
+    """
+    One-line summary for the UI, e.g. "Delivery (Negative), Price (Positive)".
+    """
+    if not aspects:
+        return "No specific aspects detected"
+    return ", ".join(
+        f"{aspect['aspect']} ({aspect['sentiment']})" if "sentiment" in aspect else aspect["aspect"]
+        for aspect in aspects
+    )
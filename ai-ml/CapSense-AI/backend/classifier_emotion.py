@@ -1,42 +1,84 @@
-import joblib
 import os
+import numpy as np
 import nltk
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 
+import model_store
+
 # Ensure NLTK data is available
 nltk.download('punkt')
 nltk.download('stopwords')
 
-# Load model and vectorizer
-BASE_DIR = '/home/azureuser/Capgemini_SentimentApp_Remake/backend/models'
+# Models folder is configurable through CAPSENSE_MODEL_DIR (see model_store.py)
+BASE_DIR = model_store.MODELS_DIR
 MODEL_PATH = os.path.join(BASE_DIR, 'emotion_classifier.pkl')
 VECTORIZER_PATH = os.path.join(BASE_DIR, 'emotion_vectorizer.pkl')
 
-try:
-    model = joblib.load(MODEL_PATH)
-    vectorizer = joblib.load(VECTORIZER_PATH)
-except Exception as e:
-    print(f"[Emotion Classifier] Failed to load model or vectorizer: {e}")
-    model, vectorizer = None, None
+_stop_words = None
 
 def preprocess_text(text):
-    stop_words = set(stopwords.words('english'))
+    # Build the stopword set once instead of once per text
+    global _stop_words
+    if _stop_words is None:
+        _stop_words = set(stopwords.words('english'))
     words = word_tokenize(text.lower())
-    return ' '.join([word for word in words if word.isalnum() and word not in stop_words])
+    return ' '.join([word for word in words if word.isalnum() and word not in _stop_words])
+
+def warm_up(model, vectorizer):
+    processed = [preprocess_text(text) for text in model_store.WARMUP_TEXTS]
+    model.predict_proba(vectorizer.transform(processed))
+
+# Load the published version, or the legacy pickles if none exists yet.
+# Requests read the model through active_model so it can be hot-swapped.
+active_model = model_store.register_active(
+    "emotion",
+    *model_store.load_initial("emotion", MODEL_PATH, VECTORIZER_PATH),
+    warm_up=warm_up
+)
 
 def detect_emotion(text):
     """
-    Returns: {"emotion": label, "confidence": 0.8} or fallback.
+    Returns: {"emotion": label, "confidence": float} or fallback.
     """
+    model, vectorizer, _ = active_model.get()
     if not model or not vectorizer:
         return {"emotion": "neutral", "confidence": 0.5}
-    
+
+    labels, probabilities = detect_emotion_batch([text])
+    return {"emotion": labels[0], "confidence": float(probabilities[0].max())}
+
+def detect_emotion_batch(texts, scores=None):
+    """
+    Detects emotions for a list of texts with one predict_proba call.
+    Returns (labels, probabilities) where probabilities is a float32 array of
+    shape (len(texts), n_classes) ordered like model.classes_ and each label
+    is the argmax of its row.
+    scores, the HeadScores of the fused kernel for these texts (see
+    fused_classifier.py), replaces the predict_proba call.
+    """
+    model, vectorizer, _ = active_model.get()
+    if scores is not None:
+        model = scores.model
+    if not model or not vectorizer:
+        return ["neutral"] * len(texts), np.full((len(texts), 1), 0.5, dtype=np.float32)
+
+    classes = model.classes_
+    labels = ["neutral"] * len(texts)
+    probabilities = np.zeros((len(texts), len(classes)), dtype=np.float32)
+    neutral = np.flatnonzero(classes == "neutral")
+    probabilities[:, neutral] = 0.5
+
     try:
-        processed = preprocess_text(text)
-        X = vectorizer.transform([processed])
-        prediction = model.predict(X)[0]
-        return {"emotion": prediction, "confidence": 0.8}
+        if scores is None:
+            processed = [preprocess_text(str(text)) for text in texts]
+            X = vectorizer.transform(processed)
+            batch_proba = model.predict_proba(X).astype(np.float32, copy=False)
+        else:
+            batch_proba = scores.probabilities.astype(np.float32, copy=False)
+        probabilities[:] = batch_proba
+        labels = [str(label) for label in classes[batch_proba.argmax(axis=1)]]
     except Exception as e:
         print(f"[Emotion Classifier] Error: {e}")
-        return {"emotion": "neutral", "confidence": 0.5}
+
+    return labels, probabilities
@@ -5,14 +5,11 @@ plus an optional local Naive Bayes fallback stored in 'models/'.
 """
 
 import os
-import joblib
-import pandas as pd
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.naive_bayes import MultinomialNB
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
+import numpy as np
 from transformers import pipeline
 
+import model_store
+
 # Initialize Hugging Face pipeline
 try:
     sarcasm_detector = pipeline("text-classification", model="cardiffnlp/twitter-roberta-base-irony")
@@ -21,136 +18,123 @@ except Exception as e:
     print(f"Warning: Failed to initialize Hugging Face pipeline: {str(e)}")
     sarcasm_detector = None
 
-# Define the base directory for models using absolute path
-BASE_DIR = '/home/azureuser/Capgemini_SentimentApp_Remake/backend/models'
+# Models folder is configurable through CAPSENSE_MODEL_DIR (see model_store.py)
+BASE_DIR = model_store.MODELS_DIR
 MODEL_PATH = os.path.join(BASE_DIR, "sarcasm_classifier.pkl")
 VECTORIZER_PATH = os.path.join(BASE_DIR, "sarcasm_vectorizer.pkl")
 
-model = None
-vectorizer = None
-try:
-    if os.path.exists(MODEL_PATH) and os.path.exists(VECTORIZER_PATH):
-        model = joblib.load(MODEL_PATH)
-        vectorizer = joblib.load(VECTORIZER_PATH)
-        print(f"Loaded local sarcasm model from {MODEL_PATH}")
-        print(f"Loaded local sarcasm vectorizer from {VECTORIZER_PATH}")
-    else:
-        print(f"Warning: Local sarcasm model not found at {MODEL_PATH} or {VECTORIZER_PATH}")
-except Exception as e:
-    print(f"Warning: Failed to load local sarcasm model: {str(e)}")
-    model, vectorizer = None, None
+
+def warm_up(model, vectorizer):
+    model.predict_proba(vectorizer.transform(model_store.WARMUP_TEXTS))
+
+# Load the published version, or the legacy pickles if none exists yet.
+# Requests read the model through active_model so it can be hot-swapped.
+active_model = model_store.register_active(
+    "sarcasm",
+    *model_store.load_initial("sarcasm", MODEL_PATH, VECTORIZER_PATH),
+    warm_up=warm_up
+)
 
 
 def detect_sarcasm(text):
     """
     Returns {"sarcasm": bool, "confidence": float}
     """
-    # Access global variables
-    global model, vectorizer, sarcasm_detector
-    
-    # Make sure text is a string
-    try:
-        if isinstance(text, (int, float)) or hasattr(text, 'dtype'):  # Handle numpy types
-            text = str(text)
-        
-        text = text.strip()
-        if not text:
-            return {"sarcasm": False, "confidence": 0.0}
-    except Exception as e:
-        print(f"Error converting input to string: {e}")
-        return {"sarcasm": False, "confidence": 0.0}
-    
+    labels, probabilities = detect_sarcasm_batch([text])
+    return {"sarcasm": labels[0], "confidence": float(probabilities[0, 1])}
+
+def detect_sarcasm_batch(texts, scores=None):
+    """
+    Detects sarcasm for a list of texts in one model pass.
+    Returns (labels, probabilities): a list of bools and a float32 array of
+    shape (len(texts), 2) holding [P(not sarcastic), P(sarcastic)] per text.
+    The labels are the argmax of that same matrix, so predict_proba runs once
+    instead of predict followed by predict_proba.
+    scores, the HeadScores of the fused kernel for these texts (see
+    fused_classifier.py), replaces the local model pass.
+    """
+    # One snapshot per batch: a concurrent hot-swap cannot mix versions
+    model, vectorizer, _ = active_model.get()
+    if scores is not None:
+        model = scores.model
+
+    labels = [False] * len(texts)
+    probabilities = np.zeros((len(texts), 2), dtype=np.float32)
+    probabilities[:, 0] = 1.0
+
+    # Make sure every text is a string; blank texts stay non-sarcastic
+    cleaned = []
+    for text in texts:
+        try:
+            if isinstance(text, (int, float)) or hasattr(text, 'dtype'):  # Handle numpy types
+                text = str(text)
+            cleaned.append(text.strip())
+        except Exception as e:
+            print(f"Error converting input to string: {e}")
+            cleaned.append("")
+    rows = [i for i, text in enumerate(cleaned) if text]
+    if not rows:
+        return labels, probabilities
+    batch = [cleaned[i] for i in rows]
+
     # Try the local model first
     if model and vectorizer:
         try:
-            # Vectorize the text
-            text_vectorized = vectorizer.transform([text])
-            
-            # Predict with the model
-            pred_label = model.predict(text_vectorized)[0]
-            confidence = float(model.predict_proba(text_vectorized)[0][1])  # Probability of class 1
-            
-            return {"sarcasm": bool(pred_label == 1), "confidence": confidence}
+            if scores is None:
+                text_vectorized = vectorizer.transform(batch)
+                batch_proba = model.predict_proba(text_vectorized).astype(np.float32, copy=False)
+            else:
+                batch_proba = scores.probabilities[rows].astype(np.float32, copy=False)
+            sarcastic_column = int(np.flatnonzero(model.classes_ == 1)[0])
+            predicted = model.classes_[batch_proba.argmax(axis=1)]
+            probabilities[rows, 1] = batch_proba[:, sarcastic_column]
+            probabilities[rows, 0] = 1.0 - batch_proba[:, sarcastic_column]
+            for i, pred_label in zip(rows, predicted):
+                labels[i] = bool(pred_label == 1)
+            return labels, probabilities
         except Exception as e:
             print(f"Error using local sarcasm model: {str(e)}")
             # Fall through to Hugging Face if local model fails
-    
+
     # Use Hugging Face pipeline as backup
     if sarcasm_detector:
         try:
-            result = sarcasm_detector(text)[0]
-            label = result["label"]
-            score = float(result["score"])
-            is_sarcastic = (label.upper() == "IRONY") # Note: This model uses "IRONY" rather than "SARCASM"
-            return {"sarcasm": is_sarcastic, "confidence": score}
+            for i, result in zip(rows, sarcasm_detector(batch)):
+                score = float(result["score"])
+                is_sarcastic = (result["label"].upper() == "IRONY") # Note: This model uses "IRONY" rather than "SARCASM"
+                # Express the score as P(sarcastic) like the local model does
+                p_sarcastic = score if is_sarcastic else 1.0 - score
+                labels[i] = is_sarcastic
+                probabilities[i] = (1.0 - p_sarcastic, p_sarcastic)
+            return labels, probabilities
         except Exception as e:
             print(f"Error using Hugging Face sarcasm model: {str(e)}")
-    
+
     # Fallback if both methods fail
-    return {"sarcasm": False, "confidence": 0.5}
+    probabilities[rows] = (0.5, 0.5)
+    return labels, probabilities
 
 def train_sarcasm_model(dataset_path="sarcasm_dataset.csv"):
     """
-    Writes the trained model/vectorizer to the 'models/' folder.
+    Streams the dataset through train_models.train_head and publishes the
+    result as a new version under 'models/sarcasm/'.
     """
-    if not os.path.exists(dataset_path):
-        return {"error": f"Dataset file '{dataset_path}' not found."}
-
-    # Try different encodings
-    encodings_to_try = ['utf-8', 'latin1', 'cp1252', 'ISO-8859-1']
-    data = None
-    
-    for encoding in encodings_to_try:
-        try:
-            print(f"Trying to read with {encoding} encoding...")
-            data = pd.read_csv(dataset_path, encoding=encoding)
-            print(f"Successfully read with {encoding} encoding")
-            break
-        except UnicodeDecodeError:
-            print(f"Failed to read with {encoding} encoding")
-            continue
-    
-    if data is None:
-        return {"error": "Could not read the dataset with any of the attempted encodings."}
-
-    if "text" not in data.columns or "label" not in data.columns:
-        # Try to guess columns if standard names aren't found
-        print("Standard columns 'text' and 'label' not found. Available columns:")
-        for col in data.columns:
-            print(f"  {col}")
-        return {"error": "Dataset must have 'text' and 'label' columns."}
-
-    data = data.dropna(subset=["text", "label"])
-    data = data[data["text"].str.strip() != ""]
-
-    X = data["text"]
-    y = data["label"]
-
-    global model, vectorizer
-    vectorizer = CountVectorizer(stop_words="english")
-    X_vectorized = vectorizer.fit_transform(X)
-
-    X_train, X_test, y_train, y_test = train_test_split(
-        X_vectorized, y, test_size=0.2, random_state=42
-    )
-
-    model = MultinomialNB()
-    model.fit(X_train, y_train)
-
-    y_pred = model.predict(X_test)
-    accuracy = accuracy_score(y_test, y_pred)
-    precision = precision_score(y_test, y_pred, pos_label=1)
-    recall = recall_score(y_test, y_pred, pos_label=1)
-    f1 = f1_score(y_test, y_pred, pos_label=1)
-
-    os.makedirs(BASE_DIR, exist_ok=True)
-    joblib.dump(model, MODEL_PATH)
-    joblib.dump(vectorizer, VECTORIZER_PATH)
+    from train_models import train_head
+
+    report = train_head("sarcasm", dataset_path)
+    if "error" in report:
+        return report
+
+    model, vectorizer, _ = model_store.load_version("sarcasm", report["version"])
+    active_model.publish(model, vectorizer, report["version"])
 
     return {
         "message": "Sarcasm model trained successfully",
-        "accuracy": float(accuracy),
-        "precision": float(precision),
-        "recall": float(recall),
-        "f1_score": float(f1)
-    }
\ No newline at end of file
+        "version": report["version"],
+        "accuracy": report["accuracy"],
+        "precision": report["precision"],
+        "recall": report["recall"],
+        "f1_score": report["f1_score"],
+        "rows_per_second": report["rows_per_second"],
+        "peak_memory_mb": report["peak_memory_mb"]
+    }
@@ -1,38 +1,32 @@
 import os
-import joblib
 import numpy as np
 
-# Define the base directory for models using absolute path
-BASE_DIR = '/home/azureuser/Capgemini_SentimentApp_Remake/backend/models'
+import model_store
+
+# Models folder is configurable through CAPSENSE_MODEL_DIR (see model_store.py)
+BASE_DIR = model_store.MODELS_DIR
 MODEL_PATH = os.path.join(BASE_DIR, "sentiment_classifier.pkl")
 # changed it from ...sentiment_vectorizer.pkl to just 'vectorizer.pkl' though i don't know if theres training in there
 
 VECTORIZER_PATH = os.path.join(BASE_DIR, "vectorizer.pkl")
 
-# Initialize model and vectorizer as None
-model = None
-vectorizer = None
+def warm_up(model, vectorizer):
+    model.predict_proba(vectorizer.transform(model_store.WARMUP_TEXTS))
 
-# Try to load the model and vectorizer if they exist
-try:
-    if os.path.exists(MODEL_PATH) and os.path.exists(VECTORIZER_PATH):
-        model = joblib.load(MODEL_PATH)
-        vectorizer = joblib.load(VECTORIZER_PATH)
-        print(f"Loaded sentiment model from {MODEL_PATH}")
-        print(f"Loaded sentiment vectorizer from {VECTORIZER_PATH}")
-    else:
-        print(f"Warning: Local sentiment model not found at {MODEL_PATH} or {VECTORIZER_PATH}")
-except Exception as e:
-    print(f"Warning: Failed to load local sentiment model: {str(e)}")
-    model, vectorizer = None, None
+# Load the published version, or the legacy pickles if none exists yet.
+# Requests read the model through active_model so it can be hot-swapped.
+active_model = model_store.register_active(
+    "sentiment",
+    *model_store.load_initial("sentiment", MODEL_PATH, VECTORIZER_PATH),
+    warm_up=warm_up
+)
 
 def classify_sentiment(text):
     """
     Returns a dict like {"sentiment": "Positive", "confidence": 0.85} or similar.
     If local model is not available, provides a basic fallback.
     """
-    # Access the global model and vectorizer
-    global model, vectorizer
+    model, vectorizer, _ = active_model.get()
     
     # Make sure text is a string
     try:
@@ -52,36 +46,94 @@ def classify_sentiment(text):
         }
         
     if model and vectorizer:
+        labels, probabilities = classify_sentiment_batch([text])
+        return {
+            "sentiment": labels[0],
+            "confidence": float(probabilities[0].max())
+        }
+    else:
+        return _keyword_fallback(text)
+
+def classify_sentiment_batch(texts, scores=None):
+    """
+    Classifies a list of texts with a single vectorizer/model pass.
+    Returns (labels, probabilities): a list of sentiment labels and a float32
+    array of shape (len(texts), n_classes) ordered like model.classes_.
+    The label is the argmax of the same probability matrix, so the model is
+    only invoked once per batch. Without a model the array holds the keyword
+    fallback confidences with shape (len(texts), 1).
+    scores, the HeadScores of the fused kernel for these texts (see
+    fused_classifier.py), replaces the vectorizer/model pass.
+    """
+    # One snapshot per batch: a concurrent hot-swap cannot mix versions
+    model, vectorizer, _ = active_model.get()
+    if scores is not None:
+        model = scores.model
+
+    texts = [_coerce_text(text) for text in texts]
+
+    if not (model and vectorizer):
+        labels, confidences = [], []
+        for text in texts:
+            fallback = _keyword_fallback(text)
+            labels.append(fallback["sentiment"])
+            confidences.append(fallback["confidence"])
+        return labels, np.asarray(confidences, dtype=np.float32).reshape(-1, 1)
+
+    classes = model.classes_
+    probabilities = np.zeros((len(texts), len(classes)), dtype=np.float32)
+    labels = ["Neutral"] * len(texts)
+    # Blank texts keep the neutral default and never reach the model
+    rows = [i for i, text in enumerate(texts) if text.strip()]
+    neutral = _class_index(classes, "neutral")
+    if neutral is not None:
+        probabilities[:, neutral] = 0.5
+
+    if rows:
         try:
-            X_vectorized = vectorizer.transform([text])
-            sentiment_label = model.predict(X_vectorized)[0]
-            confidence = 0.8  # placeholder or model.predict_proba
-            return {
-                "sentiment": sentiment_label,
-                "confidence": confidence
-            }
+            if scores is None:
+                X_vectorized = vectorizer.transform([texts[i] for i in rows])
+                batch_proba = model.predict_proba(X_vectorized).astype(np.float32, copy=False)
+            else:
+                batch_proba = scores.probabilities[rows].astype(np.float32, copy=False)
+            predicted = classes[batch_proba.argmax(axis=1)]
+            probabilities[rows] = batch_proba
+            for i, label in zip(rows, predicted):
+                labels[i] = str(label)
         except Exception as e:
-            print(f"Error classifying sentiment: {str(e)}")
-            # fallback on error
-            return {
-                "sentiment": "Neutral",
-                "confidence": 0.5
-            }
+            print(f"Error classifying sentiment batch: {str(e)}")
+
+    return labels, probabilities
+
+def _coerce_text(text):
+    # Make sure text is a string (handles numpy types and None)
+    if text is None:
+        return ""
+    if isinstance(text, (int, float)) or hasattr(text, 'dtype'):
+        return str(text)
+    return text if isinstance(text, str) else str(text)
+
+def _class_index(classes, name):
+    for i, label in enumerate(classes):
+        if str(label).lower() == name:
+            return i
+    return None
+
+def _keyword_fallback(text):
+    # Basic fallback logic if no model is available
+    text_lower = text.lower()
+    if any(word in text_lower for word in ["great", "love", "excellent", "amazing", "good", "happy"]):
+        return {
+            "sentiment": "positive",
+            "confidence": 0.7
+        }
+    elif any(word in text_lower for word in ["terrible", "awful", "bad", "hate", "disappointed", "angry"]):
+        return {
+            "sentiment": "negative",
+            "confidence": 0.7
+        }
     else:
-        # Basic fallback logic if no model is available
-        text_lower = text.lower()
-        if any(word in text_lower for word in ["great", "love", "excellent", "amazing", "good", "happy"]):
-            return {
-                "sentiment": "positive",
-                "confidence": 0.7
-            }
-        elif any(word in text_lower for word in ["terrible", "awful", "bad", "hate", "disappointed", "angry"]):
-            return {
-                "sentiment": "negative",
-                "confidence": 0.7
-            }
-        else:
-            return {
-                "sentiment": "neutral",
-                "confidence": 0.5
-            }
\ No newline at end of file
+        return {
+            "sentiment": "neutral",
+            "confidence": 0.5
+        }
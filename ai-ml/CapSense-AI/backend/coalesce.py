@@ -0,0 +1,166 @@
+"""
+coalesce.py
+Single-flight coalescing of identical in-flight work.
+
+When several request threads ask for the same text at the same time (the
+frontend firing parallel /batch-analyze calls, or many clients posting the
+same viral complaint), only the first one computes the classification and
+the Phi-3 response; the others wait on its Future and share the result.
+Nothing is cached: once a computation finishes its key is forgotten, so the
+next request for that text computes afresh.
+
+Texts are keyed after normalization (case-folded, whitespace collapsed), so
+"Late  delivery!" and "late delivery!" share one computation.
+
+SingleFlight is for request threads (Flask); AsyncSingleFlight does the same
+for coroutines on one event loop (asgi_app.py).
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+def normalize_text(text):
+    """
+    Coalescing key for a text: case-folded with runs of whitespace collapsed.
+    """
+    text = text if isinstance(text, str) else str(text)
+    return " ".join(text.split()).casefold()
+
+
+def dedupe(texts):
+    """
+    Splits a batch into its distinct texts (by normalized key).
+    Returns (unique_texts, positions) where texts[i] maps to
+    unique_texts[positions[i]]; the first spelling of each text is kept.
+    """
+    index = {}
+    unique_texts = []
+    positions = []
+    for text in texts:
+        key = normalize_text(text)
+        position = index.get(key)
+        if position is None:
+            position = index[key] = len(unique_texts)
+            unique_texts.append(text)
+        positions.append(position)
+    return unique_texts, positions
+
+
+class SingleFlight:
+    """
+    Runs at most one computation per key at a time; concurrent callers
+    with the same key wait for the running one and get its result (or its
+    exception).
+    """
+
+    def __init__(self, name="single-flight"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.computed = 0
+        self.coalesced = 0
+
+    def do(self, key, func, timeout=None):
+        """
+        Returns func() for the first caller with this key; concurrent callers
+        wait (up to timeout seconds) for the same result.
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+                self.computed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result(timeout=timeout)
+
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def do_many(self, keys, func, timeout=None):
+        """
+        Batched do(): the keys nobody is computing yet are computed together
+        by one func(indexes) call, which returns their results in order; keys
+        another caller is computing are waited on (up to timeout seconds).
+        Returns the results aligned with keys.
+        """
+        futures = []
+        led = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                future = self._in_flight.get(key)
+                if future is None:
+                    future = self._in_flight[key] = Future()
+                    led.append(i)
+                    self.computed += 1
+                else:
+                    self.coalesced += 1
+                futures.append(future)
+
+        # Compute before waiting, so two callers leading each other's keys cannot deadlock
+        try:
+            if led:
+                for i, result in zip(led, func(led)):
+                    futures[i].set_result(result)
+        except BaseException as e:
+            for i in led:
+                if not futures[i].done():
+                    futures[i].set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                for i in led:
+                    self._in_flight.pop(keys[i], None)
+        return [future.result(timeout=timeout) for future in futures]
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._in_flight)
+        return {"computed": self.computed, "coalesced": self.coalesced, "in_flight": in_flight}
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines on one event loop: concurrent awaits of the
+    same key share one run of the coroutine.
+    """
+
+    def __init__(self, name="async-single-flight"):
+        self.name = name
+        self._in_flight = {}
+        self.computed = 0
+        self.coalesced = 0
+
+    async def do(self, key, coroutine_func):
+        """
+        Awaits coroutine_func() for the first caller with this key; concurrent
+        callers await the same result.
+        """
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # shield: a cancelled waiter must not cancel the shared computation
+            return await asyncio.shield(future)
+
+        self.computed += 1
+        future = asyncio.ensure_future(coroutine_func())
+        self._in_flight[key] = future
+        future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+    def stats(self):
+        return {"computed": self.computed, "coalesced": self.coalesced, "in_flight": len(self._in_flight)}
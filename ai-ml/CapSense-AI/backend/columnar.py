@@ -0,0 +1,222 @@
+"""
+columnar.py
+Compact columnar encoding of /api/respond_batch results.
+
+The default response is a list of nested dicts, one per text, repeating
+every key string ("classification", "sentiment_confidence", ...) for each
+row. For large batches the columnar form is much smaller and faster to
+serialize: one array per field, sentiment and emotion dictionary-encoded
+(a short list of labels plus one small unsigned integer per row, as narrow
+as the number of labels allows) and confidences
+stored as float32. The optional row fields become nullable columns:
+reused_from and reused_similarity (an approved response reused instead of
+a Phi-3 call), near_duplicate_cluster and near_duplicate_similarity (the
+"near_duplicate" tag); they are null for rows without them.
+
+Formats (?format=... or "format" in the request body):
+    rows      the original list of dicts (default)
+    columnar  compact JSON; confidences rounded to 4 decimals
+    msgpack   the same structure as MessagePack, floats packed as float32
+              (needs the msgpack package)
+    arrow     an Arrow IPC stream with dictionary and float32 columns
+              (needs the pyarrow package)
+
+The frontend decodes the JSON form with frontend/src/utils/columnar-results.js.
+"""
+
+import json
+
+import numpy as np
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+try:
+    import pyarrow as pa
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+FORMAT_VERSION = 2
+
+MEDIA_TYPES = {
+    "rows": "application/json",
+    "columnar": "application/json",
+    "msgpack": "application/msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# Dictionary-encoded label columns and float32 columns, in output order
+LABEL_COLUMNS = ("sentiment", "emotion")
+FLOAT_COLUMNS = ("sentiment_confidence", "sarcasm_confidence", "emotion_confidence", "empathy_score", "f1_score")
+# Nullable columns for the optional row fields: integer ids and float32 similarities
+ID_COLUMNS = ("reused_from", "near_duplicate_cluster")
+SIMILARITY_COLUMNS = ("reused_similarity", "near_duplicate_similarity")
+
+
+def available_formats():
+    """
+    The formats this server can produce. msgpack and arrow are optional:
+    they need the msgpack and pyarrow packages (listed in requirements.txt)
+    and are left out when those are not installed.
+    """
+    formats = ["rows", "columnar"]
+    if MSGPACK_AVAILABLE:
+        formats.append("msgpack")
+    if PYARROW_AVAILABLE:
+        formats.append("arrow")
+    return formats
+
+
+def code_dtype(labels):
+    """
+    The narrowest unsigned integer type that indexes every label.
+    """
+    if len(labels) <= 1 << 8:
+        return np.uint8
+    if len(labels) <= 1 << 16:
+        return np.uint16
+    return np.uint32
+
+
+def dictionary_encode(values):
+    """
+    Returns (labels, codes): the distinct values in order of first
+    appearance and an array with the index of each value, typed by code_dtype.
+    """
+    index = {}
+    codes = [index.setdefault(value, len(index)) for value in values]
+    labels = list(index)
+    return labels, np.asarray(codes, dtype=code_dtype(labels))
+
+
+def to_columns(results):
+    """
+    Turns the respond_batch rows into columns.
+    Returns (columns, dictionaries): strings and aspects stay lists, labels
+    become integer codes into dictionaries[name], numbers become float32
+    arrays and the nullable columns lists with None where a row has no value.
+    """
+    classifications = [row["classification"] for row in results]
+    responses = [row["ai_response"] for row in results]
+
+    columns = {
+        "input_text": [row["input_text"] for row in results],
+        "sarcasm": np.fromiter((bool(c["sarcasm"]) for c in classifications), dtype=np.bool_, count=len(results)),
+        "response_text": [r["response_text"] for r in responses],
+        "aspects": [row.get("aspects", []) for row in results],
+    }
+    dictionaries = {}
+    for name in LABEL_COLUMNS:
+        dictionaries[name], columns[name] = dictionary_encode([c[name] for c in classifications])
+
+    sources = {
+        "sentiment_confidence": (classifications, "sentiment_confidence"),
+        "sarcasm_confidence": (classifications, "sarcasm_confidence"),
+        "emotion_confidence": (classifications, "emotion_confidence"),
+        "empathy_score": (responses, "empathy_score"),
+    }
+    for name, (rows, key) in sources.items():
+        columns[name] = np.fromiter((row[key] for row in rows), dtype=np.float32, count=len(results))
+    columns["f1_score"] = np.fromiter((row["f1_score"] or 0.0 for row in results), dtype=np.float32,
+                                      count=len(results))
+
+    near_duplicates = [row.get("near_duplicate") or {} for row in results]
+    columns["reused_from"] = [r.get("reused_from") for r in responses]
+    columns["reused_similarity"] = [r.get("similarity") if "reused_from" in r else None for r in responses]
+    columns["near_duplicate_cluster"] = [n.get("cluster") for n in near_duplicates]
+    columns["near_duplicate_similarity"] = [n.get("similarity") for n in near_duplicates]
+    return columns, dictionaries
+
+
+def _document(columns, dictionaries, floats):
+    """
+    The shared columnar structure; floats(array) converts a float32 column.
+    """
+    return {
+        "format": "columnar",
+        "version": FORMAT_VERSION,
+        "count": len(columns["input_text"]),
+        "dictionaries": dictionaries,
+        "columns": {
+            "input_text": columns["input_text"],
+            "sentiment": columns["sentiment"].tolist(),
+            "sentiment_confidence": floats(columns["sentiment_confidence"]),
+            "sarcasm": columns["sarcasm"].astype(np.uint8).tolist(),
+            "sarcasm_confidence": floats(columns["sarcasm_confidence"]),
+            "emotion": columns["emotion"].tolist(),
+            "emotion_confidence": floats(columns["emotion_confidence"]),
+            "response_text": columns["response_text"],
+            "empathy_score": floats(columns["empathy_score"]),
+            "f1_score": floats(columns["f1_score"]),
+            "aspects": columns["aspects"],
+            "reused_from": columns["reused_from"],
+            "reused_similarity": columns["reused_similarity"],
+            "near_duplicate_cluster": columns["near_duplicate_cluster"],
+            "near_duplicate_similarity": columns["near_duplicate_similarity"],
+        },
+    }
+
+
+def encode_columnar_json(results):
+    columns, dictionaries = to_columns(results)
+    # float32 values print with spurious digits in JSON (0.8999999761...), so round them
+    document = _document(columns, dictionaries, lambda array: np.round(array.astype(np.float64), 4).tolist())
+    return json.dumps(document, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def encode_msgpack(results):
+    if not MSGPACK_AVAILABLE:
+        raise ValueError("The msgpack format needs the msgpack package.")
+    columns, dictionaries = to_columns(results)
+    document = _document(columns, dictionaries, lambda array: array.tolist())
+    return msgpack.packb(document, use_single_float=True)
+
+
+def encode_arrow(results):
+    if not PYARROW_AVAILABLE:
+        raise ValueError("The arrow format needs the pyarrow package.")
+    columns, dictionaries = to_columns(results)
+    arrays = {"input_text": pa.array(columns["input_text"], type=pa.string())}
+    for name in LABEL_COLUMNS:
+        arrays[name] = pa.DictionaryArray.from_arrays(
+            pa.array(columns[name], type=pa.from_numpy_dtype(columns[name].dtype)), pa.array(dictionaries[name], type=pa.string())
+        )
+    for name in ("sentiment_confidence", "sarcasm_confidence", "emotion_confidence"):
+        arrays[name] = pa.array(columns[name], type=pa.float32())
+    arrays["sarcasm"] = pa.array(columns["sarcasm"], type=pa.bool_())
+    arrays["response_text"] = pa.array(columns["response_text"], type=pa.string())
+    arrays["empathy_score"] = pa.array(columns["empathy_score"], type=pa.float32())
+    arrays["f1_score"] = pa.array(columns["f1_score"], type=pa.float32())
+    # Aspects are a short, irregular list per row; kept as JSON text
+    arrays["aspects"] = pa.array([json.dumps(aspects, separators=(",", ":")) for aspects in columns["aspects"]],
+                                 type=pa.string())
+    for name in ID_COLUMNS:
+        arrays[name] = pa.array(columns[name], type=pa.int64())
+    for name in SIMILARITY_COLUMNS:
+        arrays[name] = pa.array(columns[name], type=pa.float32())
+
+    table = pa.table(arrays).replace_schema_metadata({"format": "columnar", "version": str(FORMAT_VERSION)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_results(results, fmt):
+    """
+    Returns (body bytes, media type) for the respond_batch rows in format fmt.
+    Raises ValueError for an unknown format or a missing optional package.
+    """
+    if fmt == "rows":
+        return json.dumps(results, separators=(",", ":")).encode("utf-8"), MEDIA_TYPES["rows"]
+    if fmt == "columnar":
+        return encode_columnar_json(results), MEDIA_TYPES["columnar"]
+    if fmt == "msgpack":
+        return encode_msgpack(results), MEDIA_TYPES["msgpack"]
+    if fmt == "arrow":
+        return encode_arrow(results), MEDIA_TYPES["arrow"]
+    raise ValueError(f"Unknown format '{fmt}'. Use one of: {', '.join(MEDIA_TYPES)}.")
@@ -0,0 +1,45 @@
+"""
+db.py
+Connection to the Azure SQL database that holds FeedbackResponses.
+
+Kept apart from app.py so that command-line tools (near_duplicates.py,
+retention.py) can reach the database without importing the server, which
+starts its background workers on import.
+"""
+
+try:
+    import pyodbc
+    PYODBC_AVAILABLE = True
+except ImportError:
+    print("WARNING: pyodbc module not available. Database functionality will be disabled.")
+    PYODBC_AVAILABLE = False
+
+# Production DB config for Azure SQL
+DB_CONFIG = {
+    'server': '1sqlcapsenseserver.database.windows.net',
+    'database': 'SentimentAnalysisDB',
+    'username': 'capsenseadmin',
+    'password': 'Access@Capsense1'
+}
+
+def get_db_connection():
+    """
+    Returns a database connection or None if pyodbc is not available
+    """
+    if not PYODBC_AVAILABLE:
+        print("WARNING: Database connection requested but pyodbc is not available")
+        return None
+        
+    conn_str = (
+        f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+        f"SERVER={DB_CONFIG['server']};"
+        f"DATABASE={DB_CONFIG['database']};"
+        f"UID={DB_CONFIG['username']};"
+        f"PWD={DB_CONFIG['password']};"
+        "Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;"
+    )
+    try:
+        return pyodbc.connect(conn_str)
+    except Exception as e:
+        print(f"ERROR connecting to database: {str(e)}")
+        return None
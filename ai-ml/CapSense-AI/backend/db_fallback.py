@@ -1,11 +1,173 @@
 """
 db_fallback.py
-Commented-out code to illustrate a simple local fallback DB (e.g. SQLite).
-Uncomment if you want to test locally without Azure.
+A local SQLite stand-in for FeedbackResponses, for trying the backend and
+the retention job (retention.py) without Azure.
+
+SQLite has no table partitioning, so the monthly layout is emulated: one
+table per month (FeedbackResponses_p202610, ...) behind a FeedbackResponses
+view. INSTEAD OF INSERT triggers on the view route each row to the table of
+its CreatedAt month, so FEEDBACK_INSERT_QUERY works unchanged, and dropping
+a month is a DROP TABLE. Ids come from one shared sequence, as with the
+real table.
+
+    from db_fallback import get_fallback_db_connection
+    conn = get_fallback_db_connection()
+
+Configuration:
+    CAPSENSE_FALLBACK_DB    SQLite file (default: backend/fallback_local.db)
 """
 
-# import sqlite3
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+from retention import PARTITIONS_AHEAD, TABLE, Partition, add_months, month_start
+
+FALLBACK_DB_PATH = os.getenv("CAPSENSE_FALLBACK_DB",
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), "fallback_local.db"))
+
+COLUMNS = [
+    ("Id", "INTEGER PRIMARY KEY"),
+    ("CustomerText", "TEXT"),
+    ("Sentiment", "TEXT"),
+    ("ResponseText", "TEXT"),
+    ("EmpathyScore", "REAL"),
+    ("SarcasmDetected", "INTEGER"),
+    ("Emotion", "TEXT"),
+    ("F1Score", "REAL"),
+    ("approved", "INTEGER"),
+    ("FeedbackDate", "TEXT"),
+    ("CreatedAt", "TEXT NOT NULL"),
+]
+COLUMN_NAMES = [name for name, _ in COLUMNS]
+SEQUENCE_TABLE = f"{TABLE}_ids"
+PARTITION_TABLE = re.compile(rf"^{TABLE}_p(\d{{4}})(\d{{2}})$")
+
+# CreatedAt as SQL Server's GETDATE() would set it, in SQLite's sortable text form
+CREATED_AT = "COALESCE(NEW.CreatedAt, datetime('now', 'localtime'))"
+
+
+def sqlite_datetime(moment):
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def partition_table(start):
+    return f"{TABLE}_p{start:%Y%m}"
+
+
+class SqlitePartitions:
+    """
+    The SQL Server partition operations of retention.py on the SQLite stand-in.
+    """
+
+    def __init__(self, path=FALLBACK_DB_PATH):
+        self.path = path
+
+    def connect(self):
+        return sqlite3.connect(self.path)
+
+    def _months(self, conn):
+        names = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table';")]
+        matches = [PARTITION_TABLE.match(name) for name in names]
+        return sorted(datetime(int(m.group(1)), int(m.group(2)), 1) for m in matches if m)
+
+    def _route(self, conn, months):
+        """
+        Recreates the FeedbackResponses view and its insert triggers over the month tables.
+        """
+        conn.execute(f"DROP VIEW IF EXISTS {TABLE};")
+        if not months:
+            return
+        columns = ", ".join(COLUMN_NAMES)
+        conn.execute(f"CREATE VIEW {TABLE} AS "
+                     + " UNION ALL ".join(f"SELECT {columns} FROM {partition_table(start)}" for start in months)
+                     + ";")
+        values = ", ".join(f"NEW.{name}" for name in COLUMN_NAMES[1:-1])
+        for start in months:
+            conn.execute(f"""
+                CREATE TRIGGER {partition_table(start)}_insert INSTEAD OF INSERT ON {TABLE}
+                WHEN {CREATED_AT} >= '{sqlite_datetime(start)}'
+                 AND {CREATED_AT} < '{sqlite_datetime(add_months(start, 1))}'
+                BEGIN
+                    INSERT INTO {SEQUENCE_TABLE} (Id) VALUES (NULL);
+                    INSERT INTO {partition_table(start)} ({columns})
+                    VALUES (last_insert_rowid(), {values}, {CREATED_AT});
+                    DELETE FROM {SEQUENCE_TABLE};
+                END;""")
+        conn.execute(f"""
+            CREATE TRIGGER {TABLE}_outside INSTEAD OF INSERT ON {TABLE}
+            WHEN {CREATED_AT} < '{sqlite_datetime(months[0])}'
+              OR {CREATED_AT} >= '{sqlite_datetime(add_months(months[-1], 1))}'
+            BEGIN
+                SELECT RAISE(ABORT, 'no {TABLE} partition for this CreatedAt');
+            END;""")
+
+    def partitions(self):
+        conn = self.connect()
+        try:
+            return [Partition(number, start, add_months(start, 1),
+                              conn.execute(f"SELECT COUNT(*) FROM {partition_table(start)};").fetchone()[0])
+                    for number, start in enumerate(self._months(conn), start=1)]
+        finally:
+            conn.close()
+
+    def ensure(self, now=None, ahead=PARTITIONS_AHEAD, history=0):
+        """
+        Creates the month tables from history months ago up to ahead months
+        from now. Returns the months added.
+        """
+        now = now or datetime.now()
+        conn = self.connect()
+        try:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {SEQUENCE_TABLE} (Id INTEGER PRIMARY KEY AUTOINCREMENT);")
+            months = self._months(conn)
+            first = months[-1] if months else add_months(month_start(now), -history)
+            added = []
+            start = first
+            while start <= add_months(month_start(now), ahead):
+                if start not in months:
+                    columns = ", ".join(f"{name} {definition}" for name, definition in COLUMNS)
+                    conn.execute(f"CREATE TABLE {partition_table(start)} ({columns});")
+                    added.append(start)
+                start = add_months(start, 1)
+            if added or not months:
+                self._route(conn, sorted(months + added))
+            conn.commit()
+            return added
+        finally:
+            conn.close()
+
+    def read(self, partition, batch_rows=10000):
+        conn = self.connect()
+        try:
+            cursor = conn.execute(f"SELECT {', '.join(COLUMN_NAMES)} FROM {partition_table(partition.start)};")
+            while True:
+                rows = cursor.fetchmany(batch_rows)
+                if not rows:
+                    break
+                yield COLUMN_NAMES, rows
+        finally:
+            conn.close()
+
+    def drop(self, partition):
+        conn = self.connect()
+        try:
+            conn.execute(f"DROP TABLE {partition_table(partition.start)};")
+            self._route(conn, [start for start in self._months(conn) if start != partition.start])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def lock(self):
+        # One process at a time is the stand-in's only use
+        return self.connect()
+
 
-# def get_fallback_db_connection():
-#     conn = sqlite3.connect('fallback_local.db')
-#     return conn
+def get_fallback_db_connection(path=FALLBACK_DB_PATH):
+    """
+    A connection to the SQLite stand-in, with the month tables up to
+    PARTITIONS_AHEAD months from now in place.
+    """
+    SqlitePartitions(path).ensure()
+    return sqlite3.connect(path)
@@ -0,0 +1,273 @@
+"""
+fused_classifier.py
+The sentiment, sarcasm and emotion heads scored with one sparse matrix product.
+
+Each head is a linear model over its own CountVectorizer: MultinomialNB
+(log P(class) + counts . log P(term | class)) or a logistic regression
+(intercept + counts . coef). Called one by one, every batch is tokenized
+once per head and goes through three rounds of sklearn's input validation
+and dispatch. The fused kernel instead:
+
+  - tokenizes each text once per distinct analyzer (sentiment and sarcasm
+    share one: lowercase unigrams without English stop words; emotion adds
+    bigrams over the preprocess_text output),
+  - counts the tokens into one CSR matrix over the union of the heads'
+    vocabularies, where a term known to several heads is a single column,
+  - multiplies it by one dense matrix holding every head's weights side by
+    side (zero where a head does not know a term) and adds the stacked
+    class priors / intercepts,
+  - and turns each head's slice of the scores into probabilities the way
+    that head's predict_proba does.
+
+Zero weights add exactly 0.0 and the union keeps each vocabulary's sorted
+order, so every score is summed in the order sklearn sums it and the
+probabilities match predict_proba bit for bit;
+benchmarks/check_fused_parity.py checks this against the deployed models.
+
+    from fused_classifier import score_heads
+    scores = score_heads(texts)      # {"sentiment": HeadScores, ...} or {}
+
+The kernel is rebuilt when a head's active model changes (a published
+version or the online learner). If a head cannot be fused (a
+HashingVectorizer, an estimator other than MultinomialNB or
+LogisticRegression), score_heads returns {} and the classifiers run one by
+one as before.
+
+Configuration:
+    CAPSENSE_FUSED_CLASSIFIER=0    score the heads one by one
+"""
+
+import os
+import threading
+from collections import namedtuple
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.special import expit, logsumexp
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.naive_bayes import MultinomialNB
+
+import model_store
+from classifier_emotion import preprocess_text
+
+FUSED_ENABLED = os.getenv("CAPSENSE_FUSED_CLASSIFIER", "1") != "0"
+
+HEADS = ("sentiment", "sarcasm", "emotion")
+
+# CountVectorizer settings that decide which terms a text produces
+ANALYZER_PARAMS = ("input", "encoding", "decode_error", "strip_accents", "lowercase", "preprocessor",
+                   "tokenizer", "stop_words", "token_pattern", "ngram_range", "analyzer")
+
+# probabilities ordered like model.classes_; labels are their row-wise argmax
+HeadScores = namedtuple("HeadScores", ["model", "labels", "probabilities"])
+
+
+class UnsupportedModel(ValueError):
+    pass
+
+
+def as_text(text):
+    # What the sentiment and sarcasm heads feed their vectorizer
+    return "" if text is None else str(text)
+
+
+def emotion_input(text):
+    return preprocess_text(str(text))
+
+
+# What each head's vectorizer is given for a raw text
+HEAD_INPUTS = {"sentiment": as_text, "sarcasm": as_text, "emotion": emotion_input}
+
+
+def linear_weights(model):
+    """
+    (weights of shape (n_features, n_scores), bias, link) for a supported estimator.
+    """
+    if isinstance(model, MultinomialNB):
+        return model.feature_log_prob_.T, model.class_log_prior_, "naive_bayes"
+    if isinstance(model, LogisticRegression):
+        return model.coef_.T, model.intercept_, "logistic"
+    raise UnsupportedModel(f"cannot fuse a {type(model).__name__}")
+
+
+def analyzer_key(vectorizer, prepare):
+    """
+    Heads whose vectorizers turn a text into the same terms share a key,
+    and so one tokenization pass and one set of columns.
+    """
+    if type(vectorizer) is not CountVectorizer or isinstance(vectorizer, TfidfVectorizer):
+        raise UnsupportedModel(f"cannot fuse a {type(vectorizer).__name__}")
+    if vectorizer.binary:
+        raise UnsupportedModel("cannot fuse a binary CountVectorizer")
+    params = vectorizer.get_params()
+    key = [prepare]
+    for name in ANALYZER_PARAMS:
+        value = params[name]
+        key.append(tuple(sorted(value)) if isinstance(value, (list, set, frozenset)) else value)
+    vocabulary = vectorizer.vocabulary_
+    terms = sorted(vocabulary, key=vocabulary.get)
+    if terms != sorted(vocabulary):
+        # A vocabulary out of term order cannot share columns without changing the summation order
+        key.append(id(vectorizer))
+    return tuple(key)
+
+
+def probabilities(scores, link):
+    """
+    predict_proba from a head's scores, with the same arithmetic as sklearn.
+    """
+    if link == "naive_bayes":
+        return np.exp(scores - np.atleast_2d(logsumexp(scores, axis=1)).T)
+    if scores.shape[1] == 1:
+        positive = expit(scores[:, 0])
+        return np.stack([1 - positive, positive], axis=1)
+    # sklearn.utils.extmath.softmax
+    scores = scores - scores.max(axis=1).reshape(-1, 1)
+    np.exp(scores, out=scores)
+    scores /= scores.sum(axis=1).reshape(-1, 1)
+    return scores
+
+
+class AnalyzerGroup:
+    """
+    The heads sharing one analyzer, and the columns of their union vocabulary.
+    """
+
+    def __init__(self, prepare, analyzer, terms, offset):
+        self.prepare = prepare
+        self.analyzer = analyzer
+        self.columns = {term: offset + i for i, term in enumerate(sorted(terms))}
+
+
+class FusedClassifier:
+    """
+    heads: (name, model, vectorizer, prepare) per head, where prepare maps a
+    raw text to what that head's vectorizer expects.
+    """
+
+    def __init__(self, heads):
+        self.names = [name for name, _, _, _ in heads]
+        self.models = {name: model for name, model, _, _ in heads}
+        keys = {}
+        for name, model, vectorizer, prepare in heads:
+            if len(vectorizer.vocabulary_) != model.n_features_in_:
+                raise UnsupportedModel(f"the {name} vectorizer and model disagree on the number of features")
+            keys.setdefault(analyzer_key(vectorizer, prepare), []).append((name, model, vectorizer, prepare))
+
+        self.groups = []
+        head_columns = {}
+        offset = 0
+        for members in keys.values():
+            _, _, vectorizer, prepare = members[0]
+            terms = set().union(*(member[2].vocabulary_ for member in members))
+            group = AnalyzerGroup(prepare, vectorizer.build_analyzer(), terms, offset)
+            self.groups.append(group)
+            offset += len(terms)
+            for name, _, head_vectorizer, _ in members:
+                vocabulary = head_vectorizer.vocabulary_
+                head_columns[name] = np.asarray(
+                    [group.columns[term] for term in sorted(vocabulary, key=vocabulary.get)], dtype=np.intp
+                )
+        self.n_features = offset
+
+        # One weight matrix and bias for all heads; self.slices[name] are a head's score columns
+        stacked = [(name, *linear_weights(self.models[name])) for name in self.names]
+        n_scores = sum(weights.shape[1] for _, weights, _, _ in stacked)
+        self.weights = np.zeros((self.n_features, n_scores), dtype=np.float64)
+        self.bias = np.zeros(n_scores, dtype=np.float64)
+        self.slices = {}
+        self.links = {}
+        start = 0
+        for name, weights, bias, link in stacked:
+            stop = start + weights.shape[1]
+            self.weights[head_columns[name], start:stop] = weights
+            self.bias[start:stop] = bias
+            self.slices[name] = slice(start, stop)
+            self.links[name] = link
+            start = stop
+
+    def transform(self, texts):
+        """
+        Term counts of texts over the union vocabulary, with sorted indices like CountVectorizer's.
+        """
+        indices = []
+        indptr = [0]
+        for text in texts:
+            for group in self.groups:
+                columns = group.columns
+                for term in group.analyzer(group.prepare(text)):
+                    column = columns.get(term)
+                    if column is not None:
+                        indices.append(column)
+            indptr.append(len(indices))
+        counts = sp.csr_matrix(
+            (np.ones(len(indices), dtype=np.float64), np.asarray(indices, dtype=np.int32),
+             np.asarray(indptr, dtype=np.int64)),
+            shape=(len(texts), self.n_features)
+        )
+        counts.sum_duplicates()
+        return counts
+
+    def predict(self, texts):
+        """
+        {head: HeadScores} for texts from one tokenization pass per analyzer
+        and one sparse x dense product.
+        """
+        scores = self.transform(texts) @ self.weights + self.bias
+        results = {}
+        for name in self.names:
+            model = self.models[name]
+            head_probabilities = probabilities(np.ascontiguousarray(scores[:, self.slices[name]]), self.links[name])
+            labels = model.classes_[head_probabilities.argmax(axis=1)] if len(texts) else model.classes_[:0]
+            results[name] = HeadScores(model, labels, head_probabilities)
+        return results
+
+
+# (active snapshots it was built from, FusedClassifier or None)
+_fused = (None, None)
+_fused_lock = threading.Lock()
+
+
+def get_fused_classifier():
+    """
+    The kernel for the heads' active models, rebuilt after a hot swap; None
+    when fusing is off or a head cannot be fused.
+    """
+    global _fused
+    if not FUSED_ENABLED or not all(head in model_store.ACTIVE_MODELS for head in HEADS):
+        return None
+    snapshots = tuple(model_store.ACTIVE_MODELS[head].get() for head in HEADS)
+    built_from, fused = _fused
+    if built_from is not None and all(a is b for a, b in zip(built_from, snapshots)):
+        return fused
+    with _fused_lock:
+        built_from, fused = _fused
+        if built_from is not None and all(a is b for a, b in zip(built_from, snapshots)):
+            return fused
+        fused = None
+        if all(model is not None and vectorizer is not None for model, vectorizer, _ in snapshots):
+            try:
+                fused = FusedClassifier([(head, model, vectorizer, HEAD_INPUTS[head])
+                                         for head, (model, vectorizer, _) in zip(HEADS, snapshots)])
+                print(f"[FUSED] Scoring {', '.join(HEADS)} with one product over {fused.n_features} features "
+                      f"(versions {', '.join(str(version) for _, _, version in snapshots)})")
+            except UnsupportedModel as e:
+                print(f"[FUSED] Scoring the heads one by one: {str(e)}")
+        _fused = (snapshots, fused)
+        return fused
+
+
+def score_heads(texts):
+    """
+    {head: HeadScores} for texts from the fused kernel, or {} when it is
+    unavailable or fails (the classifiers then score the texts themselves).
+    """
+    fused = get_fused_classifier()
+    if fused is None or not texts:
+        return {}
+    try:
+        return fused.predict(texts)
+    except Exception as e:
+        print(f"[FUSED] Error: {str(e)}")
+        return {}
@@ -0,0 +1,327 @@
+"""
+generation_backends.py
+Pluggable backends for the AI response.
+
+    remote    Phi-3 on Azure AI Foundry (phi3resgen.generate_response); one
+              network round trip per response
+    local     a quantized GGUF model on this machine's CPU through llama.cpp
+              (pip install llama-cpp-python); no network, no per-call cost
+    template  the templated fallback responses (phi3resgen.generate_fallback_response)
+    auto      remote when PHI3_ENDPOINT and PHI3_KEY are set, else local when
+              CAPSENSE_LOCAL_MODEL points at a model, else template (default)
+
+Every backend offers generate() for one text, generate_batch() for many and
+stream() for /batch-analyze/stream, and returns the same
+{"response_text", "empathy_score"} dict as generate_response.
+generate_batch() takes an optional gate, entered around each generation, so
+the LLM scheduler (scheduler.py) decides which request's text goes next.
+
+The local backend keeps the prompt's fixed preamble ("As a customer service
+agent for Capgemini, ...") at the very start of every prompt and evaluates
+it once at startup. Its KV cache is saved and restored before each
+generation, so only the text-specific part of the prompt is evaluated per
+response. Because the llama.cpp bindings decode one sequence per model,
+batches are spread over CAPSENSE_LOCAL_INSTANCES model instances, each with
+CAPSENSE_LOCAL_THREADS threads.
+
+Configuration:
+    CAPSENSE_GENERATION_BACKEND     auto | remote | local | template (default: auto)
+    CAPSENSE_LOCAL_MODEL            path to a GGUF model, e.g. Phi-3-mini-4k-instruct-q4.gguf
+    CAPSENSE_LOCAL_THREADS          threads per model instance (default: CPU count / instances)
+    CAPSENSE_LOCAL_INSTANCES        model instances generating in parallel (default: 1)
+    CAPSENSE_LOCAL_CONTEXT          context window in tokens (default: 1024)
+    CAPSENSE_LOCAL_MAX_TOKENS       new tokens per response (default: 150)
+"""
+
+import asyncio
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import phi3resgen
+from phi3resgen import (PROMPT_PREAMBLE, build_prompt_body, calculate_empathy_score,
+                        generate_fallback_response, generate_fallback_responses, generate_response,
+                        generate_response_async, generate_response_stream)
+
+try:
+    from llama_cpp import Llama
+    LLAMA_CPP_AVAILABLE = True
+except ImportError:
+    LLAMA_CPP_AVAILABLE = False
+
+GENERATION_BACKEND = os.getenv("CAPSENSE_GENERATION_BACKEND", "auto")
+LOCAL_MODEL_PATH = os.getenv("CAPSENSE_LOCAL_MODEL")
+LOCAL_INSTANCES = int(os.getenv("CAPSENSE_LOCAL_INSTANCES", "1"))
+LOCAL_THREADS = int(os.getenv("CAPSENSE_LOCAL_THREADS", str(max(1, (os.cpu_count() or 1) // LOCAL_INSTANCES))))
+LOCAL_CONTEXT = int(os.getenv("CAPSENSE_LOCAL_CONTEXT", "1024"))
+LOCAL_MAX_TOKENS = int(os.getenv("CAPSENSE_LOCAL_MAX_TOKENS", "150"))
+
+# Concurrent Phi-3 calls per generate_batch on the remote backend
+REMOTE_BATCH_CONCURRENCY = 16
+
+# Phi-3 instruct chat format, matching the remote model's family
+LOCAL_PROMPT_PREFIX = "<|user|>\n"
+LOCAL_PROMPT_SUFFIX = "<|end|>\n<|assistant|>\n"
+LOCAL_STOP = ["<|end|>", "<|endoftext|>", "<|user|>"]
+
+
+class CompletedStream:
+    """
+    A response that exists in full, served through the ResponseStream
+    interface (one chunk, then result()).
+    """
+
+    def __init__(self, produce):
+        self._produce = produce
+        self.response = None
+        self.first_chunk_seconds = None
+        self._started = time.perf_counter()
+
+    def _run(self):
+        self.response = self._produce()
+        self.first_chunk_seconds = time.perf_counter() - self._started
+        return self.response["response_text"]
+
+    def __iter__(self):
+        yield self._run()
+
+    async def __aiter__(self):
+        yield await asyncio.to_thread(self._run)
+
+    def result(self):
+        return self.response
+
+
+class GenerationBackend:
+    name = "base"
+    # Generations this backend can run at once, when it is bounded by more than the caller
+    max_concurrency = None
+
+    def generate(self, customer_text, classification_data):
+        raise NotImplementedError
+
+    def generate_batch(self, items, gate=None):
+        """
+        Responses for a list of (customer_text, classification_data), in order.
+        gate, when given, is called for a context manager held around each generation.
+        """
+        return [self.generate_gated(gate, text, classification_data) for text, classification_data in items]
+
+    def generate_gated(self, gate, customer_text, classification_data):
+        if gate is None:
+            return self.generate(customer_text, classification_data)
+        with gate():
+            return self.generate(customer_text, classification_data)
+
+    async def generate_async(self, customer_text, classification_data, client=None):
+        return await asyncio.to_thread(self.generate, customer_text, classification_data)
+
+    def stream(self, customer_text, classification_data, client=None):
+        return CompletedStream(lambda: self.generate(customer_text, classification_data))
+
+    def describe(self):
+        return {"backend": self.name}
+
+
+class RemoteBackend(GenerationBackend):
+    name = "remote"
+
+    def generate(self, customer_text, classification_data):
+        return generate_response(customer_text, classification_data)
+
+    def generate_batch(self, items, gate=None):
+        if len(items) <= 1:
+            return super().generate_batch(items, gate)
+        with ThreadPoolExecutor(max_workers=min(REMOTE_BATCH_CONCURRENCY, len(items))) as pool:
+            return list(pool.map(lambda item: self.generate_gated(gate, *item), items))
+
+    async def generate_async(self, customer_text, classification_data, client=None):
+        return await generate_response_async(customer_text, classification_data, client)
+
+    def stream(self, customer_text, classification_data, client=None):
+        return generate_response_stream(customer_text, classification_data, client)
+
+
+class TemplateBackend(GenerationBackend):
+    name = "template"
+
+    def generate(self, customer_text, classification_data):
+        return generate_fallback_response(customer_text, classification_data)
+
+    def generate_batch(self, items, gate=None):
+        # Templates take no LLM slot, so the gate is not needed
+        return generate_fallback_responses(items)
+
+    async def generate_async(self, customer_text, classification_data, client=None):
+        return self.generate(customer_text, classification_data)
+
+
+class LocalModel:
+    """
+    One llama.cpp model instance with the prompt preamble already evaluated.
+    """
+
+    def __init__(self, model_path, threads, context):
+        self.llm = Llama(model_path=model_path, n_ctx=context, n_threads=threads, n_threads_batch=threads,
+                         verbose=False)
+        self.prefix = LOCAL_PROMPT_PREFIX + PROMPT_PREAMBLE
+        self.llm.eval(self.llm.tokenize(self.prefix.encode("utf-8")))
+        self.prefix_state = self.llm.save_state()
+
+    def complete(self, prompt_body, max_tokens, stream=False):
+        # Back to "preamble evaluated": llama.cpp matches the prompt's prefix against
+        # the restored tokens and only evaluates the text-specific part
+        self.llm.load_state(self.prefix_state)
+        return self.llm.create_completion(self.prefix + prompt_body + LOCAL_PROMPT_SUFFIX, max_tokens=max_tokens,
+                                          temperature=0.7, top_p=1.0, stop=LOCAL_STOP, stream=stream)
+
+
+class LocalBackend(GenerationBackend):
+    name = "local"
+
+    def __init__(self, model_path=LOCAL_MODEL_PATH, instances=LOCAL_INSTANCES, threads=LOCAL_THREADS,
+                 context=LOCAL_CONTEXT, max_tokens=LOCAL_MAX_TOKENS):
+        if not LLAMA_CPP_AVAILABLE:
+            raise RuntimeError("The local backend needs llama-cpp-python (pip install llama-cpp-python)")
+        if not model_path or not os.path.isfile(model_path):
+            raise RuntimeError(f"CAPSENSE_LOCAL_MODEL does not point at a model file: {model_path}")
+        self.model_path = model_path
+        self.threads = threads
+        self.max_tokens = max_tokens
+        self._models = queue.Queue()
+        started = time.perf_counter()
+        for _ in range(max(1, instances)):
+            self._models.put(LocalModel(model_path, threads, context))
+        self.instances = self._models.qsize()
+        self.max_concurrency = self.instances
+        self.load_seconds = time.perf_counter() - started
+        self._pool = ThreadPoolExecutor(max_workers=self.instances, thread_name_prefix="local-llm")
+
+    def _with_model(self, work):
+        model = self._models.get()
+        try:
+            return work(model)
+        finally:
+            self._models.put(model)
+
+    def _response(self, response_text, customer_text, classification_data):
+        response_text = response_text.strip()
+        if not response_text:
+            return generate_fallback_response(customer_text, classification_data)
+        return {
+            "response_text": response_text,
+            "empathy_score": calculate_empathy_score(response_text, classification_data)
+        }
+
+    def generate(self, customer_text, classification_data):
+        try:
+            completion = self._with_model(
+                lambda model: model.complete(build_prompt_body(customer_text, classification_data), self.max_tokens)
+            )
+            return self._response(completion["choices"][0]["text"], customer_text, classification_data)
+        except Exception as e:
+            phi3resgen.logger.error(f"Error generating response with the local model: {str(e)}")
+            return generate_fallback_response(customer_text, classification_data)
+
+    def generate_batch(self, items, gate=None):
+        if gate is None:
+            # One text per free model instance at a time
+            return list(self._pool.map(lambda item: self.generate(*item), items))
+        # The shared pool would queue texts first come, first served ahead of the
+        # gate; instead each batch waits for its turn at the gate on its own threads
+        with ThreadPoolExecutor(max_workers=min(self.instances, len(items) or 1)) as pool:
+            return list(pool.map(lambda item: self.generate_gated(gate, *item), items))
+
+    def stream(self, customer_text, classification_data, client=None):
+        return LocalStream(self, customer_text, classification_data)
+
+    def describe(self):
+        return {"backend": self.name, "model": os.path.basename(self.model_path), "instances": self.instances,
+                "threads": self.threads, "load_seconds": round(self.load_seconds, 2)}
+
+
+class LocalStream(CompletedStream):
+    """
+    Tokens from the local model as llama.cpp produces them.
+    """
+
+    def __init__(self, backend, customer_text, classification_data):
+        super().__init__(None)
+        self.backend = backend
+        self.customer_text = customer_text
+        self.classification_data = classification_data
+        self.parts = []
+
+    def _chunks(self):
+        prompt_body = build_prompt_body(self.customer_text, self.classification_data)
+        model = self.backend._models.get()
+        try:
+            for chunk in model.complete(prompt_body, self.backend.max_tokens, stream=True):
+                text = chunk["choices"][0]["text"]
+                if text:
+                    if self.first_chunk_seconds is None:
+                        self.first_chunk_seconds = time.perf_counter() - self._started
+                    self.parts.append(text)
+                    yield text
+        finally:
+            self.backend._models.put(model)
+
+    def __iter__(self):
+        try:
+            yield from self._chunks()
+        except Exception as e:
+            phi3resgen.logger.error(f"Error streaming from the local model: {str(e)}")
+        if not self.parts:
+            self.response = generate_fallback_response(self.customer_text, self.classification_data)
+            yield self.response["response_text"]
+
+    async def __aiter__(self):
+        chunks = iter(self)
+        done = object()
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, done)
+            if chunk is done:
+                return
+            yield chunk
+
+    def result(self):
+        if self.response is None:
+            self.response = self.backend._response("".join(self.parts), self.customer_text, self.classification_data)
+        return self.response
+
+
+def create_backend(name=GENERATION_BACKEND):
+    """
+    Builds the named backend; "auto" picks remote, then local, then template.
+    """
+    if name == "auto":
+        if os.getenv("PHI3_ENDPOINT") and os.getenv("PHI3_KEY"):
+            return RemoteBackend()
+        if LLAMA_CPP_AVAILABLE and LOCAL_MODEL_PATH:
+            try:
+                return LocalBackend()
+            except Exception as e:
+                print(f"[GENERATION] Local model unavailable ({str(e)}), using templates")
+        return TemplateBackend()
+    if name == "remote":
+        return RemoteBackend()
+    if name == "local":
+        return LocalBackend()
+    if name == "template":
+        return TemplateBackend()
+    raise ValueError(f"Unknown generation backend: {name} (expected auto, remote, local or template)")
+
+
+_backend = None
+
+
+def get_generation_backend():
+    """
+    This process's backend, created on first use.
+    """
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+        print(f"[GENERATION] Using {_backend.describe()}")
+    return _backend
@@ -0,0 +1,325 @@
+"""
+ingest.py
+Memory-bounded ingestion of very large batch uploads.
+
+/api/respond_batch parses the whole body into a list and keeps every result
+until the end, so a 200MB upload needs several times that in memory.
+/api/ingest instead reads the body as it arrives, parses texts out of it
+incrementally and runs them through the pipeline INGEST_CHUNK_TEXTS at a
+time, storing each chunk's results before reading on, and answers with a
+summary ({"count": n, "seconds": s}). Memory is bounded by one chunk plus
+one partial text, whatever the upload size.
+
+With ?results=rows the results are also streamed back as NDJSON (one
+respond_batch row per line, then {"done": true, "count": n}) while the
+upload is still being read. Only use it from clients that read the response
+while sending: one that sends the whole body first stalls once the unread
+results fill the socket buffers.
+
+Accepted bodies (by Content-Type):
+    application/json      {"customer_texts": ["...", ...]} or a bare ["...", ...]
+    application/x-ndjson  one JSON string, or object with "text"/"customer_text", per line
+    text/csv              a header row, then one row per text; the column is
+                          customer_text, text or feedback (or the only column)
+
+Limits: an upload may not exceed CAPSENSE_INGEST_MAX_BYTES and a single text
+CAPSENSE_INGEST_MAX_TEXT_BYTES. Only CAPSENSE_INGEST_CONCURRENCY uploads run
+per worker at once; further ones are turned away with 503 and Retry-After
+rather than queued. Under the sync server the body is read from the socket
+only as fast as the pipeline consumes it, so a fast client is slowed down by
+TCP backpressure. /api/respond_batch rejects bodies over
+CAPSENSE_MAX_JSON_BYTES with 413 and a pointer to /api/ingest.
+
+An upload that breaks off (bad JSON, a text over the limit) is answered
+with {"error": "...", "count": n}; the n texts before the failing chunk are
+analyzed and stored.
+
+Configuration:
+    CAPSENSE_INGEST_MAX_BYTES         largest upload (default: 1 GiB)
+    CAPSENSE_INGEST_MAX_TEXT_BYTES    largest single text (default: 64 KiB)
+    CAPSENSE_INGEST_CHUNK_TEXTS       texts per pipeline chunk (default: 256)
+    CAPSENSE_INGEST_CONCURRENCY       concurrent uploads per worker (default: 2)
+    CAPSENSE_MAX_JSON_BYTES           largest /api/respond_batch body (default: 32 MiB)
+"""
+
+import codecs
+import csv
+import json
+import os
+import threading
+
+INGEST_MAX_BYTES = int(os.getenv("CAPSENSE_INGEST_MAX_BYTES", str(1024 * 1024 * 1024)))
+INGEST_MAX_TEXT_BYTES = int(os.getenv("CAPSENSE_INGEST_MAX_TEXT_BYTES", str(64 * 1024)))
+INGEST_CHUNK_TEXTS = int(os.getenv("CAPSENSE_INGEST_CHUNK_TEXTS", "256"))
+INGEST_CONCURRENCY = int(os.getenv("CAPSENSE_INGEST_CONCURRENCY", "2"))
+MAX_JSON_BYTES = int(os.getenv("CAPSENSE_MAX_JSON_BYTES", str(32 * 1024 * 1024)))
+
+READ_BYTES = 64 * 1024
+RETRY_AFTER_SECONDS = 30
+
+CSV_TEXT_COLUMNS = ("customer_text", "text", "feedback")
+JSON_WHITESPACE = " \t\r\n"
+
+
+class IngestError(ValueError):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class JsonTextsParser:
+    """
+    Push parser for {"customer_texts": [...], ...} or a bare array of
+    strings: feed() takes decoded text as it arrives and returns the
+    complete texts found so far. Other fields ("format", ...) are skipped.
+    """
+
+    def __init__(self, max_text_bytes=INGEST_MAX_TEXT_BYTES):
+        self.max_text_bytes = max_text_bytes
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._state = "start"
+        self._key = None
+        self._bare = False
+
+    def _skip_whitespace(self, pos):
+        while pos < len(self._buffer) and self._buffer[pos] in JSON_WHITESPACE:
+            pos += 1
+        return pos
+
+    def _decode(self, pos, closed):
+        """
+        (value, end) for the JSON value at pos, or None if more data is needed.
+        """
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, pos)
+        except json.JSONDecodeError as e:
+            if closed:
+                raise IngestError(f"Invalid JSON: {e.msg}")
+            if len(self._buffer) - pos > self.max_text_bytes:
+                raise IngestError(f"A value is larger than {self.max_text_bytes} bytes or the JSON is invalid", 413)
+            return None
+        # A number or literal at the very end of the buffer may still continue
+        if not closed and end == len(self._buffer) and not isinstance(value, (str, list, dict)):
+            return None
+        return value, end
+
+    def feed(self, text, closed=False):
+        self._buffer += text
+        texts = []
+        pos = 0
+        buffer = self._buffer
+        while True:
+            pos = self._skip_whitespace(pos)
+            if pos >= len(buffer):
+                break
+            char = buffer[pos]
+            state = self._state
+            if state == "start":
+                if char == "{":
+                    self._state = "key"
+                elif char == "[":
+                    self._state, self._bare = "items", True
+                else:
+                    raise IngestError("Expected a JSON object or array")
+                pos += 1
+            elif state == "key":
+                if char == ",":
+                    pos += 1
+                    continue
+                if char == "}":
+                    self._state = "end"
+                    pos += 1
+                    continue
+                decoded = self._decode(pos, closed)
+                if decoded is None:
+                    break
+                self._key, pos = decoded
+                self._state = "colon"
+            elif state == "colon":
+                if char != ":":
+                    raise IngestError("Expected ':' after a key")
+                pos += 1
+                self._state = "array" if self._key == "customer_texts" else "value"
+            elif state == "array":
+                if char != "[":
+                    raise IngestError("'customer_texts' must be a list of strings.")
+                pos += 1
+                self._state = "items"
+            elif state == "value":
+                decoded = self._decode(pos, closed)
+                if decoded is None:
+                    break
+                _, pos = decoded
+                self._state = "key"
+            elif state == "items":
+                if char == ",":
+                    pos += 1
+                    continue
+                if char == "]":
+                    self._state = "end" if self._bare else "key"
+                    pos += 1
+                    continue
+                decoded = self._decode(pos, closed)
+                if decoded is None:
+                    break
+                value, pos = decoded
+                if not isinstance(value, str):
+                    raise IngestError("'customer_texts' must be a list of strings.")
+                texts.append(value)
+            else:  # end
+                raise IngestError("Unexpected data after the JSON document")
+        self._buffer = buffer[pos:]
+        if closed and self._state != "end":
+            raise IngestError("The JSON document is incomplete")
+        return texts
+
+
+class NdjsonTextsParser:
+    """
+    Push parser for newline-delimited JSON: one string, or an object with
+    "text" or "customer_text", per line.
+    """
+
+    def __init__(self, max_text_bytes=INGEST_MAX_TEXT_BYTES):
+        self.max_text_bytes = max_text_bytes
+        self._partial = ""
+
+    def feed(self, text, closed=False):
+        lines = (self._partial + text).split("\n")
+        self._partial = "" if closed else lines.pop()
+        if len(self._partial) > self.max_text_bytes:
+            raise IngestError(f"A line is longer than {self.max_text_bytes} bytes", 413)
+        texts = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                value = json.loads(line)
+            except ValueError as e:
+                raise IngestError(f"Invalid JSON line: {str(e)}")
+            if isinstance(value, dict):
+                value = value.get("customer_text", value.get("text"))
+            if not isinstance(value, str):
+                raise IngestError("Each line must be a string or an object with 'text' or 'customer_text'")
+            texts.append(value)
+        return texts
+
+
+class CsvTextsParser:
+    """
+    Push parser for CSV with a header row; quoted fields may span lines.
+    """
+
+    def __init__(self, max_text_bytes=INGEST_MAX_TEXT_BYTES):
+        self.max_text_bytes = max_text_bytes
+        self._partial = ""
+        self._column = None
+
+    def _records(self, text, closed):
+        lines = (self._partial + text).split("\n")
+        self._partial = "" if closed else lines.pop()
+        record = []
+        quotes = 0
+        for line in lines:
+            record.append(line)
+            quotes += line.count('"')
+            if quotes % 2 == 0:  # not inside a quoted field
+                yield "\n".join(record)
+                record, quotes = [], 0
+        if record:
+            if closed:
+                raise IngestError("A quoted CSV field is never closed")
+            self._partial = "\n".join(record) + "\n" + self._partial
+        if len(self._partial) > self.max_text_bytes:
+            raise IngestError(f"A CSV row is longer than {self.max_text_bytes} bytes", 413)
+
+    def feed(self, text, closed=False):
+        texts = []
+        for row in csv.reader(self._records(text, closed)):
+            if not row:
+                continue
+            if self._column is None:
+                header = [name.strip().lower() for name in row]
+                matches = [header.index(name) for name in CSV_TEXT_COLUMNS if name in header]
+                if matches:
+                    self._column = matches[0]
+                elif len(header) == 1:
+                    self._column = 0
+                else:
+                    raise IngestError(f"The CSV needs a column named one of: {', '.join(CSV_TEXT_COLUMNS)}")
+                continue
+            if self._column < len(row):
+                texts.append(row[self._column])
+        return texts
+
+
+PARSERS = {
+    "application/json": JsonTextsParser,
+    "application/x-ndjson": NdjsonTextsParser,
+    "application/jsonl": NdjsonTextsParser,
+    "text/csv": CsvTextsParser,
+}
+
+
+def parser_for(mimetype):
+    """
+    A fresh parser for the upload's Content-Type, or None if it is not supported.
+    """
+    parser_class = PARSERS.get((mimetype or "application/json").lower())
+    return parser_class() if parser_class else None
+
+
+class BodyReader:
+    """
+    Turns raw body chunks into texts: decodes UTF-8 incrementally, enforces
+    the upload size limit and hands the text to the parser.
+    """
+
+    def __init__(self, parser, max_bytes=INGEST_MAX_BYTES):
+        self.parser = parser
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def feed(self, data):
+        self.bytes_read += len(data)
+        if self.bytes_read > self.max_bytes:
+            raise IngestError(f"The upload is larger than {self.max_bytes} bytes", 413)
+        return self.parser.feed(self._decoder.decode(data))
+
+    def close(self):
+        return self.parser.feed(self._decoder.decode(b"", final=True), closed=True)
+
+
+def iter_texts(read, parser, max_bytes=INGEST_MAX_BYTES, read_bytes=READ_BYTES):
+    """
+    Yields the texts of a body read with read(n) until it returns b"".
+    """
+    reader = BodyReader(parser, max_bytes)
+    while True:
+        data = read(read_bytes)
+        if not data:
+            break
+        yield from reader.feed(data)
+    yield from reader.close()
+
+
+def iter_chunks(texts, size=INGEST_CHUNK_TEXTS):
+    chunk = []
+    for text in texts:
+        chunk.append(text)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ndjson_line(data):
+    return json.dumps(data) + "\n"
+
+
+# Uploads being ingested by this worker
+ingest_slots = threading.BoundedSemaphore(INGEST_CONCURRENCY)
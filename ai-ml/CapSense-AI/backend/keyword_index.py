@@ -0,0 +1,167 @@
+"""
+keyword_index.py
+Multi-pattern keyword matcher (Aho-Corasick) for scanning text against a
+large phrase list in a single left-to-right pass.
+
+The automaton is built once; matching costs O(len(text) + matches) no
+matter how many phrases are indexed. Uses the pyahocorasick C extension
+when it is installed and a pure-Python automaton otherwise.
+
+count_phrases_batch() scans a whole list of texts in one call: they are
+joined by a separator character that no phrase contains, the separator is
+itself a pattern, and each separator match starts the next text's counts.
+"""
+
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+# Joins the texts of count_phrases_batch; phrases containing it are not indexed
+SEPARATOR = "\x00"
+
+
+class KeywordIndex:
+    """
+    Case-insensitive phrase index.
+
+    Build it from {phrase: payload}; find_all(text) returns
+    (start, end, phrase, payload) tuples for every occurrence, with
+    positions into text.lower(). With whole_words=True a match must not be
+    glued to a letter or digit on either side ("price" does not match
+    "priceless").
+    """
+
+    def __init__(self, phrases, whole_words=True, use_extension=None):
+        self.whole_words = whole_words
+        self.phrases = {phrase.lower(): payload for phrase, payload in phrases.items()
+                        if phrase.strip() and SEPARATOR not in phrase}
+        if use_extension is None:
+            use_extension = AHOCORASICK_AVAILABLE
+        self._automaton = None
+        self._batch_automaton = None
+        if use_extension and AHOCORASICK_AVAILABLE:
+            self._automaton = ahocorasick.Automaton()
+            # The same phrases plus the separator, whose value is None
+            self._batch_automaton = ahocorasick.Automaton()
+            for phrase, payload in self.phrases.items():
+                self._automaton.add_word(phrase, (phrase, payload))
+                self._batch_automaton.add_word(phrase, phrase)
+            self._batch_automaton.add_word(SEPARATOR, None)
+            self._batch_automaton.make_automaton()
+            if self.phrases:
+                self._automaton.make_automaton()
+        else:
+            self._build()
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def _build(self):
+        # Trie as parallel lists: goto[state] maps a character to the next state
+        goto = [{}]
+        output = [[]]
+        for phrase in self.phrases:
+            state = 0
+            for char in phrase:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    output.append([])
+                state = next_state
+            output[state].append(phrase)
+
+        # Breadth-first failure links; each state inherits the outputs of its failure state
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for state in queue:
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(char, 0)
+                output[next_state] = output[next_state] + output[fail[next_state]]
+
+        self._goto = goto
+        self._fail = fail
+        self._output = [tuple(phrases) for phrases in output]
+
+    def iter_matches(self, lowered):
+        """
+        Yields (start, end, phrase) for every match in already-lowercased text.
+        """
+        if self._automaton is not None:
+            if not self.phrases:
+                return
+            for end, (phrase, _) in self._automaton.iter(lowered):
+                yield end - len(phrase) + 1, end + 1, phrase
+            return
+
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for index, char in enumerate(lowered):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                for phrase in output[state]:
+                    yield index - len(phrase) + 1, index + 1, phrase
+
+    def find_all(self, text):
+        """
+        Returns [(start, end, phrase, payload), ...] in order of match end.
+        """
+        lowered = text.lower()
+        matches = []
+        for start, end, phrase in self.iter_matches(lowered):
+            if self.whole_words and not _on_word_boundary(lowered, start, end):
+                continue
+            matches.append((start, end, phrase, self.phrases[phrase]))
+        return matches
+
+    def count_phrases(self, text):
+        """
+        Returns {phrase: occurrences} for the phrases present in text.
+        """
+        counts = {}
+        for _, _, phrase, _ in self.find_all(text):
+            counts[phrase] = counts.get(phrase, 0) + 1
+        return counts
+
+    def count_phrases_batch(self, texts):
+        """
+        count_phrases for each of texts, from a single scan over all of them
+        with the C extension (one count_phrases per text without it).
+        """
+        if self._batch_automaton is None or not texts:
+            return [self.count_phrases(text) for text in texts]
+        joined = SEPARATOR.join(texts)
+        if joined.count(SEPARATOR) != len(texts) - 1:
+            # Some texts contain the separator itself: count those one by one
+            batched = iter(self.count_phrases_batch([text for text in texts if SEPARATOR not in text]))
+            return [self.count_phrases(text) if SEPARATOR in text else next(batched) for text in texts]
+        lowered = joined.lower()
+        whole_words = self.whole_words
+        counts = [{}]
+        current = counts[0]
+        for end, phrase in self._batch_automaton.iter(lowered):
+            if phrase is None:
+                current = {}
+                counts.append(current)
+                continue
+            if whole_words and not _on_word_boundary(lowered, end - len(phrase) + 1, end + 1):
+                continue
+            current[phrase] = current.get(phrase, 0) + 1
+        return counts
+
+
+def _on_word_boundary(text, start, end):
+    if start > 0 and text[start - 1].isalnum():
+        return False
+    if end < len(text) and text[end].isalnum():
+        return False
+    return True
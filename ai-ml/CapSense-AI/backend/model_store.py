@@ -0,0 +1,371 @@
+"""
+model_store.py
+Versioned on-disk layout for the classifier artifacts.
+
+Each classifier ("head") gets its own folder under models/:
+
+    models/<head>/<version>/classifier.pkl
+    models/<head>/<version>/vectorizer.pkl
+    models/<head>/<version>/metadata.json
+    models/<head>/CURRENT        <- name of the active version
+
+Versions are written into a hidden temporary folder and renamed into place,
+and CURRENT is replaced atomically, so a reader never sees a half-written
+model. Before any version is published the classifiers fall back to the
+original flat pickles (models/sentiment_classifier.pkl, ...), reported as
+version "legacy".
+
+Each worker runs a ModelWatcher that polls the CURRENT files. When one
+changes, the new version is loaded and warmed up in the background and only
+then swapped in, so requests never wait on unpickling or a cold model.
+
+Configuration:
+    CAPSENSE_MODEL_DIR           models folder (default: backend/models)
+    CAPSENSE_MODEL_POLL_SECONDS  watcher poll interval (default: 10)
+    CAPSENSE_MODEL_WATCH=0       disable the watcher
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+import joblib
+
+MODELS_DIR = os.getenv("CAPSENSE_MODEL_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+WATCH_INTERVAL_SECONDS = float(os.getenv("CAPSENSE_MODEL_POLL_SECONDS", "10"))
+
+LEGACY_VERSION = "legacy"
+
+# Short inputs pushed through a freshly loaded model before it takes traffic
+WARMUP_TEXTS = [
+    "The service was excellent and the staff were very helpful.",
+    "I waited two hours and nobody answered my complaint.",
+    "Oh great, another delayed delivery. Just what I needed.",
+]
+
+CLASSIFIER_FILE = "classifier.pkl"
+VECTORIZER_FILE = "vectorizer.pkl"
+METADATA_FILE = "metadata.json"
+CURRENT_FILE = "CURRENT"
+
+HEADS = ("sentiment", "sarcasm", "emotion")
+
+# head -> ActiveModel served by this process
+ACTIVE_MODELS = {}
+
+
+class ActiveModel:
+    """
+    The (model, vectorizer, version) triple a classifier is serving.
+
+    publish() replaces the whole tuple in one assignment. Readers call get()
+    once per batch and keep that snapshot, so they never take a lock and
+    never see a model paired with another version's vectorizer.
+    """
+
+    def __init__(self, head, model=None, vectorizer=None, version=None, warm_up=None):
+        self.head = head
+        self._current = (model, vectorizer, version)
+        self._publish_lock = threading.Lock()  # serializes writers only
+        self._warm_up = warm_up
+        self.loaded_at = time.time()
+
+    def get(self):
+        return self._current
+
+    @property
+    def version(self):
+        return self._current[2]
+
+    def publish(self, model, vectorizer, version):
+        """
+        Swaps in a new model and returns the previous (model, vectorizer, version).
+        """
+        with self._publish_lock:
+            previous = self._current
+            self._current = (model, vectorizer, version)
+            self.loaded_at = time.time()
+        return previous
+
+    def warm_up(self, model, vectorizer):
+        """
+        Runs the classifier's warm-up inference on a model that is not live yet.
+        """
+        if self._warm_up is not None:
+            self._warm_up(model, vectorizer)
+
+
+def register_active(head, model=None, vectorizer=None, version=None, warm_up=None):
+    """
+    Creates the ActiveModel for a head and makes it reachable by the online
+    learner, the watcher and the model endpoints.
+    """
+    active = ActiveModel(head, model, vectorizer, version, warm_up)
+    ACTIVE_MODELS[head] = active
+    return active
+
+
+def load_initial(head, legacy_model_path, legacy_vectorizer_path, models_dir=None):
+    """
+    Loads the model a classifier starts with: the published CURRENT version
+    if there is one, otherwise the legacy flat pickles.
+    Returns (model, vectorizer, version); all None if nothing could be loaded.
+    """
+    version = get_current(head, models_dir)
+    if version:
+        try:
+            model, vectorizer, _ = load_version(head, version, models_dir)
+            print(f"Loaded {head} model version {version} from {head_dir(head, models_dir)}")
+            return model, vectorizer, version
+        except Exception as e:
+            print(f"Warning: Failed to load {head} model version {version}: {str(e)}")
+
+    try:
+        if os.path.exists(legacy_model_path) and os.path.exists(legacy_vectorizer_path):
+            model = joblib.load(legacy_model_path)
+            vectorizer = joblib.load(legacy_vectorizer_path)
+            print(f"Loaded {head} model from {legacy_model_path}")
+            print(f"Loaded {head} vectorizer from {legacy_vectorizer_path}")
+            return model, vectorizer, LEGACY_VERSION
+        print(f"Warning: Local {head} model not found at {legacy_model_path} or {legacy_vectorizer_path}")
+    except Exception as e:
+        print(f"Warning: Failed to load local {head} model: {str(e)}")
+    return None, None, None
+
+
+def describe_active_models(models_dir=None):
+    """
+    Active and published versions per head, for the /api/models endpoint.
+    """
+    heads = {}
+    for head, active in ACTIVE_MODELS.items():
+        heads[head] = {
+            "active_version": active.version,
+            "published_version": get_current(head, models_dir),
+            "available_versions": list_versions(head, models_dir),
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(active.loaded_at)),
+        }
+    return heads
+
+
+class ModelWatcher:
+    """
+    Polls models/<head>/CURRENT and swaps newly published versions into this
+    process after loading and warming them up off the request path.
+    """
+
+    def __init__(self, interval=WATCH_INTERVAL_SECONDS, models_dir=None):
+        self.interval = interval
+        self.models_dir = models_dir
+        self._stop = threading.Event()
+        self._failed = {}  # head -> version that failed to load, so it is not retried every poll
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="model-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check_once()
+
+    def check_once(self):
+        """
+        Returns {head: version} for every head that was swapped.
+        """
+        swapped = {}
+        for head, active in list(ACTIVE_MODELS.items()):
+            version = get_current(head, self.models_dir)
+            if not version or version == active.version or self._failed.get(head) == version:
+                continue
+            try:
+                model, vectorizer, _ = load_version(head, version, self.models_dir)
+                active.warm_up(model, vectorizer)
+            except Exception as e:
+                print(f"[MODEL WATCHER] Failed to load {head} version {version}: {str(e)}")
+                self._failed[head] = version
+                continue
+            previous = active.publish(model, vectorizer, version)
+            print(f"[MODEL WATCHER] {head}: {previous[2]} -> {version}")
+            swapped[head] = version
+        return swapped
+
+
+_watcher = None
+
+
+def start_watcher(interval=None):
+    """
+    Starts this process's ModelWatcher once.
+    """
+    global _watcher
+    if _watcher is None:
+        _watcher = ModelWatcher(interval or WATCH_INTERVAL_SECONDS)
+        _watcher.start()
+    return _watcher
+
+
+def head_dir(head, models_dir=None):
+    return os.path.join(models_dir or MODELS_DIR, head)
+
+
+def new_version_name():
+    """
+    Returns a sortable version name like 20241118-153012-4821.
+    """
+    return time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid() % 10000:04d}"
+
+
+def list_versions(head, models_dir=None):
+    """
+    Returns the complete versions of a head, oldest first.
+    """
+    path = head_dir(head, models_dir)
+    if not os.path.isdir(path):
+        return []
+    versions = [
+        name for name in os.listdir(path)
+        if not name.startswith(".")
+        and os.path.isfile(os.path.join(path, name, CLASSIFIER_FILE))
+    ]
+    return sorted(versions)
+
+
+def get_current(head, models_dir=None):
+    """
+    Returns the active version name of a head, or None if nothing is published.
+    """
+    try:
+        with open(os.path.join(head_dir(head, models_dir), CURRENT_FILE), "r") as f:
+            version = f.read().strip()
+        return version or None
+    except FileNotFoundError:
+        return None
+
+
+def set_current(head, version, models_dir=None):
+    """
+    Atomically points CURRENT at an existing version.
+    """
+    path = head_dir(head, models_dir)
+    if not os.path.isfile(os.path.join(path, version, CLASSIFIER_FILE)):
+        raise ValueError(f"Unknown {head} model version: {version}")
+    atomic_write_text(os.path.join(path, CURRENT_FILE), version + "\n")
+
+
+def write_version(head, model, vectorizer, metadata=None, models_dir=None, activate=True):
+    """
+    Writes a new model version and optionally makes it the active one.
+    Returns the version name.
+    """
+    path = head_dir(head, models_dir)
+    os.makedirs(path, exist_ok=True)
+
+    version = new_version_name()
+    while os.path.exists(os.path.join(path, version)):
+        time.sleep(1)
+        version = new_version_name()
+
+    tmp_dir = tempfile.mkdtemp(prefix=f".{version}.", dir=path)
+    os.chmod(tmp_dir, 0o755)  # mkdtemp creates the folder owner-only
+    joblib.dump(model, os.path.join(tmp_dir, CLASSIFIER_FILE))
+    joblib.dump(vectorizer, os.path.join(tmp_dir, VECTORIZER_FILE))
+    metadata = dict(metadata or {}, head=head, version=version)
+    with open(os.path.join(tmp_dir, METADATA_FILE), "w") as f:
+        json.dump(metadata, f, indent=2, default=str)
+    for name in (CLASSIFIER_FILE, VECTORIZER_FILE, METADATA_FILE):
+        _fsync_file(os.path.join(tmp_dir, name))
+
+    os.rename(tmp_dir, os.path.join(path, version))
+    if activate:
+        set_current(head, version, models_dir)
+    return version
+
+
+def check_version(head, version, models_dir=None):
+    """
+    Raises ValueError unless version names one of the head's stored
+    versions. Versions can come from API clients, so this runs before a
+    version is turned into a path (or unpickled).
+    """
+    if not isinstance(version, str) or version not in list_versions(head, models_dir):
+        raise ValueError(f"Unknown {head} model version: {version}")
+
+
+def load_version(head, version, models_dir=None):
+    """
+    Returns (model, vectorizer, metadata) for a stored version.
+    """
+    check_version(head, version, models_dir)
+    path = os.path.join(head_dir(head, models_dir), version)
+    model = joblib.load(os.path.join(path, CLASSIFIER_FILE))
+    vectorizer = joblib.load(os.path.join(path, VECTORIZER_FILE))
+    try:
+        with open(os.path.join(path, METADATA_FILE), "r") as f:
+            metadata = json.load(f)
+    except (FileNotFoundError, ValueError):
+        metadata = {"head": head, "version": version}
+    return model, vectorizer, metadata
+
+
+def previous_version(head, version, models_dir=None):
+    """
+    Returns the version published before the given one, or None.
+    """
+    versions = list_versions(head, models_dir)
+    if version not in versions:
+        return None
+    index = versions.index(version)
+    return versions[index - 1] if index > 0 else None
+
+
+def rollback(head, version=None, models_dir=None):
+    """
+    Points CURRENT back at an older version (the one before the active
+    version by default) and swaps it into this process.
+    Returns the version now active.
+    """
+    if version is None:
+        active = ACTIVE_MODELS.get(head)
+        current = get_current(head, models_dir) or (active.version if active else None)
+        version = previous_version(head, current, models_dir)
+        if version is None:
+            raise ValueError(f"No earlier {head} model version to roll back to.")
+    check_version(head, version, models_dir)
+    model, vectorizer, _ = load_version(head, version, models_dir)
+    active = ACTIVE_MODELS.get(head)
+    if active is not None:
+        # Same check as the watcher: a version that cannot score is never published
+        try:
+            active.warm_up(model, vectorizer)
+        except Exception as e:
+            raise ValueError(f"{head} model version {version} failed to warm up: {str(e)}")
+    set_current(head, version, models_dir)
+    if active is not None:
+        active.publish(model, vectorizer, version)
+    return version
+
+
+def _fsync_file(path):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+
+def atomic_write_text(path, text):
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(path))
+    try:
+        os.chmod(tmp_path, 0o644)
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
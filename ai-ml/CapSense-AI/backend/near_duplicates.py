@@ -0,0 +1,566 @@
+"""
+near_duplicates.py
+MinHash/LSH near-duplicate detection for feedback texts.
+
+Reviews that differ only in punctuation, casing or a few words ("Delivery
+was late!!" / "delivery was late again") are one complaint to the pipeline.
+Each text is reduced to its character 5-gram shingles (case-folded,
+punctuation dropped) and summarized by a MinHash signature of NUM_PERM
+32-bit values; the share of equal values estimates the Jaccard similarity
+of two texts' shingle sets. An LSH index splits each signature into BANDS
+bands and buckets texts by band, so a lookup only compares against texts
+that share at least one band instead of the whole history. With 16 bands of
+8 values, pairs at Jaccard 0.8 become candidates ~95% of the time and
+pairs at 0.5 ~6% of the time; candidates are then checked against the
+threshold.
+
+The index holds the most recent CAPSENSE_DEDUP_HISTORY texts in a ring
+buffer. Every text joins a cluster (the first text of the cluster names
+it); the analysis computed for a cluster is kept for a while, so later
+near-duplicates with the same sentiment, sarcasm and emotion labels reuse
+it instead of running Phi-3 again (see DuplicatePlan). The index is saved to CAPSENSE_DEDUP_DIR every
+few minutes and at exit and loaded on startup; workers share the file and
+the last one to save wins, which only costs some recent history.
+
+Run as a script to find the near-duplicates already in FeedbackResponses:
+
+    python near_duplicates.py                 # report, writes a CSV
+    python near_duplicates.py --delete        # also delete duplicates nobody gave feedback on
+
+Configuration:
+    CAPSENSE_DEDUP=0                   disable near-duplicate detection
+    CAPSENSE_DEDUP_THRESHOLD           estimated Jaccard similarity needed (default: 0.9)
+    CAPSENSE_DEDUP_HISTORY             texts kept in the index (default: 100000)
+    CAPSENSE_DEDUP_RESULT_SECONDS      how long a cluster's analysis is reused (default: 3600)
+    CAPSENSE_DEDUP_DIR                 where the index is saved (default: backend/dedup)
+"""
+
+import argparse
+import atexit
+import csv
+import os
+import re
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+
+import joblib
+import numpy as np
+
+from coalesce import normalize_text
+
+DEDUP_THRESHOLD = float(os.getenv("CAPSENSE_DEDUP_THRESHOLD", "0.9"))
+DEDUP_HISTORY = int(os.getenv("CAPSENSE_DEDUP_HISTORY", "100000"))
+RESULT_TTL_SECONDS = float(os.getenv("CAPSENSE_DEDUP_RESULT_SECONDS", "3600"))
+DEDUP_DIR = os.getenv("CAPSENSE_DEDUP_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "dedup")
+SAVE_INTERVAL_SECONDS = 300
+RESULT_CACHE_SIZE = 10000
+
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+BANDS = 16
+SEED = 1
+
+INDEX_FILE = "minhash_index.pkl"
+INDEX_FORMAT = 1
+
+# Smallest prime above 2**32: (a * x + b) stays below 2**64 for 32-bit a, x and b
+HASH_PRIME = np.uint64(4294967311)
+HASH_MASK = np.uint64(0xFFFFFFFF)
+EMPTY_SIGNATURE_VALUE = np.uint32(0xFFFFFFFF)
+
+PUNCTUATION = re.compile(r"[^\w\s]+")
+
+# Rows scanned per page by the bulk job; rows with feedback are kept over those without
+BULK_PAGE_SIZE = 5000
+BULK_QUERY = """
+SELECT Id, CustomerText, approved
+FROM FeedbackResponses
+WHERE CustomerText IS NOT NULL
+ORDER BY CASE WHEN approved IS NULL THEN 1 ELSE 0 END, Id
+OFFSET ? ROWS FETCH NEXT ? ROWS ONLY;
+"""
+BULK_DELETE_QUERY = "DELETE FROM FeedbackResponses WHERE Id = ? AND approved IS NULL;"
+
+
+def shingle_text(text):
+    """
+    The text shingles are taken from: case-folded, punctuation dropped, whitespace collapsed.
+    """
+    return " ".join(PUNCTUATION.sub(" ", normalize_text(text)).split())
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """
+    32-bit hashes of the text's character shingles (the whole text if it is shorter).
+    """
+    text = shingle_text(text)
+    if len(text) <= size:
+        return {zlib.crc32(text.encode("utf-8"))} if text else set()
+    return {zlib.crc32(text[i:i + size].encode("utf-8")) for i in range(len(text) - size + 1)}
+
+
+class MinHasher:
+    """
+    MinHash signatures from NUM_PERM universal hash functions (a * x + b) mod p.
+    """
+
+    def __init__(self, num_perm=NUM_PERM, seed=SEED, shingle_size=SHINGLE_SIZE):
+        self.num_perm = num_perm
+        self.seed = seed
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 2 ** 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 2 ** 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        hashes = np.fromiter(shingles(text, self.shingle_size), dtype=np.uint64)
+        if hashes.size == 0:
+            return np.full(self.num_perm, EMPTY_SIGNATURE_VALUE, dtype=np.uint32)
+        values = (hashes[:, None] * self._a + self._b) % HASH_PRIME
+        return (values.min(axis=0) & HASH_MASK).astype(np.uint32)
+
+    def signatures(self, texts):
+        return np.vstack([self.signature(text) for text in texts]) if texts else \
+            np.zeros((0, self.num_perm), dtype=np.uint32)
+
+
+def estimated_similarity(signature, other):
+    """
+    Estimated Jaccard similarity of the shingle sets behind two signatures.
+    """
+    return float(np.count_nonzero(signature == other)) / len(signature)
+
+
+class LSHIndex:
+    """
+    Banded LSH over a ring buffer of the most recent signatures.
+    Each slot holds (entry_id, cluster_id, text).
+    """
+
+    def __init__(self, num_perm=NUM_PERM, bands=BANDS, capacity=DEDUP_HISTORY):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.capacity = capacity
+        self._signatures = np.zeros((capacity, num_perm), dtype=np.uint32)
+        self._entries = [None] * capacity
+        self._tables = [{} for _ in range(bands)]   # band bytes -> set of slots
+        self._next_slot = 0
+
+    def __len__(self):
+        return min(self._next_slot, self.capacity)
+
+    def _band_keys(self, signature):
+        r = self.rows_per_band
+        return [signature[band * r:(band + 1) * r].tobytes() for band in range(self.bands)]
+
+    def _evict(self, slot):
+        for table, key in zip(self._tables, self._band_keys(self._signatures[slot])):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(slot)
+                if not bucket:
+                    del table[key]
+        self._entries[slot] = None
+
+    def insert(self, signature, entry):
+        slot = self._next_slot % self.capacity
+        if self._entries[slot] is not None:
+            self._evict(slot)
+        self._signatures[slot] = signature
+        self._entries[slot] = entry
+        for table, key in zip(self._tables, self._band_keys(signature)):
+            table.setdefault(key, set()).add(slot)
+        self._next_slot += 1
+
+    def query(self, signature, threshold):
+        """
+        The most similar indexed entry at or above threshold as (entry, similarity), or None.
+        Only entries sharing a band with the signature are compared.
+        """
+        candidates = set()
+        for table, key in zip(self._tables, self._band_keys(signature)):
+            bucket = table.get(key)
+            if bucket:
+                candidates.update(bucket)
+        if not candidates:
+            return None
+        slots = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarities = np.count_nonzero(self._signatures[slots] == signature, axis=1) / self.num_perm
+        best = int(np.argmax(similarities))
+        if similarities[best] < threshold:
+            return None
+        return self._entries[slots[best]], float(similarities[best])
+
+    def state(self):
+        count = len(self)
+        order = [(self._next_slot - count + i) % self.capacity for i in range(count)]  # oldest first
+        return {
+            "signatures": self._signatures[order].copy(),
+            "entries": [self._entries[slot] for slot in order],
+        }
+
+
+class NearDuplicate:
+    """
+    Where a text landed: its cluster, and the earlier text it matched (if any).
+    """
+
+    def __init__(self, entry_id, cluster_id, matched_text=None, similarity=None):
+        self.entry_id = entry_id
+        self.cluster_id = cluster_id
+        self.matched_text = matched_text
+        self.similarity = similarity
+
+    @property
+    def is_duplicate(self):
+        return self.similarity is not None
+
+
+class NearDuplicateDetector:
+    def __init__(self, threshold=DEDUP_THRESHOLD, capacity=DEDUP_HISTORY, num_perm=NUM_PERM, bands=BANDS,
+                 seed=SEED, result_ttl=RESULT_TTL_SECONDS):
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, seed)
+        self.index = LSHIndex(num_perm, bands, capacity)
+        self.result_ttl = result_ttl
+        self._results = OrderedDict()   # (cluster_id, labels) -> (stored_at, analysis), least recently used first
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self.dirty = False
+
+        self.texts_seen = 0
+        self.duplicates = 0
+        self.results_reused = 0
+        self.lookup_seconds = 0.0
+
+    def assign(self, texts):
+        """
+        Adds texts to the history and returns a NearDuplicate for each.
+        A text close enough to an earlier one (including one earlier in
+        the same call) joins that text's cluster.
+        """
+        start = time.perf_counter()
+        signatures = self.hasher.signatures(texts)
+        assignments = []
+        with self._lock:
+            for text, signature in zip(texts, signatures):
+                entry_id = self._next_id
+                self._next_id += 1
+                found = self.index.query(signature, self.threshold)
+                if found is None:
+                    assignment = NearDuplicate(entry_id, entry_id)
+                else:
+                    (_, cluster_id, matched_text), similarity = found
+                    assignment = NearDuplicate(entry_id, cluster_id, matched_text, similarity)
+                    self.duplicates += 1
+                self.index.insert(signature, (entry_id, assignment.cluster_id, text))
+                assignments.append(assignment)
+            self.texts_seen += len(texts)
+            self.lookup_seconds += time.perf_counter() - start
+            self.dirty = True
+        return assignments
+
+    def match(self, text):
+        """
+        The closest earlier text as (cluster_id, text, similarity), or None; does not add the text.
+        """
+        with self._lock:
+            found = self.index.query(self.hasher.signature(text), self.threshold)
+        if found is None:
+            return None
+        (_, cluster_id, matched_text), similarity = found
+        return cluster_id, matched_text, similarity
+
+    def cached_result(self, key):
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is None:
+                return None
+            if time.time() - cached[0] > self.result_ttl:
+                del self._results[key]
+                return None
+            self._results.move_to_end(key)
+            self.results_reused += 1
+            return cached[1]
+
+    def remember_result(self, key, analysis):
+        with self._lock:
+            self._results[key] = (time.time(), analysis)
+            self._results.move_to_end(key)
+            while len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+
+    def plan(self, texts):
+        return DuplicatePlan(self, texts, self.assign(texts))
+
+    def save(self, path):
+        """
+        Writes the index (not the cached analyses) atomically.
+        """
+        with self._lock:
+            state = dict(self.index.state(), format=INDEX_FORMAT, num_perm=self.index.num_perm,
+                         bands=self.index.bands, seed=self.hasher.seed, shingle_size=self.hasher.shingle_size,
+                         next_id=self._next_id)
+            self.dirty = False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(path))
+        os.close(fd)
+        try:
+            joblib.dump(state, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def load(self, path):
+        """
+        Refills the index from a saved one with the same hashing parameters.
+        Returns the number of texts loaded (0 if there is nothing usable).
+        """
+        if not os.path.isfile(path):
+            return 0
+        state = joblib.load(path)
+        expected = (INDEX_FORMAT, self.index.num_perm, self.index.bands, self.hasher.seed, self.hasher.shingle_size)
+        if (state.get("format"), state.get("num_perm"), state.get("bands"), state.get("seed"),
+                state.get("shingle_size")) != expected:
+            print(f"[DEDUP] Ignoring {path}: saved with different hashing parameters")
+            return 0
+        with self._lock:
+            for signature, entry in zip(state["signatures"], state["entries"]):
+                self.index.insert(signature, entry)
+            self._next_id = max(self._next_id, state["next_id"])
+        return len(state["entries"])
+
+    def metrics(self):
+        return {
+            "indexed": len(self.index),
+            "capacity": self.index.capacity,
+            "threshold": self.threshold,
+            "texts_seen": self.texts_seen,
+            "near_duplicates": self.duplicates,
+            "duplicate_rate": round(self.duplicates / self.texts_seen, 4) if self.texts_seen else 0.0,
+            "results_reused": self.results_reused,
+            "cached_results": len(self._results),
+            "avg_assign_ms": round(1000 * self.lookup_seconds / self.texts_seen, 3) if self.texts_seen else 0.0,
+        }
+
+
+def classification_labels(classification):
+    """
+    The labels two texts must share to share an analysis.
+    """
+    return classification["sentiment"], bool(classification["sarcasm"]), classification["emotion"]
+
+
+class DuplicatePlan:
+    """
+    Which texts of a batch need the pipeline. Texts of one cluster only
+    share an analysis when the classifiers give them the same labels:
+    "I am happy with the service" and "I am unhappy with the service" are
+    near-duplicates, but not the same complaint. The texts that could
+    share one are listed in to_classify; once decide() has their
+    classifications, a text whose cluster has a recent analysis with its
+    labels reuses it, and of the remaining texts only the first of each
+    cluster and labels is run, the rest sharing its analysis.
+    """
+
+    def __init__(self, detector, texts, assignments):
+        self.detector = detector
+        self.assignments = assignments
+        self._all_texts = texts
+        in_batch = Counter(assignment.cluster_id for assignment in assignments)
+        # Near-duplicates of earlier texts, and every text of a cluster repeated in the batch
+        self._classified = [i for i, assignment in enumerate(assignments)
+                            if assignment.is_duplicate or in_batch[assignment.cluster_id] > 1]
+        self.to_classify = [texts[i] for i in self._classified]
+        self.texts = None           # texts to run through the pipeline, set by decide()
+        self._sources = []          # per text: (cached analysis, None, classification) or (None, index into self.texts, classification)
+        self._leaders = {}          # (cluster_id, labels) -> index into self.texts
+
+    def decide(self, classifications):
+        """
+        Takes the classifications of self.to_classify and sets self.texts.
+        """
+        classified = dict(zip(self._classified, classifications))
+        self.texts = []
+        for i, (text, assignment) in enumerate(zip(self._all_texts, self.assignments)):
+            classification = classified.get(i)
+            labels = classification_labels(classification) if classification is not None else None
+            key = (assignment.cluster_id, labels)
+            cached = self.detector.cached_result(key) if assignment.is_duplicate else None
+            if cached is not None:
+                self._sources.append((cached, None, classification))
+                continue
+            leader = self._leaders.get(key)
+            if leader is None:
+                leader = self._leaders[key] = len(self.texts)
+                self.texts.append(text)
+            self._sources.append((None, leader, classification))
+
+    def complete(self, analyses):
+        """
+        Takes the analyses of self.texts and returns one per planned text;
+        near-duplicates are tagged with "near_duplicate". A text sharing
+        another's analysis keeps its own classification.
+        """
+        for (cluster_id, _), leader in self._leaders.items():
+            analysis = analyses[leader]
+            self.detector.remember_result((cluster_id, classification_labels(analysis["classification"])), analysis)
+
+        completed = []
+        led = set()
+        for assignment, (cached, leader, classification) in zip(self.assignments, self._sources):
+            analysis = cached if cached is not None else analyses[leader]
+            if cached is not None or leader in led:
+                analysis = dict(analysis, classification=classification)
+            if leader is not None:
+                led.add(leader)
+            if assignment.is_duplicate:
+                analysis = dict(analysis, near_duplicate={
+                    "cluster": assignment.cluster_id,
+                    "similarity": round(assignment.similarity, 4),
+                })
+            completed.append(analysis)
+        return completed
+
+
+_detector = None
+
+
+def start_near_duplicates(dedup_dir=DEDUP_DIR, interval=SAVE_INTERVAL_SECONDS):
+    """
+    Loads this process's detector from disk once, saving it periodically and at exit.
+    Returns the detector.
+    """
+    global _detector
+    if _detector is None:
+        path = os.path.join(dedup_dir, INDEX_FILE)
+        detector = NearDuplicateDetector()
+        try:
+            loaded = detector.load(path)
+        except Exception as e:
+            print(f"[DEDUP ERROR] Could not load {path}: {str(e)}")
+            loaded = 0
+
+        def save():
+            if detector.dirty:
+                try:
+                    detector.save(path)
+                except Exception as e:
+                    print(f"[DEDUP ERROR] Could not save {path}: {str(e)}")
+
+        def run():
+            while True:
+                time.sleep(interval)
+                save()
+
+        threading.Thread(target=run, name="near-duplicates", daemon=True).start()
+        atexit.register(save)
+        _detector = detector
+        print(f"[DEDUP] Near-duplicate detection at similarity >= {detector.threshold}, "
+              f"{loaded} texts loaded from {path}")
+    return _detector
+
+
+def get_near_duplicates():
+    return _detector
+
+
+def find_duplicate_rows(get_db_connection, threshold=DEDUP_THRESHOLD, page_size=BULK_PAGE_SIZE):
+    """
+    Scans FeedbackResponses for near-duplicate CustomerTexts.
+    Rows with feedback come first, then by Id, so the row kept for a
+    cluster is one somebody reviewed whenever there is one.
+    Returns [(duplicate_id, kept_id, similarity, approved)]; only the kept
+    rows are indexed, so memory grows with the distinct texts.
+    """
+    hasher = MinHasher()
+    index = LSHIndex(capacity=max(page_size, 1))
+    duplicates = []
+    offset = 0
+    while True:
+        conn = get_db_connection()
+        if conn is None:
+            raise RuntimeError("Database connection not available")
+        try:
+            cursor = conn.cursor()
+            cursor.execute(BULK_QUERY, (offset, page_size))
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+        if not rows:
+            break
+        for (row_id, text, approved), signature in zip(rows, hasher.signatures([row[1] for row in rows])):
+            found = index.query(signature, threshold)
+            if found is not None:
+                duplicates.append((row_id, found[0][0], round(found[1], 4), approved))
+                continue
+            if len(index) == index.capacity:
+                index = _grown(index)
+            index.insert(signature, (row_id, row_id, None))
+        offset += len(rows)
+        print(f"[DEDUP] Scanned {offset} rows, {len(duplicates)} near-duplicates so far")
+        if len(rows) < page_size:
+            break
+    return duplicates
+
+
+def _grown(index):
+    # The bulk job must not evict kept rows, so its index doubles instead of wrapping
+    grown = LSHIndex(index.num_perm, index.bands, index.capacity * 2)
+    state = index.state()
+    for signature, entry in zip(state["signatures"], state["entries"]):
+        grown.insert(signature, entry)
+    return grown
+
+
+def delete_duplicate_rows(get_db_connection, duplicates):
+    """
+    Deletes the duplicate rows nobody gave feedback on. Returns the number deleted.
+    """
+    ids = [(duplicate_id,) for duplicate_id, _, _, approved in duplicates if approved is None]
+    if not ids:
+        return 0
+    conn = get_db_connection()
+    if conn is None:
+        raise RuntimeError("Database connection not available")
+    try:
+        cursor = conn.cursor()
+        cursor.executemany(BULK_DELETE_QUERY, ids)
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+    return len(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find near-duplicate feedback in FeedbackResponses.")
+    parser.add_argument("--threshold", type=float, default=DEDUP_THRESHOLD)
+    parser.add_argument("--report", default="near_duplicates.csv", help="CSV of duplicate_id, kept_id, similarity")
+    parser.add_argument("--delete", action="store_true",
+                        help="delete duplicate rows that have no feedback (approved IS NULL)")
+    args = parser.parse_args()
+
+    from db import get_db_connection
+
+    duplicates = find_duplicate_rows(get_db_connection, args.threshold)
+    with open(args.report, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["duplicate_id", "kept_id", "similarity", "approved"])
+        writer.writerows(duplicates)
+    print(f"[DEDUP] {len(duplicates)} near-duplicate rows written to {args.report}")
+    if args.delete:
+        print(f"[DEDUP] Deleted {delete_duplicate_rows(get_db_connection, duplicates)} rows without feedback")
+
+
+if __name__ == "__main__":
+    main()
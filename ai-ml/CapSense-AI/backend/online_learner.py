@@ -0,0 +1,244 @@
+"""
+online_learner.py
+Background incremental learning from approve/reject feedback.
+
+Every few minutes the learner pulls the FeedbackResponses rows approved
+since its last run, in one query, and updates the sentiment, sarcasm and
+emotion models with partial_fit. An approval confirms the labels the
+classifiers produced, so those rows become training examples. Rejected rows
+only say the generated response was wrong, not which label was, so they
+are not trained on.
+
+Each update is trained on a copy of the live model, written as a new
+version through model_store and swapped into this process with
+ActiveModel.publish(). Requests in flight keep the snapshot they started
+with. Use model_store.rollback() to return to an earlier version.
+
+Enable with CAPSENSE_ONLINE_LEARNING=1. With several gunicorn workers only
+the one holding the lock file trains and writes new versions to models/;
+the learner itself only swaps them into that worker. The others load them
+through model_store's watcher (start_watcher), when it is running.
+
+Rows with no label for a head (approved feedback recorded without a
+classification) are left out of that head's update.
+
+Each head keeps its own watermark in online_learner_state.json. A head
+whose update fails keeps its watermark and retries those rows on the next
+run, without the heads that succeeded training on them again.
+"""
+
+import copy
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+import model_store
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:  # Windows: one process, no cross-worker lock needed
+    FCNTL_AVAILABLE = False
+
+LEARN_INTERVAL_SECONDS = int(os.getenv("CAPSENSE_LEARN_INTERVAL", "300"))
+LEARN_MIN_ROWS = int(os.getenv("CAPSENSE_LEARN_MIN_ROWS", "20"))
+LEARN_BATCH_LIMIT = int(os.getenv("CAPSENSE_LEARN_BATCH_LIMIT", "5000"))
+
+STATE_FILE = "online_learner_state.json"
+LOCK_FILE = ".online_learner.lock"
+
+HEADS = ("sentiment", "sarcasm", "emotion")
+START_WATERMARK = {"last_feedback_date": "1900-01-01T00:00:00", "last_id": 0}
+
+# Rows approved after the watermark, oldest first
+FEEDBACK_QUERY = """
+SELECT TOP {limit} Id, CustomerText, Sentiment, SarcasmDetected, Emotion, FeedbackDate
+FROM FeedbackResponses
+WHERE approved = 1
+  AND FeedbackDate IS NOT NULL
+  AND (FeedbackDate > ? OR (FeedbackDate = ? AND Id > ?))
+ORDER BY FeedbackDate, Id;
+"""
+
+_learner = None
+
+
+def start_online_learner(get_db_connection, interval=None):
+    """
+    Starts the background learner thread once per process.
+    Returns the OnlineLearner, or None if another worker already owns it.
+    """
+    global _learner
+    if _learner is not None:
+        return _learner
+    learner = OnlineLearner(get_db_connection, interval or LEARN_INTERVAL_SECONDS)
+    if not learner.acquire_lock():
+        print("[LEARNER] Another worker owns the online learner; not starting here.")
+        return None
+    learner.start()
+    _learner = learner
+    return learner
+
+
+class OnlineLearner:
+    def __init__(self, get_db_connection, interval=LEARN_INTERVAL_SECONDS, models_dir=None):
+        self.get_db_connection = get_db_connection
+        self.interval = interval
+        self.models_dir = models_dir or model_store.MODELS_DIR
+        self.state_path = os.path.join(self.models_dir, STATE_FILE)
+        self.state = self._load_state()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_handle = None
+
+    def acquire_lock(self):
+        if not FCNTL_AVAILABLE:
+            return True
+        os.makedirs(self.models_dir, exist_ok=True)
+        handle = open(os.path.join(self.models_dir, LOCK_FILE), "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._lock_handle = handle
+        return True
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="online-learner", daemon=True)
+        self._thread.start()
+        print(f"[LEARNER] Online learning enabled, polling every {self.interval}s")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[LEARNER ERROR] {str(e)}")
+
+    def run_once(self):
+        """
+        Pulls new feedback and updates every head that has enough examples.
+        Returns {head: new_version} for the heads that were updated.
+        """
+        rows = self.fetch_feedback()
+        if len(rows) < LEARN_MIN_ROWS:
+            # Leave the watermarks alone so these rows are used once enough arrive
+            return {}
+        print(f"[LEARNER] {len(rows)} newly approved feedback rows")
+
+        label_of = {
+            "sentiment": lambda row: row[2],
+            "sarcasm": lambda row: None if row[3] is None else (1 if row[3] else 0),
+            "emotion": lambda row: row[4],
+        }
+        updated = {}
+        for head in HEADS:
+            # Only the rows past this head's own watermark
+            after = self._watermark(head)
+            head_rows = [row for row in rows if (row[5], int(row[0])) > after]
+            if len(head_rows) < LEARN_MIN_ROWS:
+                continue
+            try:
+                version = self.update_head(head, [row[1] for row in head_rows],
+                                           [label_of[head](row) for row in head_rows])
+            except Exception as e:
+                # Keep this head's watermark so the next run retries these rows
+                print(f"[LEARNER ERROR] Failed to update {head} model: {str(e)}")
+                continue
+            if version:
+                updated[head] = version
+            last = head_rows[-1]
+            self.state["heads"][head] = {"last_feedback_date": last[5].isoformat(), "last_id": int(last[0])}
+            self.state["rows_trained"] = self.state.get("rows_trained", 0) + len(head_rows)
+        self._save_state()
+        return updated
+
+    def _watermark(self, head):
+        mark = self.state["heads"][head]
+        return datetime.fromisoformat(mark["last_feedback_date"]), int(mark["last_id"])
+
+    def fetch_feedback(self):
+        conn = self.get_db_connection()
+        if conn is None:
+            return []
+        try:
+            cursor = conn.cursor()
+            # From the head that is furthest behind; the others skip what they already trained on
+            watermark, last_id = min(self._watermark(head) for head in HEADS)
+            cursor.execute(
+                FEEDBACK_QUERY.format(limit=int(LEARN_BATCH_LIMIT)),
+                (watermark, watermark, last_id),
+            )
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
+        finally:
+            conn.close()
+
+    def update_head(self, head, texts, labels):
+        """
+        partial_fit a copy of the live model on the new examples, publish it
+        as a version and swap it in. Returns the new version or None.
+        """
+        active = model_store.ACTIVE_MODELS.get(head)
+        if active is None:
+            return None
+        model, vectorizer, version = active.get()
+        if model is None or vectorizer is None or not hasattr(model, "partial_fit"):
+            return None
+
+        # Stored labels may differ in case from the model's classes ("positive" vs "Positive")
+        class_lookup = {str(label).lower(): label for label in model.classes_}
+        pairs = [(text, class_lookup.get(str(label).lower()))
+                 for text, label in zip(texts, labels) if text and label is not None]
+        pairs = [(text, label) for text, label in pairs if label is not None]
+        if not pairs:
+            return None
+
+        head_texts = [text for text, _ in pairs]
+        if head == "emotion":
+            from classifier_emotion import preprocess_text
+            head_texts = [preprocess_text(text) for text in head_texts]
+
+        X = vectorizer.transform(head_texts)
+        y = np.array([label for _, label in pairs])
+        updated_model = copy.deepcopy(model)
+        updated_model.partial_fit(X, y)
+
+        new_version = model_store.write_version(
+            head, updated_model, vectorizer,
+            metadata={
+                "source": "online_learner",
+                "parent_version": version,
+                "rows": len(pairs),
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            models_dir=self.models_dir,
+        )
+        active.publish(updated_model, vectorizer, new_version)
+        print(f"[LEARNER] {head}: {version} -> {new_version} ({len(pairs)} examples)")
+        return new_version
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            state = {}
+        # A state file from before per-head watermarks holds one shared watermark
+        shared = {key: state.pop(key) for key in START_WATERMARK if key in state} or START_WATERMARK
+        heads = state.setdefault("heads", {})
+        for head in HEADS:
+            heads.setdefault(head, dict(shared))
+        return state
+
+    def _save_state(self):
+        model_store.atomic_write_text(self.state_path, json.dumps(self.state, indent=2))
@@ -1,4 +1,5 @@
 # phi3resgen.py - Updated for Azure AI Foundry with improved error handling
+import asyncio
 import requests
 import json
 import os
@@ -6,6 +7,8 @@ import time
 import random
 import logging
 
+from keyword_index import KeywordIndex
+
 # Set up logging
 logging.basicConfig(
     level=logging.INFO,
@@ -16,12 +19,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger("phi3resgen")
 
-def generate_response(customer_text, classification_data):
+PHI3_TIMEOUT_SECONDS = 30
+
+# Fixed opening of every prompt; the local backend keeps it evaluated in its KV cache
+PROMPT_PREAMBLE = "As a customer service agent for Capgemini, respond to this feedback:"
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+def build_phi3_request(customer_text, classification_data, stream=False):
     """
-    Generates an empathetic response using Phi-3, based on:
-    - Customer feedback text
-    - Classifier outputs (sentiment, sarcasm, emotion)
-    Returns: {"response_text": str, "empathy_score": float}
+    Builds the Azure AI Foundry request for one piece of feedback.
+    Returns (endpoint, headers, payload), or None when PHI3_ENDPOINT or
+    PHI3_KEY is not set. With stream=True the endpoint is asked to send
+    the completion as server-sent events while it is generated.
     """
     # Get environment variables
     phi3_endpoint = os.getenv("PHI3_ENDPOINT")
@@ -32,19 +46,17 @@ def generate_response(customer_text, classification_data):
         logger.warning("PHI3_ENDPOINT or PHI3_KEY environment variables not set. Using fallback response.")
         logger.info(f"PHI3_ENDPOINT is {'set' if phi3_endpoint else 'NOT SET'}")
         logger.info(f"PHI3_KEY is {'set (value hidden)' if phi3_key else 'NOT SET'}")
-        return generate_fallback_response(customer_text, classification_data)
+        return None
     
     # Log the environment variables (partially masked for security)
     logger.info(f"Using PHI3_ENDPOINT: {phi3_endpoint}")
     if phi3_key:
         masked_key = phi3_key[:5] + "..." + phi3_key[-5:] if len(phi3_key) > 10 else "***"
         logger.info(f"Using PHI3_KEY: {masked_key}")
-    
-    # If environment variables are properly set, use Azure AI
-    try:
-        # Prepare the prompt
-        prompt = f"""
-        As a customer service agent for Capgemini, respond to this feedback:
+
+    # Prepare the prompt
+    prompt = f"""
+        {PROMPT_PREAMBLE}
         
         **Customer Feedback**: "{customer_text}"
         **Sentiment**: {classification_data.get('sentiment', 'neutral')}
@@ -53,82 +65,282 @@ def generate_response(customer_text, classification_data):
         
         Write a concise, empathetic response (2-3 sentences):
         """
-        
-        # Prepare the payload for Azure AI Foundry
-        payload = {
-          "input_data": {
-        	"input_string": [
-            		{"role": "user", "content": prompt}
-          ],
-          "parameters": {
+    
+    # Prepare the payload for Azure AI Foundry
+    payload = {
+      "input_data": {
+        "input_string": [
+            {"role": "user", "content": prompt}
+        ],
+        "parameters": {
             "temperature": 0.7,
             "top_p": 1,
             "max_new_tokens": 150
-          }
-      }
-  }
-        
-        # Using bearer token auth which seems to work
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {phi3_key}"
         }
-        
+      }
+    }
+    
+    # Using bearer token auth which seems to work
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {phi3_key}"
+    }
+    if stream:
+        payload["input_data"]["parameters"]["stream"] = True
+        payload["stream"] = True
+        headers["Accept"] = "text/event-stream"
+    return phi3_endpoint, headers, payload
+
+def build_prompt_body(customer_text, classification_data):
+    """
+    The part of the prompt after PROMPT_PREAMBLE, without the indentation
+    the remote prompt carries (used by the local backend).
+    """
+    return (
+        f"\n\n**Customer Feedback**: \"{customer_text}\"\n"
+        f"**Sentiment**: {classification_data.get('sentiment', 'neutral')}\n"
+        f"**Emotion**: {classification_data.get('emotion', 'unknown')}\n"
+        f"**Sarcasm Detected**: {classification_data.get('sarcasm', False)}\n\n"
+        "Write a concise, empathetic response (2-3 sentences):"
+    )
+
+def handle_phi3_response(status_code, response_body, customer_text, classification_data):
+    """
+    Turns the raw Azure AI response (status code and body text) into
+    {"response_text": str, "empathy_score": float}, falling back to a
+    templated response when the call failed or returned nothing usable.
+    """
+    # Check response status
+    logger.info(f"Received status code: {status_code}")
+    
+    # If successful, process the response
+    if status_code == 200:
+        try:
+            # Log the raw response text for debugging
+            logger.info(f"Raw response text: {response_body[:200]}...")
+            
+            # Parse the JSON response
+            if response_body.strip():
+                response_data = json.loads(response_body)
+                logger.info(f"Response type: {type(response_data)}")
+                
+                # Check if we got usable data
+                if isinstance(response_data, dict) and response_data:
+                    logger.info(f"Response keys: {list(response_data.keys())}")
+                elif isinstance(response_data, list):
+                    logger.info(f"Response is a list with {len(response_data)} items")
+                    
+                # Extract the response text using a simple approach
+                response_text = extract_response_text(response_data)
+                
+                if response_text:
+                    logger.info(f"Successfully extracted response: {response_text[:50]}...")
+                    empathy_score = calculate_empathy_score(response_text, classification_data)
+                    return {
+                        "response_text": response_text,
+                        "empathy_score": empathy_score
+                    }
+                else:
+                    logger.warning("Could not extract text from response")
+            else:
+                logger.warning("Empty response received")
+        except Exception as e:
+            logger.error(f"Error processing response: {str(e)}")
+    else:
+        logger.error(f"API request failed with status {status_code}: {response_body}")
+    
+    # If we get here, something went wrong, use fallback
+    return generate_fallback_response(customer_text, classification_data)
+
+def generate_response(customer_text, classification_data):
+    """
+    Generates an empathetic response using Phi-3, based on:
+    - Customer feedback text
+    - Classifier outputs (sentiment, sarcasm, emotion)
+    Returns: {"response_text": str, "empathy_score": float}
+    """
+    phi3_request = build_phi3_request(customer_text, classification_data)
+    if phi3_request is None:
+        return generate_fallback_response(customer_text, classification_data)
+    phi3_endpoint, headers, payload = phi3_request
+    
+    # If environment variables are properly set, use Azure AI
+    try:
         # Make the request to Azure AI Foundry
         logger.info(f"Calling PHI-3 API at {phi3_endpoint}")
         response = requests.post(
             phi3_endpoint, 
             headers=headers,
             json=payload,
-            timeout=30
+            timeout=PHI3_TIMEOUT_SECONDS
         )
-        
-        # Check response status
-        logger.info(f"Received status code: {response.status_code}")
-        
-        # If successful, process the response
-        if response.status_code == 200:
-            try:
-                # Log the raw response text for debugging
-                logger.info(f"Raw response text: {response.text[:200]}...")
-                
-                # Parse the JSON response
-                if response.text.strip():
-                    response_data = response.json()
-                    logger.info(f"Response type: {type(response_data)}")
-                    
-                    # Check if we got usable data
-                    if isinstance(response_data, dict) and response_data:
-                        logger.info(f"Response keys: {list(response_data.keys())}")
-                    elif isinstance(response_data, list):
-                        logger.info(f"Response is a list with {len(response_data)} items")
-                        
-                    # Extract the response text using a simple approach
-                    response_text = extract_response_text(response_data)
-                    
-                    if response_text:
-                        logger.info(f"Successfully extracted response: {response_text[:50]}...")
-                        empathy_score = calculate_empathy_score(response_text, classification_data)
-                        return {
-                            "response_text": response_text,
-                            "empathy_score": empathy_score
-                        }
-                    else:
-                        logger.warning("Could not extract text from response")
-                else:
-                    logger.warning("Empty response received")
-            except Exception as e:
-                logger.error(f"Error processing response: {str(e)}")
-        else:
-            logger.error(f"API request failed with status {response.status_code}: {response.text}")
-        
-        # If we get here, something went wrong, use fallback
-        return generate_fallback_response(customer_text, classification_data)
+        return handle_phi3_response(response.status_code, response.text, customer_text, classification_data)
             
     except Exception as e:
         logger.error(f"Error generating response with Azure AI: {str(e)}")
         return generate_fallback_response(customer_text, classification_data)
 
+async def generate_response_async(customer_text, classification_data, client=None):
+    """
+    Awaitable generate_response for the ASGI server (asgi_app.py).
+    With httpx installed and a client passed in, the Phi-3 call is a
+    non-blocking HTTP request on the event loop; otherwise the blocking
+    version runs on a worker thread.
+    """
+    if client is None or not HTTPX_AVAILABLE:
+        return await asyncio.to_thread(generate_response, customer_text, classification_data)
+
+    phi3_request = build_phi3_request(customer_text, classification_data)
+    if phi3_request is None:
+        return generate_fallback_response(customer_text, classification_data)
+    phi3_endpoint, headers, payload = phi3_request
+
+    try:
+        logger.info(f"Calling PHI-3 API at {phi3_endpoint}")
+        response = await client.post(phi3_endpoint, headers=headers, json=payload, timeout=PHI3_TIMEOUT_SECONDS)
+        return handle_phi3_response(response.status_code, response.text, customer_text, classification_data)
+    except Exception as e:
+        logger.error(f"Error generating response with Azure AI: {str(e)}")
+        return generate_fallback_response(customer_text, classification_data)
+
+def parse_stream_line(line):
+    """
+    The text delta carried by one line of a streamed response, or None for
+    blank lines, comments, "[DONE]" and lines without text.
+    Understands OpenAI-style chunks (choices[0].delta.content or
+    choices[0].text) and text-generation-inference ones (token.text).
+    """
+    if isinstance(line, bytes):
+        line = line.decode("utf-8", errors="replace")
+    line = line.strip()
+    if not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if not data or data == "[DONE]":
+        return None
+    try:
+        chunk = json.loads(data)
+    except ValueError:
+        return data
+    if isinstance(chunk, dict):
+        choices = chunk.get("choices")
+        if choices:
+            choice = choices[0]
+            delta = choice.get("delta") or {}
+            return delta.get("content") or choice.get("text")
+        token = chunk.get("token")
+        if isinstance(token, dict) and not token.get("special"):
+            return token.get("text")
+    return extract_response_text(chunk)
+
+class ResponseStream:
+    """
+    Streams one Phi-3 response chunk by chunk as the endpoint generates it.
+    Iterate with "for chunk in stream" (requests) or "async for chunk in
+    stream" (httpx client); afterwards result() returns the same dict as
+    generate_response. When the endpoint is not configured or fails before
+    sending any text, the templated fallback is yielded as a single chunk;
+    if it fails midway the text received so far is kept.
+    An endpoint that answers with plain JSON instead of events is yielded
+    as one chunk.
+    """
+
+    def __init__(self, customer_text, classification_data, client=None):
+        self.customer_text = customer_text
+        self.classification_data = classification_data
+        self.client = client
+        self.parts = []
+        self.response = None
+        self.first_chunk_seconds = None
+        self._started = time.perf_counter()
+
+    def _chunk(self, text):
+        if self.first_chunk_seconds is None:
+            self.first_chunk_seconds = time.perf_counter() - self._started
+        self.parts.append(text)
+        return text
+
+    def _whole(self, response):
+        self.response = response
+        return self._chunk(response["response_text"])
+
+    def _failed(self, error):
+        logger.error(f"Error streaming response from Azure AI: {str(error)}")
+        if not self.parts:
+            return self._whole(generate_fallback_response(self.customer_text, self.classification_data))
+        return None
+
+    def __iter__(self):
+        phi3_request = build_phi3_request(self.customer_text, self.classification_data, stream=True)
+        if phi3_request is None:
+            yield self._whole(generate_fallback_response(self.customer_text, self.classification_data))
+            return
+        phi3_endpoint, headers, payload = phi3_request
+        try:
+            logger.info(f"Streaming PHI-3 API at {phi3_endpoint}")
+            with requests.post(phi3_endpoint, headers=headers, json=payload, stream=True,
+                               timeout=PHI3_TIMEOUT_SECONDS) as response:
+                if response.status_code != 200 or "event-stream" not in response.headers.get("Content-Type", ""):
+                    yield self._whole(handle_phi3_response(response.status_code, response.text,
+                                                           self.customer_text, self.classification_data))
+                    return
+                for line in response.iter_lines():
+                    text = parse_stream_line(line)
+                    if text:
+                        yield self._chunk(text)
+        except Exception as e:
+            text = self._failed(e)
+            if text:
+                yield text
+            return
+        if not self.parts:
+            yield self._whole(generate_fallback_response(self.customer_text, self.classification_data))
+
+    async def __aiter__(self):
+        if self.client is None or not HTTPX_AVAILABLE:
+            yield self._whole(await generate_response_async(self.customer_text, self.classification_data))
+            return
+        phi3_request = build_phi3_request(self.customer_text, self.classification_data, stream=True)
+        if phi3_request is None:
+            yield self._whole(generate_fallback_response(self.customer_text, self.classification_data))
+            return
+        phi3_endpoint, headers, payload = phi3_request
+        try:
+            logger.info(f"Streaming PHI-3 API at {phi3_endpoint}")
+            async with self.client.stream("POST", phi3_endpoint, headers=headers, json=payload,
+                                          timeout=PHI3_TIMEOUT_SECONDS) as response:
+                if response.status_code != 200 or "event-stream" not in response.headers.get("content-type", ""):
+                    body = (await response.aread()).decode("utf-8", errors="replace")
+                    yield self._whole(handle_phi3_response(response.status_code, body,
+                                                           self.customer_text, self.classification_data))
+                    return
+                async for line in response.aiter_lines():
+                    text = parse_stream_line(line)
+                    if text:
+                        yield self._chunk(text)
+        except Exception as e:
+            text = self._failed(e)
+            if text:
+                yield text
+            return
+        if not self.parts:
+            yield self._whole(generate_fallback_response(self.customer_text, self.classification_data))
+
+    def result(self):
+        if self.response is not None:
+            return self.response
+        response_text = "".join(self.parts).strip()
+        return {
+            "response_text": response_text,
+            "empathy_score": calculate_empathy_score(response_text, self.classification_data)
+        }
+
+def generate_response_stream(customer_text, classification_data, client=None):
+    """
+    Streaming counterpart of generate_response; see ResponseStream.
+    """
+    return ResponseStream(customer_text, classification_data, client)
+
 def extract_response_text(response_data):
     """
     Extracts response text from various possible response formats.
@@ -173,89 +385,139 @@ def extract_response_text(response_data):
     # Couldn't find any usable text
     return None
 
-def generate_fallback_response(customer_text, classification_data):
-    """
-    Generates a fallback response when the Azure AI service is unavailable
-    """
-    logger.info("Using fallback response generation")
-    sentiment = classification_data.get('sentiment', 'neutral').lower()
-    emotion = classification_data.get('emotion', 'unknown').lower()
-    is_sarcastic = classification_data.get('sarcasm', False)
-    
-    # Templates for different sentiment categories
-    positive_templates = [
+# Fallback templates by sentiment, built once at import
+FALLBACK_TEMPLATES = {
+    "positive": (
         "Thank you for your positive feedback! We're thrilled to hear you're enjoying our service. Your support means a lot to us.",
         "We appreciate your kind words and positive feedback. It's wonderful to know our efforts have led to a good experience for you.",
         "Thank you for sharing such positive thoughts with us. We're committed to maintaining the quality you've highlighted."
-    ]
-    
-    negative_templates = [
+    ),
+    "negative": (
         "We sincerely apologize for your negative experience. Your feedback is important to us, and we'd like to address your concerns to make things right.",
         "We're sorry to hear about your disappointing experience. We take your feedback seriously and will work to improve based on your comments.",
         "Thank you for bringing this issue to our attention. We apologize for the inconvenience and are committed to resolving this situation."
-    ]
-    
-    neutral_templates = [
+    ),
+    "neutral": (
         "Thank you for your feedback. We value your input and will take your comments into consideration for future improvements.",
         "We appreciate you taking the time to share your thoughts with us. Your feedback helps us improve our services.",
         "Thank you for reaching out. We're constantly working to enhance our offerings based on customer input like yours."
-    ]
-    
+    )
+}
+
+# Emotion-specific acknowledgment added to negative responses
+EMOTIONAL_ACKNOWLEDGMENTS = {
+    "anger": "We understand this situation has been frustrating for you.",
+    "sadness": "We understand this experience has been disappointing for you.",
+    "fear": "We understand your concerns and take them very seriously.",
+    "disgust": "We understand this experience has been unpleasant for you."
+}
+
+SARCASM_ACKNOWLEDGMENT = "We appreciate your candid feedback and want to address the underlying concerns."
+
+TEMPLATE_EMPATHY_SCORE = 0.7  # Reasonable default for templated responses
+
+def fallback_response_text(classification_data):
+    """
+    The templated response for one classification.
+    """
+    sentiment = classification_data.get('sentiment', 'neutral').lower()
+    emotion = classification_data.get('emotion', 'unknown').lower()
+    is_sarcastic = classification_data.get('sarcasm', False)
+
     # Select template based on sentiment
-    if sentiment == "positive":
-        template = random.choice(positive_templates)
-    elif sentiment == "negative":
-        template = random.choice(negative_templates)
-    else:
-        template = random.choice(neutral_templates)
-    
+    template = random.choice(FALLBACK_TEMPLATES.get(sentiment, FALLBACK_TEMPLATES["neutral"]))
+
     # Add emotion-specific acknowledgment for negative sentiment
-    if sentiment == "negative" and emotion in ["anger", "sadness", "fear", "disgust"]:
-        emotional_acknowledgments = {
-            "anger": "We understand this situation has been frustrating for you.",
-            "sadness": "We understand this experience has been disappointing for you.",
-            "fear": "We understand your concerns and take them very seriously.",
-            "disgust": "We understand this experience has been unpleasant for you."
-        }
-        template += " " + emotional_acknowledgments.get(emotion, "")
-    
+    if sentiment == "negative" and emotion in EMOTIONAL_ACKNOWLEDGMENTS:
+        template += " " + EMOTIONAL_ACKNOWLEDGMENTS[emotion]
+
     # Add sarcasm acknowledgment if detected
     if is_sarcastic:
-        template += " We appreciate your candid feedback and want to address the underlying concerns."
-    
-    empathy_score = 0.7  # Reasonable default for templated responses
-    
+        template += " " + SARCASM_ACKNOWLEDGMENT
+    return template
+
+def generate_fallback_response(customer_text, classification_data):
+    """
+    Generates a fallback response when the Azure AI service is unavailable
+    """
+    logger.info("Using fallback response generation")
+    template = fallback_response_text(classification_data)
     logger.info(f"Generated fallback response: {template[:50]}...")
     return {
         "response_text": template,
-        "empathy_score": empathy_score
+        "empathy_score": TEMPLATE_EMPATHY_SCORE
     }
 
-def calculate_empathy_score(response_text, classification_data):
+def generate_fallback_responses(items):
     """
-    Calculates an empathy score based on response length, sentiment acknowledgment,
-    and presence of empathetic phrases
+    generate_fallback_response for a list of (customer_text, classification_data),
+    logged once for the whole batch.
+    """
+    responses = [{"response_text": fallback_response_text(classification_data),
+                  "empathy_score": TEMPLATE_EMPATHY_SCORE}
+                 for _, classification_data in items]
+    if responses:
+        logger.info(f"Generated {len(responses)} fallback responses")
+    return responses
+
+# Phrases that signal empathy, matched anywhere in the lowercased response
+# ("help" also counts "helpful"); compiled once into one automaton (see keyword_index.py)
+EMPATHY_PHRASES = (
+    "understand", "appreciate", "sorry", "thank you",
+    "apologize", "help", "resolve", "assist",
+    "feel", "concern", "important", "value"
+)
+EMPATHY_INDEX = KeywordIndex({phrase: phrase for phrase in EMPATHY_PHRASES}, whole_words=False)
+
+def empathy_phrase_hits(response_texts):
+    """
+    {phrase: occurrences} of the empathy phrases in each response, from a
+    single scan over all of them.
+    """
+    return EMPATHY_INDEX.count_phrases_batch(response_texts)
+
+def empathy_score_from_hits(length, hits):
+    """
+    The empathy score of a response of length characters with these phrase hits.
     """
     score = 0.5  # Base score
-    
+
     # Length factor (longer responses often show more care, up to a point)
-    length = len(response_text)
     if 50 <= length <= 200:
         score += 0.2
     elif length > 200:
         score += 0.1  # Very long responses might be less effective
-    
-    # Check for empathetic phrases
-    empathy_phrases = [
-        "understand", "appreciate", "sorry", "thank you", 
-        "apologize", "help", "resolve", "assist",
-        "feel", "concern", "important", "value"
-    ]
-    
-    response_lower = response_text.lower()
-    phrase_count = sum(1 for phrase in empathy_phrases if phrase in response_lower)
-    phrase_score = min(0.3, phrase_count * 0.05)  # Cap at 0.3
+
+    # Each distinct empathetic phrase present counts once
+    phrase_score = min(0.3, len(hits) * 0.05)  # Cap at 0.3
     score += phrase_score
-    
+
     # Round to 2 decimal places and ensure score is between 0 and 1
-    return round(min(max(score, 0), 1), 2)
\ No newline at end of file
+    return round(min(max(score, 0), 1), 2)
+
+def score_empathy_batch(response_texts):
+    """
+    Empathy scores for a list of responses in one pass.
+    Returns (scores, hits): a list of floats and, for analytics, each
+    response's {phrase: occurrences} found by the same scan.
+    """
+    hits = empathy_phrase_hits(response_texts)
+    # A score only depends on the length band and the distinct phrases (capped at 6)
+    known = {}
+    scores = []
+    for text, text_hits in zip(response_texts, hits):
+        length = len(text)
+        key = (length < 50, length > 200, min(len(text_hits), 6))
+        score = known.get(key)
+        if score is None:
+            score = known[key] = empathy_score_from_hits(length, text_hits)
+        scores.append(score)
+    return scores, hits
+
+def calculate_empathy_score(response_text, classification_data):
+    """
+    Calculates an empathy score based on response length, sentiment acknowledgment,
+    and presence of empathetic phrases
+    """
+    scores, _ = score_empathy_batch([response_text])
+    return scores[0]
\ No newline at end of file
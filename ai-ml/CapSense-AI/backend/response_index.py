@@ -0,0 +1,295 @@
+"""
+response_index.py
+Reuse of human-approved responses for near-identical feedback.
+
+FeedbackResponses already holds many responses a person approved through
+/api/feedback (approved = 1). When new feedback is close enough to one of
+those texts, its approved response is reused instead of calling Phi-3.
+
+Texts are turned into TF-IDF vectors with one of the classifiers'
+CountVectorizers (app.py uses the emotion one: 5000 unigrams and bigrams,
+the widest vocabulary of the three); the IDF weights come from the
+approved texts themselves. Both the indexed texts and the queries go
+through the preprocessing that vectorizer was fitted on (for the emotion
+one, classifier_emotion.preprocess_text, which drops stopwords), so the
+words it never saw are not counted against a text's coverage. The index is an exact brute-force
+cosine search: one sparse matrix product against all approved texts, which
+stays in the low milliseconds for tens of thousands of entries. A match is
+only reused if its similarity reaches the threshold and its stored
+sentiment agrees with the new text's. Texts with too few words the
+vocabulary knows ("delivery late") are never matched, since a cosine over
+two terms says little about the rest of the complaint.
+
+A background thread keeps the index current: it pulls rows whose
+FeedbackDate moved past its watermark, adds the approved ones and drops
+the ones that were rejected since.
+
+Configuration:
+    CAPSENSE_REUSE_RESPONSES=0        always call the LLM
+    CAPSENSE_REUSE_THRESHOLD          cosine similarity needed (default: 0.9)
+    CAPSENSE_REUSE_POLL_SECONDS       index refresh interval (default: 60)
+"""
+
+import copy
+import threading
+import time
+from datetime import datetime
+import os
+
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+REUSE_THRESHOLD = float(os.getenv("CAPSENSE_REUSE_THRESHOLD", "0.9"))
+REUSE_POLL_SECONDS = int(os.getenv("CAPSENSE_REUSE_POLL_SECONDS", "60"))
+REUSE_BATCH_LIMIT = 5000
+
+# A text needs this many distinct known terms, making up this share of its words, to be matched
+REUSE_MIN_TERMS = 3
+REUSE_MIN_COVERAGE = 0.5
+
+# Recompute every document vector once the corpus grew this much since the last reweighting
+REWEIGHT_GROWTH = 1.25
+
+# Rows whose feedback changed after the watermark, oldest first
+APPROVAL_QUERY = """
+SELECT TOP {limit} Id, CustomerText, ResponseText, Sentiment, approved, FeedbackDate
+FROM FeedbackResponses
+WHERE FeedbackDate IS NOT NULL
+  AND (FeedbackDate > ? OR (FeedbackDate = ? AND Id > ?))
+ORDER BY FeedbackDate, Id;
+"""
+
+
+class ResponseMatch:
+    def __init__(self, entry_id, customer_text, response_text, sentiment, similarity):
+        self.entry_id = entry_id
+        self.customer_text = customer_text
+        self.response_text = response_text
+        self.sentiment = sentiment
+        self.similarity = similarity
+
+
+class ResponseIndex:
+    """
+    prepare maps a raw text to what vectorizer expects (the text unchanged by default).
+    """
+
+    def __init__(self, vectorizer, threshold=REUSE_THRESHOLD, prepare=None):
+        # Private copy: a hot-swapped classifier must not change the index's vocabulary
+        self.vectorizer = copy.deepcopy(vectorizer)
+        self.threshold = threshold
+        self.prepare = prepare or (lambda text: text)
+        self._lock = threading.RLock()
+        self._analyzer = self.vectorizer.build_analyzer()
+        vocabulary_size = len(self.vectorizer.vocabulary_)
+        self._df = np.zeros(vocabulary_size, dtype=np.float64)
+        self._counts = sparse.csr_matrix((0, vocabulary_size), dtype=np.float64)
+        self._matrix = sparse.csr_matrix((0, vocabulary_size), dtype=np.float64)
+        self._idf = np.ones(vocabulary_size, dtype=np.float64)
+        self._weighted_at = 0
+        self._entries = []      # (entry_id, customer_text, response_text, sentiment) per row
+        self._rows = {}         # entry_id -> row
+        self._alive = 0
+
+        self.lookups = 0
+        self.hits = 0
+        self.lookup_seconds = 0.0
+
+    def __len__(self):
+        return self._alive
+
+    def _tfidf(self, counts):
+        return normalize(counts.multiply(self._idf).tocsr(), norm="l2", copy=False)
+
+    def _reweight(self):
+        n = self._counts.shape[0]
+        self._idf = np.log((1.0 + n) / (1.0 + self._df)) + 1.0
+        self._matrix = self._tfidf(self._counts)
+        for row, entry in enumerate(self._entries):
+            if entry is None:
+                self._zero_row(row)
+        self._weighted_at = n
+
+    def _zero_row(self, row):
+        start, end = self._matrix.indptr[row], self._matrix.indptr[row + 1]
+        self._matrix.data[start:end] = 0.0
+
+    def add_many(self, items):
+        """
+        Adds approved (entry_id, customer_text, response_text, sentiment)
+        items; an entry_id already present is replaced.
+        """
+        items = [item for item in items if item[1] and item[2]]
+        if not items:
+            return 0
+        for item in items:
+            self.remove(item[0])
+        counts = self.vectorizer.transform([self.prepare(item[1]) for item in items]).astype(np.float64)
+        with self._lock:
+            first_row = self._counts.shape[0]
+            self._df += np.asarray((counts > 0).sum(axis=0)).ravel()
+            self._counts = sparse.vstack([self._counts, counts], format="csr")
+            for offset, item in enumerate(items):
+                self._entries.append(tuple(item))
+                self._rows[item[0]] = first_row + offset
+            self._alive += len(items)
+            if self._counts.shape[0] > self._weighted_at * REWEIGHT_GROWTH:
+                self._reweight()
+            else:
+                self._matrix = sparse.vstack([self._matrix, self._tfidf(counts)], format="csr")
+        return len(items)
+
+    def remove(self, entry_id):
+        with self._lock:
+            row = self._rows.pop(entry_id, None)
+            if row is None:
+                return False
+            self._entries[row] = None
+            self._df[self._counts.indices[self._counts.indptr[row]:self._counts.indptr[row + 1]]] -= 1
+            self._zero_row(row)
+            self._alive -= 1
+            return True
+
+    def is_matchable(self, prepared):
+        """
+        True if enough of the (prepared) text's words are in the vocabulary to compare it.
+        """
+        tokens = [token for token in self._analyzer(prepared) if " " not in token]  # words, not n-grams
+        vocabulary = self.vectorizer.vocabulary_
+        known = [token for token in tokens if token in vocabulary]
+        return len(set(known)) >= REUSE_MIN_TERMS and len(known) >= REUSE_MIN_COVERAGE * len(tokens)
+
+    def lookup_batch(self, texts, sentiments=None):
+        """
+        Returns, for each text, the best approved ResponseMatch at or above
+        the threshold (with the same sentiment when sentiments are given), or None.
+        """
+        start = time.perf_counter()
+        matches = [None] * len(texts)
+        with self._lock:
+            prepared = [self.prepare(text) for text in texts] if self._alive else []
+            matchable = [i for i, text in enumerate(prepared) if self.is_matchable(text)]
+            if matchable:
+                queries = self._tfidf(self.vectorizer.transform([prepared[i] for i in matchable]).astype(np.float64))
+                scores = (queries @ self._matrix.T).tocsr()
+                for q, i in enumerate(matchable):
+                    begin, end = scores.indptr[q], scores.indptr[q + 1]
+                    row_scores = scores.data[begin:end]
+                    candidates = np.flatnonzero(row_scores >= self.threshold)
+                    for k in candidates[np.argsort(-row_scores[candidates])]:
+                        entry = self._entries[scores.indices[begin + k]]
+                        if entry is None:
+                            continue
+                        if sentiments is not None and entry[3] and entry[3] != sentiments[i]:
+                            continue
+                        matches[i] = ResponseMatch(entry[0], entry[1], entry[2], entry[3], float(row_scores[k]))
+                        break
+        self.lookups += len(texts)
+        self.hits += sum(match is not None for match in matches)
+        self.lookup_seconds += time.perf_counter() - start
+        return matches
+
+    def lookup(self, text, sentiment=None):
+        return self.lookup_batch([text], None if sentiment is None else [sentiment])[0]
+
+    def metrics(self):
+        return {
+            "entries": self._alive,
+            "threshold": self.threshold,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "llm_calls_avoided": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "avg_lookup_ms": round(1000 * self.lookup_seconds / self.lookups, 3) if self.lookups else 0.0,
+        }
+
+
+class ResponseIndexUpdater:
+    """
+    Keeps a ResponseIndex in step with the approvals in FeedbackResponses.
+    """
+
+    def __init__(self, index, get_db_connection, interval=REUSE_POLL_SECONDS):
+        self.index = index
+        self.get_db_connection = get_db_connection
+        self.interval = interval
+        self.watermark = (datetime(1900, 1, 1), 0)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="response-index", daemon=True)
+        self._thread.start()
+        print(f"[RESPONSE INDEX] Reusing approved responses at similarity >= {self.index.threshold}, "
+              f"refreshing every {self.interval}s")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[RESPONSE INDEX ERROR] {str(e)}")
+            if self._stop.wait(self.interval):
+                return
+
+    def run_once(self):
+        """
+        Applies every feedback change since the watermark. Returns (added, removed).
+        """
+        added = removed = 0
+        while True:
+            rows = self.fetch_changes()
+            if not rows:
+                break
+            approved = [(row[0], row[1], row[2], row[3]) for row in rows if row[4]]
+            for row in rows:
+                if not row[4] and self.index.remove(row[0]):
+                    removed += 1
+            added += self.index.add_many(approved)
+            self.watermark = (rows[-1][5], int(rows[-1][0]))
+            if len(rows) < REUSE_BATCH_LIMIT:
+                break
+        if added or removed:
+            print(f"[RESPONSE INDEX] +{added} / -{removed} approved responses ({len(self.index)} indexed)")
+        return added, removed
+
+    def fetch_changes(self):
+        conn = self.get_db_connection()
+        if conn is None:
+            return []
+        try:
+            cursor = conn.cursor()
+            last_date, last_id = self.watermark
+            cursor.execute(APPROVAL_QUERY.format(limit=int(REUSE_BATCH_LIMIT)), (last_date, last_date, last_id))
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
+        finally:
+            conn.close()
+
+
+_index = None
+
+
+def start_response_index(vectorizer, get_db_connection, threshold=REUSE_THRESHOLD, interval=REUSE_POLL_SECONDS,
+                         prepare=None):
+    """
+    Builds this process's index and starts its updater once. Returns the
+    index, or None (reuse stays off) when there is no vectorizer to build it from.
+    """
+    global _index
+    if vectorizer is None:
+        print("[RESPONSE INDEX] No vectorizer loaded, approved responses will not be reused")
+        return None
+    if _index is None:
+        _index = ResponseIndex(vectorizer, threshold, prepare)
+        ResponseIndexUpdater(_index, get_db_connection, interval).start()
+    return _index
+
+
+def get_response_index():
+    return _index
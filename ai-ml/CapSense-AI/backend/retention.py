@@ -0,0 +1,451 @@
+"""
+retention.py
+Monthly partitions of FeedbackResponses and archive-and-drop retention.
+
+FeedbackResponses is partitioned by month on CreatedAt (partition function
+pfFeedbackResponsesMonthly, RANGE RIGHT on the first day of each month).
+Old data leaves the table one whole partition at a time. The retention
+manager writes each partition that lies entirely before the last
+CAPSENSE_RETENTION_MONTHS months to a compressed file in
+CAPSENSE_ARCHIVE_DIR (Parquet when pyarrow is installed, gzipped CSV
+otherwise), then truncates the partition and merges its boundary away.
+Neither step is a row-by-row DELETE, so retention takes the same time on a
+huge table as on a small one and never holds long row locks. Month
+partitions are split off ahead of time while they are still empty, which
+is a metadata-only change as well.
+
+Startup only makes sure the upcoming partitions exist (ensure_partitions);
+it never reads or deletes rows.
+
+    python retention.py setup             print the one-off DDL that partitions the table (--apply runs it)
+    python retention.py status            partitions and their row counts
+    python retention.py run               archive and drop expired partitions
+    python retention.py --sqlite local.db status|run   the same on the SQLite stand-in (db_fallback.py)
+
+TRUNCATE TABLE ... WITH (PARTITIONS) needs SQL Server 2016 or Azure SQL and
+every index on the table aligned with the partition scheme (setup creates
+them that way). Retention runs under an application lock, so only one
+instance at a time archives and drops.
+
+Configuration:
+    CAPSENSE_RETENTION=1                    run retention in this process every interval
+    CAPSENSE_RETENTION_MONTHS               months of feedback kept in the table (default: 12)
+    CAPSENSE_RETENTION_INTERVAL_SECONDS     time between retention runs (default: 86400)
+    CAPSENSE_PARTITIONS_AHEAD               empty month partitions kept ready (default: 3)
+    CAPSENSE_ARCHIVE_DIR                    archived partitions (default: backend/archive)
+"""
+
+import argparse
+import csv
+import gzip
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+RETENTION_MONTHS = int(os.getenv("CAPSENSE_RETENTION_MONTHS", "12"))
+RETENTION_INTERVAL_SECONDS = float(os.getenv("CAPSENSE_RETENTION_INTERVAL_SECONDS", "86400"))
+PARTITIONS_AHEAD = int(os.getenv("CAPSENSE_PARTITIONS_AHEAD", "3"))
+ARCHIVE_DIR = os.getenv("CAPSENSE_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+TABLE = "FeedbackResponses"
+PARTITION_FUNCTION = "pfFeedbackResponsesMonthly"
+PARTITION_SCHEME = "psFeedbackResponsesMonthly"
+RETENTION_LOCK = "capsense-retention"
+ARCHIVE_BATCH_ROWS = 10000
+
+BOUNDARIES_QUERY = """
+SELECT CAST(rv.value AS DATETIME)
+FROM sys.partition_range_values rv
+JOIN sys.partition_functions pf ON pf.function_id = rv.function_id
+WHERE pf.name = ?
+ORDER BY rv.boundary_id;
+"""
+
+PARTITION_ROWS_QUERY = f"""
+SELECT partition_number, rows
+FROM sys.partitions
+WHERE object_id = OBJECT_ID('{TABLE}') AND index_id IN (0, 1);
+"""
+
+PARTITION_SELECT_QUERY = f"SELECT * FROM {TABLE} WHERE $PARTITION.{PARTITION_FUNCTION}(CreatedAt) = ?;"
+
+# One partition: [start, end) on CreatedAt; None for the open ends
+Partition = namedtuple("Partition", ["number", "start", "end", "rows"])
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(moment, months):
+    years, month = divmod(moment.month - 1 + months, 12)
+    return datetime(moment.year + years, month + 1, 1)
+
+
+def sql_datetime(moment):
+    # Boundaries are generated here, never taken from input, so a literal is safe
+    return f"'{moment:%Y-%m-%dT%H:%M:%S}'"
+
+
+def setup_statements(now=None, history_months=RETENTION_MONTHS, ahead=PARTITIONS_AHEAD):
+    """
+    The one-off DDL that moves an existing FeedbackResponses onto monthly
+    partitions: history_months back to ahead months forward. Run it in a
+    maintenance window; rebuilding the clustered index rewrites the table once.
+    """
+    first = add_months(month_start(now or datetime.now()), -history_months)
+    boundaries = ", ".join(sql_datetime(add_months(first, k)) for k in range(history_months + ahead + 1))
+    return [
+        f"CREATE PARTITION FUNCTION {PARTITION_FUNCTION} (DATETIME) AS RANGE RIGHT FOR VALUES ({boundaries});",
+        f"CREATE PARTITION SCHEME {PARTITION_SCHEME} AS PARTITION {PARTITION_FUNCTION} ALL TO ([PRIMARY]);",
+        f"UPDATE {TABLE} SET CreatedAt = COALESCE(FeedbackDate, GETDATE()) WHERE CreatedAt IS NULL;",
+        f"ALTER TABLE {TABLE} ALTER COLUMN CreatedAt DATETIME NOT NULL;",
+        # The primary key is rebuilt as (Id, CreatedAt) so it can be aligned with the scheme
+        f"""DECLARE @pk sysname = (SELECT name FROM sys.key_constraints
+                       WHERE parent_object_id = OBJECT_ID('{TABLE}') AND type = 'PK');
+IF @pk IS NOT NULL EXEC('ALTER TABLE {TABLE} DROP CONSTRAINT ' + QUOTENAME(@pk));""",
+        f"CREATE CLUSTERED INDEX CIX_{TABLE}_CreatedAt ON {TABLE} (CreatedAt) "
+        f"ON {PARTITION_SCHEME} (CreatedAt);",
+        f"ALTER TABLE {TABLE} ADD CONSTRAINT PK_{TABLE} PRIMARY KEY NONCLUSTERED (Id, CreatedAt) "
+        f"ON {PARTITION_SCHEME} (CreatedAt);",
+    ]
+
+
+class SqlServerPartitions:
+    """
+    The partitions of FeedbackResponses on SQL Server / Azure SQL.
+    """
+
+    def __init__(self, get_db_connection):
+        self.get_db_connection = get_db_connection
+
+    def connect(self):
+        conn = self.get_db_connection()
+        if conn is None:
+            raise RuntimeError("Database connection not available")
+        return conn
+
+    def _partitions(self, cursor):
+        cursor.execute(BOUNDARIES_QUERY, (PARTITION_FUNCTION,))
+        boundaries = [row[0] for row in cursor.fetchall()]
+        if not boundaries:
+            return []
+        cursor.execute(PARTITION_ROWS_QUERY)
+        rows = {number: count for number, count in cursor.fetchall()}
+        edges = [None] + boundaries + [None]
+        return [Partition(number, edges[number - 1], edges[number], rows.get(number, 0))
+                for number in range(1, len(edges))]
+
+    def partitions(self):
+        conn = self.connect()
+        try:
+            return self._partitions(conn.cursor())
+        finally:
+            conn.close()
+
+    def ensure(self, now=None, ahead=PARTITIONS_AHEAD):
+        """
+        Splits off the month partitions up to ahead months from now. Only the
+        empty partition at the end is ever split, so no rows move.
+        Returns the boundaries added.
+        """
+        now = now or datetime.now()
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            partitions = self._partitions(cursor)
+            if not partitions:
+                print(f"[RETENTION] {TABLE} is not partitioned yet; see 'python retention.py setup'")
+                return []
+            added = []
+            last = partitions[-1].start
+            for k in range(ahead + 1):
+                boundary = add_months(month_start(now), k)
+                if boundary <= last:
+                    continue
+                if partitions[-1].rows:
+                    print(f"[RETENTION] The last partition of {TABLE} holds rows; not splitting at {boundary:%Y-%m}")
+                    break
+                cursor.execute(f"ALTER PARTITION SCHEME {PARTITION_SCHEME} NEXT USED [PRIMARY];")
+                cursor.execute(f"ALTER PARTITION FUNCTION {PARTITION_FUNCTION}() SPLIT RANGE ({sql_datetime(boundary)});")
+                conn.commit()
+                added.append(boundary)
+                last = boundary
+            return added
+        finally:
+            conn.close()
+
+    def read(self, partition, batch_rows=ARCHIVE_BATCH_ROWS):
+        """
+        Yields (column_names, rows) batches of one partition.
+        """
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(PARTITION_SELECT_QUERY, (partition.number,))
+            columns = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batch_rows)
+                if not rows:
+                    break
+                yield columns, [tuple(row) for row in rows]
+        finally:
+            conn.close()
+
+    def drop(self, partition):
+        """
+        Empties a partition and merges it into the one before it.
+        """
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"TRUNCATE TABLE {TABLE} WITH (PARTITIONS ({int(partition.number)}));")
+            if partition.start is not None:
+                cursor.execute(f"ALTER PARTITION FUNCTION {PARTITION_FUNCTION}() "
+                               f"MERGE RANGE ({sql_datetime(partition.start)});")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def lock(self):
+        """
+        A connection holding the retention application lock, or None if another instance has it.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute("SET NOCOUNT ON; DECLARE @result INT; "
+                       "EXEC @result = sp_getapplock @Resource = ?, @LockMode = 'Exclusive', "
+                       "@LockOwner = 'Session', @LockTimeout = 0; SELECT @result;", (RETENTION_LOCK,))
+        if cursor.fetchone()[0] < 0:
+            conn.close()
+            return None
+        return conn
+
+
+def archive_name(partition):
+    if partition.start is None:
+        return f"{TABLE}-before-{partition.end:%Y-%m}"
+    return f"{TABLE}-{partition.start:%Y-%m}"
+
+
+def write_archive(path, batches):
+    """
+    Writes (column_names, rows) batches to path (.parquet or .csv.gz) through
+    a temporary file, so a crash never leaves a partial archive behind.
+    Returns the number of rows written.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(path))
+    os.close(fd)
+    count = 0
+    try:
+        if path.endswith(".parquet"):
+            writer = None
+            try:
+                for columns, rows in batches:
+                    data = {name: [row[i] for row in rows] for i, name in enumerate(columns)}
+                    if writer is None:
+                        schema = pa.Table.from_pydict(data).schema
+                        # A column that is all NULL in the first batch is typed by the later ones as text
+                        schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                                            for field in schema])
+                        writer = pq.ParquetWriter(tmp_path, schema, compression="zstd")
+                    writer.write_table(pa.Table.from_pydict(data, schema=schema))
+                    count += len(rows)
+            finally:
+                if writer is not None:
+                    writer.close()
+        else:
+            with gzip.open(tmp_path, "wt", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                for columns, rows in batches:
+                    if count == 0:
+                        writer.writerow(columns)
+                    writer.writerows(rows)
+                    count += len(rows)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return count
+
+
+class RetentionManager:
+    """
+    Archives and drops the partitions older than retention_months.
+    """
+
+    def __init__(self, store, retention_months=RETENTION_MONTHS, archive_dir=ARCHIVE_DIR):
+        self.store = store
+        self.retention_months = retention_months
+        self.archive_dir = archive_dir
+        self.extension = ".parquet" if PYARROW_AVAILABLE else ".csv.gz"
+        self.runs = 0
+        self.partitions_dropped = 0
+        self.rows_archived = 0
+        self.last_run = None
+        self.last_run_seconds = None
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def cutoff(self, now=None):
+        return add_months(month_start(now or datetime.now()), -self.retention_months)
+
+    def expired(self, partitions, cutoff):
+        # The first partition has no lower boundary to merge away, so once empty it stays
+        return [p for p in partitions if p.end is not None and p.end <= cutoff and (p.rows or p.start is not None)]
+
+    def run(self, now=None):
+        """
+        One retention pass: archive and drop every expired partition, oldest
+        first, then make sure the upcoming partitions exist.
+        Returns [(archive_path, rows)] for the partitions dropped.
+        """
+        with self._lock:
+            started = time.perf_counter()
+            lock = self.store.lock()
+            if lock is None:
+                print("[RETENTION] Another instance is running retention; skipping")
+                return []
+            try:
+                dropped = []
+                cutoff = self.cutoff(now)
+                while True:
+                    # Partition numbers shift after each merge, so list them again
+                    expired = self.expired(self.store.partitions(), cutoff)
+                    if not expired:
+                        break
+                    partition = expired[0]
+                    path = None
+                    rows = 0
+                    if partition.rows:
+                        path = os.path.join(self.archive_dir, archive_name(partition) + self.extension)
+                        rows = write_archive(path, self.store.read(partition))
+                    self.store.drop(partition)
+                    print(f"[RETENTION] Dropped partition {archive_name(partition)} "
+                          f"({rows} rows archived to {path})")
+                    dropped.append((path, rows))
+                    self.partitions_dropped += 1
+                    self.rows_archived += rows
+                self.store.ensure(now)
+                self.last_error = None
+                return dropped
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+            finally:
+                lock.close()
+                self.runs += 1
+                self.last_run = datetime.now().isoformat(timespec="seconds")
+                self.last_run_seconds = time.perf_counter() - started
+
+    def metrics(self):
+        return {
+            "retention_months": self.retention_months,
+            "archive_dir": self.archive_dir,
+            "archive_format": self.extension.lstrip("."),
+            "runs": self.runs,
+            "partitions_dropped": self.partitions_dropped,
+            "rows_archived": self.rows_archived,
+            "last_run": self.last_run,
+            "last_run_seconds": round(self.last_run_seconds, 3) if self.last_run_seconds is not None else None,
+            "last_error": self.last_error
+        }
+
+
+def ensure_partitions(store, now=None):
+    """
+    Startup check: adds the upcoming month partitions. Touches no rows.
+    """
+    added = store.ensure(now)
+    if added:
+        print(f"[RETENTION] Added partitions for {', '.join(f'{b:%Y-%m}' for b in added)}")
+    return added
+
+
+_manager = None
+
+
+def start_retention_manager(store, interval=RETENTION_INTERVAL_SECONDS):
+    """
+    Runs retention every interval seconds in a background thread, the first
+    run one interval after startup. Returns the manager.
+    """
+    global _manager
+    if _manager is None:
+        manager = RetentionManager(store)
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    manager.run()
+                except Exception as e:
+                    print(f"[RETENTION ERROR] {str(e)}")
+
+        threading.Thread(target=run, name="retention", daemon=True).start()
+        _manager = manager
+        print(f"[RETENTION] Keeping {manager.retention_months} months of feedback, "
+              f"archiving to {manager.archive_dir} every {interval:.0f}s")
+    return _manager
+
+
+def get_retention_manager():
+    return _manager
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Partitions and retention of FeedbackResponses.")
+    parser.add_argument("command", choices=["setup", "status", "run"])
+    parser.add_argument("--sqlite", help="use the SQLite stand-in at this path instead of Azure SQL")
+    parser.add_argument("--apply", action="store_true", help="setup: run the DDL instead of printing it")
+    parser.add_argument("--months", type=int, default=RETENTION_MONTHS, help="months to keep")
+    args = parser.parse_args()
+
+    if args.sqlite:
+        from db_fallback import SqlitePartitions
+        store = SqlitePartitions(args.sqlite)
+    else:
+        from db import get_db_connection
+        store = SqlServerPartitions(get_db_connection)
+
+    if args.command == "setup":
+        if args.sqlite:
+            ensure_partitions(store)
+            return
+        statements = setup_statements(history_months=args.months)
+        if not args.apply:
+            print("\n".join(statements))
+            return
+        conn = store.connect()
+        try:
+            cursor = conn.cursor()
+            for statement in statements:
+                cursor.execute(statement)
+                conn.commit()
+        finally:
+            conn.close()
+        print(f"[RETENTION] {TABLE} is now partitioned by month")
+    elif args.command == "status":
+        for partition in store.partitions():
+            start = f"{partition.start:%Y-%m}" if partition.start else "..."
+            end = f"{partition.end:%Y-%m}" if partition.end else "..."
+            print(f"{partition.number:>4}  {start:>7} - {end:<7} {partition.rows:>12} rows")
+    else:
+        dropped = RetentionManager(store, retention_months=args.months).run()
+        print(f"[RETENTION] Dropped {len(dropped)} partitions, {sum(rows for _, rows in dropped)} rows archived")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+"""
+scheduler.py
+Priority-aware sharing of the classifier and the LLM between interactive and bulk work.
+
+Interactive requests (/batch-analyze and its stream: one text, a person
+waiting) and bulk requests (/api/respond_batch, /api/ingest: thousands of
+texts) used to take classifier threads and Phi-3 calls first come, first
+served, so one large batch made the UI unusable. Work now goes through one
+FairScheduler per resource:
+
+    classify   CAPSENSE_CLASSIFY_WORKERS slots; batches are classified
+               CAPSENSE_CLASSIFY_SLICE texts per slot, so a large batch
+               leaves gaps for interactive work
+    llm        CAPSENSE_LLM_CONCURRENCY slots, one per response being generated
+
+Each scheduler keeps one FIFO queue per work class. A freed slot goes to the
+waiting class that has been served least relative to its weight (stride
+scheduling): with the default weights of 8:1, interactive work gets 8 of
+every 9 contended slots, bulk work keeps moving, and either class may use
+every slot while the other is idle.
+
+Admission control runs before any work is queued. Each client (its remote
+address; the X-Client-Id header only when CAPSENSE_TRUST_CLIENT_ID is set,
+as the caller could otherwise pick a fresh id per request to get a fresh
+quota) has a per-class quota of texts per minute, and each class a limit on requests in flight per worker. A request
+over either is refused at once with 429 and Retry-After rather than left to
+time out. /api/ingest is admitted once and then throttled to the client's
+bulk quota chunk by chunk.
+
+Configuration:
+    CAPSENSE_CLASSIFY_WORKERS          classifier slots per worker (default: CPU count)
+    CAPSENSE_LLM_CONCURRENCY           concurrent LLM calls per worker (default: 64)
+    CAPSENSE_CLASSIFY_SLICE            texts classified per slot (default: 256)
+    CAPSENSE_WEIGHT_INTERACTIVE        share of contended slots (default: 8)
+    CAPSENSE_WEIGHT_BULK               (default: 1)
+    CAPSENSE_QUOTA_INTERACTIVE         texts per minute per client, 0 for none (default: 600)
+    CAPSENSE_QUOTA_BULK                (default: 100000)
+    CAPSENSE_MAX_ACTIVE_INTERACTIVE    requests in flight per worker (default: 256)
+    CAPSENSE_MAX_ACTIVE_BULK           (default: 8)
+    CAPSENSE_TRUST_CLIENT_ID=1         count requests by their X-Client-Id header; only behind
+                                       a trusted proxy that sets it (default: remote address)
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+WORK_CLASSES = (INTERACTIVE, BULK)
+
+CLASSIFY_WORKERS = int(os.getenv("CAPSENSE_CLASSIFY_WORKERS", str(os.cpu_count() or 1)))
+LLM_CONCURRENCY = int(os.getenv("CAPSENSE_LLM_CONCURRENCY", "64"))
+CLASSIFY_SLICE = int(os.getenv("CAPSENSE_CLASSIFY_SLICE", "256"))
+
+WEIGHTS = {
+    INTERACTIVE: float(os.getenv("CAPSENSE_WEIGHT_INTERACTIVE", "8")),
+    BULK: float(os.getenv("CAPSENSE_WEIGHT_BULK", "1")),
+}
+QUOTAS = {
+    INTERACTIVE: float(os.getenv("CAPSENSE_QUOTA_INTERACTIVE", "600")),
+    BULK: float(os.getenv("CAPSENSE_QUOTA_BULK", "100000")),
+}
+MAX_ACTIVE = {
+    INTERACTIVE: int(os.getenv("CAPSENSE_MAX_ACTIVE_INTERACTIVE", "256")),
+    BULK: int(os.getenv("CAPSENSE_MAX_ACTIVE_BULK", "8")),
+}
+TRUST_CLIENT_ID = os.getenv("CAPSENSE_TRUST_CLIENT_ID") == "1"
+
+# Recent waits and request durations kept for the metrics and Retry-After estimates
+HISTORY = 1000
+# Idle client buckets are forgotten after this long (a full bucket is the default anyway)
+IDLE_CLIENT_SECONDS = 600
+
+
+def percentile_ms(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(1000 * ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 2)
+
+
+class Waiter:
+    """
+    One queued slot request; grant() wakes whoever is waiting on it.
+    """
+
+    def __init__(self, work_class, grant):
+        self.work_class = work_class
+        self.grant = grant
+        self.enqueued = time.perf_counter()
+        self.granted = False
+
+
+class FairScheduler:
+    """
+    capacity slots shared by the work classes by weight. acquire()/slot()
+    block a thread; slot_async() awaits on an event loop.
+    """
+
+    def __init__(self, name, capacity, weights=WEIGHTS):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.weights = dict(weights)
+        self._lock = threading.Lock()
+        self._queues = {work_class: deque() for work_class in self.weights}
+        self._pass = {work_class: 0.0 for work_class in self.weights}
+        self._virtual_time = 0.0
+        self._in_use = {work_class: 0 for work_class in self.weights}
+        self._granted = {work_class: 0 for work_class in self.weights}
+        self._waits = {work_class: deque(maxlen=HISTORY) for work_class in self.weights}
+
+    def _take(self, work_class, waited):
+        # Called with the lock held: one slot to work_class, which pays 1/weight of virtual time
+        self._virtual_time = self._pass[work_class]
+        self._pass[work_class] += 1.0 / self.weights[work_class]
+        self._in_use[work_class] += 1
+        self._granted[work_class] += 1
+        self._waits[work_class].append(waited)
+
+    def _enter(self, work_class, grant):
+        """
+        Takes a free slot (returns None) or queues a Waiter and returns it.
+        """
+        with self._lock:
+            if sum(self._in_use.values()) < self.capacity:
+                self._take(work_class, 0.0)
+                return None
+            queue = self._queues[work_class]
+            if not queue:
+                # A class that was idle joins at the current virtual time instead of
+                # spending credit it built up while it had nothing to do
+                self._pass[work_class] = max(self._pass[work_class], self._virtual_time)
+            waiter = Waiter(work_class, grant)
+            queue.append(waiter)
+            return waiter
+
+    def _grant_waiting(self):
+        """
+        Hands free slots to the queued waiters, the least-served class first.
+        """
+        granted = []
+        with self._lock:
+            while sum(self._in_use.values()) < self.capacity:
+                waiting = [c for c, queue in self._queues.items() if queue]
+                if not waiting:
+                    break
+                next_class = min(waiting, key=lambda c: self._pass[c])
+                waiter = self._queues[next_class].popleft()
+                waiter.granted = True
+                self._take(next_class, time.perf_counter() - waiter.enqueued)
+                granted.append(waiter)
+        for waiter in granted:
+            waiter.grant()
+
+    def release(self, work_class):
+        with self._lock:
+            self._in_use[work_class] -= 1
+        self._grant_waiting()
+
+    def resize(self, capacity):
+        with self._lock:
+            self.capacity = max(1, capacity)
+        self._grant_waiting()
+
+    def acquire(self, work_class):
+        event = threading.Event()
+        if self._enter(work_class, event.set) is not None:
+            event.wait()
+
+    @contextmanager
+    def slot(self, work_class):
+        self.acquire(work_class)
+        try:
+            yield
+        finally:
+            self.release(work_class)
+
+    @asynccontextmanager
+    async def slot_async(self, work_class):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def grant():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enter(work_class, grant)
+        if waiter is not None:
+            try:
+                await future
+            except asyncio.CancelledError:
+                with self._lock:
+                    queued = not waiter.granted
+                    if queued:
+                        self._queues[work_class].remove(waiter)
+                if not queued:
+                    self.release(work_class)
+                raise
+        try:
+            yield
+        finally:
+            self.release(work_class)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "queues": {
+                    work_class: {
+                        "weight": self.weights[work_class],
+                        "waiting": len(self._queues[work_class]),
+                        "in_use": self._in_use[work_class],
+                        "granted": self._granted[work_class],
+                        "wait_p50_ms": percentile_ms(self._waits[work_class], 0.5),
+                        "wait_p95_ms": percentile_ms(self._waits[work_class], 0.95),
+                        "wait_max_ms": percentile_ms(self._waits[work_class], 1.0)
+                    }
+                    for work_class in self.weights
+                }
+            }
+
+
+class Rejected(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class TokenBucket:
+    """
+    quota texts per minute, bursting up to a minute's worth.
+    """
+
+    def __init__(self, quota):
+        self.rate = quota / 60.0
+        self.capacity = quota
+        self.tokens = quota
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, cost):
+        """
+        Seconds until cost texts fit; a request larger than the burst only
+        needs a full bucket and leaves the bucket in debt.
+        """
+        needed = min(cost, self.capacity)
+        return max(0.0, (needed - self.tokens) / self.rate)
+
+
+class Ticket:
+    """
+    An admitted request; close() when it is done (idempotent).
+    """
+
+    def __init__(self, admission, work_class):
+        self.admission = admission
+        self.work_class = work_class
+        self.started = time.perf_counter()
+        self.closed = False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.admission._finish(self)
+
+
+class AdmissionControl:
+    """
+    Per-client quotas and per-class limits on requests in flight.
+    """
+
+    def __init__(self, quotas=QUOTAS, max_active=MAX_ACTIVE):
+        self.quotas = dict(quotas)
+        self.max_active = dict(max_active)
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._active = {work_class: 0 for work_class in self.max_active}
+        self._durations = {work_class: deque(maxlen=HISTORY) for work_class in self.max_active}
+        self._admitted = {work_class: 0 for work_class in self.max_active}
+        self._rejected = {work_class: {"quota": 0, "busy": 0} for work_class in self.max_active}
+        self._last_pruned = time.monotonic()
+
+    def _bucket(self, client, work_class):
+        # Called with the lock held
+        if not self.quotas.get(work_class):
+            return None
+        now = time.monotonic()
+        if now - self._last_pruned > IDLE_CLIENT_SECONDS:
+            self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                             if now - bucket.updated < IDLE_CLIENT_SECONDS}
+            self._last_pruned = now
+        bucket = self._buckets.get((client, work_class))
+        if bucket is None:
+            bucket = self._buckets[(client, work_class)] = TokenBucket(self.quotas[work_class])
+        bucket.refill()
+        return bucket
+
+    def admit(self, client, work_class, texts):
+        """
+        A Ticket for a request of texts texts, or Rejected with a Retry-After.
+        """
+        with self._lock:
+            if self._active[work_class] >= self.max_active[work_class]:
+                self._rejected[work_class]["busy"] += 1
+                durations = self._durations[work_class]
+                typical = sum(durations) / len(durations) if durations else 1.0
+                # With requests finishing at a steady pace, one slot opens every typical / active seconds
+                raise Rejected(f"Too many {work_class} requests in progress, retry later.",
+                               typical / max(1, self._active[work_class]))
+            bucket = self._bucket(client, work_class)
+            if bucket is not None and texts:
+                wait = bucket.wait_for(texts)
+                if wait > 0:
+                    self._rejected[work_class]["quota"] += 1
+                    raise Rejected(f"Quota of {self.quotas[work_class]:.0f} {work_class} texts per minute "
+                                   f"exceeded, retry later.", wait)
+                bucket.tokens -= texts
+            self._active[work_class] += 1
+            self._admitted[work_class] += 1
+        return Ticket(self, work_class)
+
+    def charge(self, client, work_class, texts):
+        """
+        Takes texts from the client's quota as they arrive (for /api/ingest);
+        returns the seconds to pause so the client stays within its quota.
+        """
+        with self._lock:
+            bucket = self._bucket(client, work_class)
+            if bucket is None:
+                return 0.0
+            bucket.tokens -= texts
+            return max(0.0, -bucket.tokens / bucket.rate)
+
+    def _finish(self, ticket):
+        with self._lock:
+            self._active[ticket.work_class] -= 1
+            self._durations[ticket.work_class].append(time.perf_counter() - ticket.started)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                work_class: {
+                    "quota_per_minute": self.quotas.get(work_class) or None,
+                    "max_active": self.max_active[work_class],
+                    "active": self._active[work_class],
+                    "admitted": self._admitted[work_class],
+                    "rejected": dict(self._rejected[work_class]),
+                    "duration_p50_ms": percentile_ms(self._durations[work_class], 0.5),
+                    "duration_p95_ms": percentile_ms(self._durations[work_class], 0.95)
+                }
+                for work_class in self.max_active
+            }
+
+
+def client_id(request):
+    """
+    Who a request counts against: the remote address, or the X-Client-Id
+    header when a trusted proxy sets it (CAPSENSE_TRUST_CLIENT_ID).
+    """
+    if TRUST_CLIENT_ID and request.headers.get("X-Client-Id"):
+        return request.headers["X-Client-Id"]
+    return request.remote_addr or "unknown"
+
+
+def retry_later(message, retry_after, status=429):
+    """
+    A (body, status, headers) response telling the client when to come back;
+    works as the return value of a Flask or a Quart view.
+    """
+    return {"error": message}, status, {"Retry-After": str(retry_after)}
+
+
+def admit_request(request, work_class, texts):
+    """
+    (ticket, None) when the request may go ahead, else (None, a 429 response).
+    """
+    try:
+        return admission.admit(client_id(request), work_class, texts), None
+    except Rejected as e:
+        return None, retry_later(str(e), e.retry_after)
+
+
+# This worker's schedulers and admission control
+classify_scheduler = FairScheduler("classify", CLASSIFY_WORKERS)
+llm_scheduler = FairScheduler("llm", LLM_CONCURRENCY)
+admission = AdmissionControl()
+
+
+def scheduler_metrics():
+    return {
+        "classify": classify_scheduler.metrics(),
+        "llm": llm_scheduler.metrics(),
+        "admission": admission.metrics()
+    }
@@ -0,0 +1,290 @@
+"""
+train_models.py
+Streaming, out-of-core training for the sentiment, sarcasm and emotion models.
+
+The labelled CSV is read in fixed-size chunks and each chunk goes through a
+stateless HashingVectorizer (or the fixed vocabulary of the deployed
+vectorizer) into MultinomialNB.partial_fit, so memory stays bounded by the
+chunk size no matter how large the corpus is. Accuracy is measured with
+progressive validation: every chunk is scored by the model trained on the
+chunks before it, which needs no held-out copy of the data.
+
+Usage:
+    python train_models.py sarcasm sarcasm_dataset.csv
+    python train_models.py emotion emotions.csv --vectorizer fixed --chunk-size 20000
+"""
+
+import argparse
+import codecs
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.naive_bayes import MultinomialNB
+
+import model_store
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:  # Windows
+    RESOURCE_AVAILABLE = False
+
+# Per-head defaults: label set, stop words and n-grams used by the deployed vectorizers
+HEAD_CONFIG = {
+    "sentiment": {
+        "classes": ["Negative", "Neutral", "Positive"],
+        "stop_words": "english",
+        "ngram_range": (1, 1),
+        "legacy_vectorizer": "vectorizer.pkl",
+    },
+    "sarcasm": {
+        "classes": [0, 1],
+        "stop_words": "english",
+        "ngram_range": (1, 1),
+        "legacy_vectorizer": "sarcasm_vectorizer.pkl",
+    },
+    "emotion": {
+        "classes": ["anger", "anticipation", "disgust", "joy", "neutral", "sadness"],
+        "stop_words": None,
+        "ngram_range": (1, 2),
+        "legacy_vectorizer": "emotion_vectorizer.pkl",
+    },
+}
+
+ENCODINGS_TO_TRY = ['utf-8', 'latin1', 'cp1252', 'ISO-8859-1']
+SNIFF_BYTES = 1 << 20
+DEFAULT_CHUNK_SIZE = 10000
+DEFAULT_N_FEATURES = 1 << 18
+
+
+def detect_encoding(dataset_path):
+    """
+    Picks an encoding by decoding the first megabyte only, instead of
+    re-reading the whole file once per candidate encoding.
+    """
+    with open(dataset_path, "rb") as f:
+        sample = f.read(SNIFF_BYTES)
+    for encoding in ENCODINGS_TO_TRY:
+        try:
+            # Incremental decoding tolerates a multi-byte character cut at the end of the sample
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def build_vectorizer(head, kind="hashing", n_features=DEFAULT_N_FEATURES, models_dir=None):
+    """
+    Returns a vectorizer that needs no fitting pass over the data:
+    - "hashing": a HashingVectorizer with non-negative counts (MultinomialNB needs them)
+    - "fixed": the vocabulary of the currently deployed vectorizer for this head
+    """
+    config = HEAD_CONFIG[head]
+    if kind == "hashing":
+        return HashingVectorizer(
+            n_features=n_features,
+            alternate_sign=False,
+            norm=None,
+            stop_words=config["stop_words"],
+            ngram_range=config["ngram_range"],
+        )
+    if kind == "fixed":
+        version = model_store.get_current(head, models_dir)
+        if version:
+            return model_store.load_version(head, version, models_dir)[1]
+        legacy_path = os.path.join(models_dir or model_store.MODELS_DIR, config["legacy_vectorizer"])
+        return joblib.load(legacy_path)
+    raise ValueError(f"Unknown vectorizer kind: {kind}")
+
+
+def iter_chunks(dataset_path, chunk_size, text_column="text", label_column="label", encoding=None):
+    """
+    Yields (texts, labels) lists one chunk at a time.
+    """
+    encoding = encoding or detect_encoding(dataset_path)
+    if encoding is None:
+        raise ValueError("Could not read the dataset with any of the attempted encodings.")
+    reader = pd.read_csv(
+        dataset_path,
+        encoding=encoding,
+        encoding_errors="replace",
+        usecols=[text_column, label_column],
+        chunksize=chunk_size,
+    )
+    for chunk in reader:
+        chunk = chunk.dropna(subset=[text_column, label_column])
+        texts = chunk[text_column].astype(str)
+        keep = texts.str.strip() != ""
+        yield texts[keep].tolist(), chunk[label_column][keep].tolist()
+
+
+def train_head(head, dataset_path, vectorizer_kind="hashing", chunk_size=DEFAULT_CHUNK_SIZE,
+               n_features=DEFAULT_N_FEATURES, classes=None, text_column="text",
+               label_column="label", models_dir=None, activate=True, verbose=True):
+    """
+    Streams a labelled CSV into a MultinomialNB for one head and publishes it
+    as a new model version. Returns a report dict with metrics, throughput and
+    peak memory, or {"error": ...}.
+    """
+    if head not in HEAD_CONFIG:
+        return {"error": f"Unknown model head '{head}'. Choose from {list(HEAD_CONFIG)}."}
+    if not os.path.exists(dataset_path):
+        return {"error": f"Dataset file '{dataset_path}' not found."}
+
+    classes = list(classes or HEAD_CONFIG[head]["classes"])
+    class_array = np.array(classes)
+    class_index = {label: i for i, label in enumerate(classes)}
+    if head == "sarcasm":
+        # CSV labels may come back as 0/1, "0"/"1" or True/False
+        class_index.update({str(label): i for i, label in enumerate(classes)})
+        class_index.update({bool(label): i for i, label in enumerate(classes)})
+
+    preprocess = None
+    if head == "emotion":
+        # The emotion vectorizer was fitted on NLTK-cleaned text
+        from classifier_emotion import preprocess_text
+        preprocess = preprocess_text
+
+    try:
+        vectorizer = build_vectorizer(head, vectorizer_kind, n_features, models_dir)
+    except (OSError, ValueError) as e:
+        return {"error": f"Could not build the {vectorizer_kind} vectorizer: {e}"}
+    model = MultinomialNB()
+    column_to_class = None
+    confusion = np.zeros((len(classes), len(classes)), dtype=np.int64)
+
+    rows_seen = 0
+    rows_skipped = 0
+    chunks = 0
+    start = time.perf_counter()
+
+    try:
+        for texts, labels in iter_chunks(dataset_path, chunk_size, text_column, label_column):
+            y = np.array([class_index.get(label, -1) for label in labels], dtype=np.int64)
+            known = y >= 0
+            rows_skipped += int((~known).sum())
+            if not known.any():
+                continue
+            texts = [text for text, ok in zip(texts, known) if ok]
+            y = y[known]
+            if preprocess:
+                texts = [preprocess(text) for text in texts]
+
+            X = vectorizer.transform(texts)
+            if column_to_class is not None:
+                # Progressive validation: score the chunk before learning from it
+                predicted = column_to_class[model.predict_proba(X).argmax(axis=1)]
+                np.add.at(confusion, (y, predicted), 1)
+            model.partial_fit(X, class_array[y], classes=class_array)
+            if column_to_class is None:
+                # model.classes_ is sorted; map its columns back onto our class order
+                column_to_class = np.array([classes.index(label) for label in model.classes_])
+
+            rows_seen += len(y)
+            chunks += 1
+            if verbose:
+                elapsed = time.perf_counter() - start
+                print(f"[TRAIN {head}] chunk {chunks}: {rows_seen} rows, "
+                      f"{rows_seen / elapsed:,.0f} rows/s")
+    except ValueError as e:
+        return {"error": str(e)}
+
+    if rows_seen == 0:
+        return {"error": "Dataset contained no usable labelled rows."}
+
+    elapsed = time.perf_counter() - start
+    metrics = _metrics_from_confusion(confusion, positive=1 if head == "sarcasm" else None)
+    report = {
+        "message": f"{head.capitalize()} model trained successfully",
+        "head": head,
+        "rows": rows_seen,
+        "rows_skipped": rows_skipped,
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rows_seen / elapsed, 1) if elapsed else None,
+        "peak_memory_mb": peak_memory_mb(),
+        "vectorizer": vectorizer_kind,
+        **metrics,
+    }
+    report["version"] = model_store.write_version(
+        head, model, vectorizer,
+        metadata=dict(report, dataset=os.path.abspath(dataset_path), classes=classes,
+                      created_at=time.strftime("%Y-%m-%dT%H:%M:%S")),
+        models_dir=models_dir,
+        activate=activate,
+    )
+    return report
+
+
+def peak_memory_mb():
+    """
+    Peak resident set size of this process in MB, or None where unsupported.
+    """
+    if not RESOURCE_AVAILABLE:
+        return None
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    divisor = 1024 * 1024 if os.uname().sysname == "Darwin" else 1024
+    return round(peak / divisor, 1)
+
+
+def _metrics_from_confusion(confusion, positive=None):
+    total = confusion.sum()
+    if total == 0:
+        return {"accuracy": None, "precision": None, "recall": None, "f1_score": None}
+    true_positive = np.diag(confusion).astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.nan_to_num(true_positive / confusion.sum(axis=0))
+        recall = np.nan_to_num(true_positive / confusion.sum(axis=1))
+        f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+    if positive is not None:
+        # Binary heads report the positive class, like train_sarcasm_model always did
+        precision, recall, f1 = precision[positive], recall[positive], f1[positive]
+    else:
+        precision, recall, f1 = precision.mean(), recall.mean(), f1.mean()
+    return {
+        "accuracy": float(true_positive.sum() / total),
+        "precision": float(precision),
+        "recall": float(recall),
+        "f1_score": float(f1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a labelled CSV into a new model version.")
+    parser.add_argument("head", choices=sorted(HEAD_CONFIG))
+    parser.add_argument("dataset")
+    parser.add_argument("--vectorizer", choices=["hashing", "fixed"], default="hashing")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--n-features", type=int, default=DEFAULT_N_FEATURES)
+    parser.add_argument("--text-column", default="text")
+    parser.add_argument("--label-column", default="label")
+    parser.add_argument("--models-dir", default=None)
+    parser.add_argument("--no-activate", action="store_true",
+                        help="write the version without making it the active one")
+    args = parser.parse_args()
+
+    report = train_head(
+        args.head, args.dataset,
+        vectorizer_kind=args.vectorizer,
+        chunk_size=args.chunk_size,
+        n_features=args.n_features,
+        text_column=args.text_column,
+        label_column=args.label_column,
+        models_dir=args.models_dir,
+        activate=not args.no_activate,
+    )
+    if "error" in report:
+        print(f"[TRAIN ERROR] {report['error']}")
+        raise SystemExit(1)
+    for key, value in report.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+"""
+write_behind.py
+Write-behind persistence for analysis results.
+
+Requests no longer insert into FeedbackResponses themselves. They append
+the rows to an on-disk journal (one fsync per batch) and to a bounded
+in-memory queue, and return. A background writer drains the queue in bulk
+(executemany, one commit per flush) and retries with backoff while the
+database is slow or down, so database latency never reaches the user.
+
+Durability: a row is acknowledged only once it is in the journal. The
+writer records the sequence number of the last committed row, and on
+startup every journaled row after it is replayed. A crash between a commit
+and that record can replay a flush twice (at-least-once delivery).
+
+An optional after_insert(cursor, pending_seconds) runs in each flush's
+transaction after the insert, with how long the oldest row of the flush
+has waited; app.py uses it to attach feedback that arrived before its row
+was flushed.
+
+A failing flush is retried as a whole; if the database keeps rejecting it
+while connections work, the batch is retried row by row and rows the
+database refuses (data or integrity errors) go to dead_letter.jsonl instead
+of holding up the rest.
+
+Each gunicorn worker locks its own journal slot under CAPSENSE_JOURNAL_DIR,
+so a restarted worker picks up the journal a crashed one left behind.
+
+Configuration:
+    CAPSENSE_WRITE_BEHIND=0          insert synchronously instead
+    CAPSENSE_JOURNAL_DIR             journal folder (default: backend/journal)
+    CAPSENSE_WRITE_BATCH_SIZE        rows per flush (default: 500)
+    CAPSENSE_WRITE_FLUSH_SECONDS     max wait before a partial flush (default: 1)
+    CAPSENSE_WRITE_QUEUE_LIMIT       max rows waiting in memory (default: 100000)
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import model_store
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:  # Windows: one process, one journal slot
+    FCNTL_AVAILABLE = False
+
+JOURNAL_DIR = os.getenv("CAPSENSE_JOURNAL_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "journal")
+BATCH_SIZE = int(os.getenv("CAPSENSE_WRITE_BATCH_SIZE", "500"))
+FLUSH_INTERVAL_SECONDS = float(os.getenv("CAPSENSE_WRITE_FLUSH_SECONDS", "1"))
+QUEUE_LIMIT = int(os.getenv("CAPSENSE_WRITE_QUEUE_LIMIT", "100000"))
+
+SEGMENT_ROWS = 10000
+MAX_BATCH_RETRIES = 3
+MAX_BACKOFF_SECONDS = 60
+COMMITTED_FILE = "committed"
+DEAD_LETTER_FILE = "dead_letter.jsonl"
+LOCK_FILE = ".slot.lock"
+
+# Errors that mean the row itself is bad, not that the database is unavailable
+ROW_ERROR_NAMES = ("DataError", "IntegrityError")
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+def is_row_error(error):
+    return type(error).__name__ in ROW_ERROR_NAMES
+
+
+class WriteBehindQueue:
+    def __init__(self, get_db_connection, insert_query, journal_dir, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL_SECONDS, queue_limit=QUEUE_LIMIT, fsync=True, after_insert=None):
+        self.get_db_connection = get_db_connection
+        self.insert_query = insert_query
+        self.after_insert = after_insert
+        self.journal_dir = journal_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_limit = queue_limit
+        self.fsync = fsync
+
+        self._pending = deque()  # (seq, row, enqueued_at), oldest first
+        self._reserved = 0       # rows admitted by enqueue but not yet journaled
+        # Lock order: _journal_lock, then _cond; journal I/O never runs under _cond
+        self._cond = threading.Condition()
+        self._journal_lock = threading.Lock()
+        self._segments = []      # [(path, last_seq)], oldest first
+        self._segment_file = None
+        self._segment_rows = 0
+        self._next_seq = 1
+        self._committed_seq = 0
+        self._conn = None
+        self._thread = None
+        self._stop = threading.Event()
+
+        self.rows_enqueued = 0
+        self.rows_flushed = 0
+        self.flushes = 0
+        self.flush_failures = 0
+        self.dead_letter_rows = 0
+        self.last_error = None
+        self._flush_times = deque(maxlen=200)
+
+        os.makedirs(journal_dir, exist_ok=True)
+        self._replay()
+
+    # ---- journal ----
+
+    def _replay(self):
+        """
+        Loads the committed watermark and queues every journaled row after it.
+        """
+        try:
+            with open(os.path.join(self.journal_dir, COMMITTED_FILE), "r") as f:
+                self._committed_seq = int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            self._committed_seq = 0
+
+        last_seq = self._committed_seq
+        segment_names = sorted(name for name in os.listdir(self.journal_dir)
+                               if name.startswith("segment-") and name.endswith(".jsonl"))
+        for name in segment_names:
+            path = os.path.join(self.journal_dir, name)
+            segment_last = 0
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # torn write at the end of the journal: never acknowledged
+                    seq = entry["seq"]
+                    segment_last = max(segment_last, seq)
+                    if seq > self._committed_seq:
+                        self._pending.append((seq, tuple(entry["row"]), entry.get("at", time.time())))
+            self._segments.append((path, segment_last))
+            last_seq = max(last_seq, segment_last)
+
+        self._next_seq = last_seq + 1
+        if self._pending:
+            print(f"[WRITE-BEHIND] Replaying {len(self._pending)} unflushed rows from {self.journal_dir}")
+        self._drop_committed_segments()
+
+    def _open_segment(self):
+        path = os.path.join(self.journal_dir, f"segment-{self._next_seq:012d}.jsonl")
+        self._segment_file = open(path, "a", encoding="utf-8")
+        self._segment_rows = 0
+        self._segments.append((path, self._next_seq - 1))
+
+    def _append_to_journal(self, rows, now):
+        """
+        Writes rows, enqueued at now, to the journal and returns their
+        sequence numbers. The caller holds _journal_lock.
+        """
+        if self._segment_file is None or self._segment_rows >= SEGMENT_ROWS:
+            if self._segment_file is not None:
+                self._segment_file.close()
+            self._open_segment()
+        first_seq = self._next_seq
+        lines = []
+        for offset, row in enumerate(rows):
+            lines.append(json.dumps({"seq": first_seq + offset, "row": list(row), "at": now}, default=str))
+        self._segment_file.write("\n".join(lines) + "\n")
+        self._segment_file.flush()
+        if self.fsync:
+            os.fsync(self._segment_file.fileno())
+        self._next_seq += len(rows)
+        self._segment_rows += len(rows)
+        path, _ = self._segments[-1]
+        self._segments[-1] = (path, self._next_seq - 1)
+        return range(first_seq, self._next_seq)
+
+    def _mark_committed(self, seq):
+        self._committed_seq = seq
+        model_store.atomic_write_text(os.path.join(self.journal_dir, COMMITTED_FILE), str(seq))
+        self._drop_committed_segments()
+
+    def _drop_committed_segments(self):
+        with self._journal_lock:
+            active = self._segment_file.name if self._segment_file is not None else None
+            kept = []
+            for path, last_seq in self._segments:
+                if last_seq <= self._committed_seq and path != active:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                else:
+                    kept.append((path, last_seq))
+            self._segments = kept
+
+    # ---- producer side ----
+
+    def enqueue(self, rows, timeout=5.0):
+        """
+        Journals rows and queues them for the writer. Returns once the rows
+        are durable. Raises QueueFullError if the queue stays full for timeout seconds.
+        """
+        rows = [tuple(row) for row in rows]
+        if not rows:
+            return 0
+        with self._cond:
+            deadline = time.monotonic() + timeout
+            while (len(self._pending) + self._reserved + len(rows) > self.queue_limit
+                   and (self._pending or self._reserved)):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise QueueFullError(f"Write-behind queue is full ({len(self._pending)} rows waiting).")
+                self._cond.wait(remaining)
+            self._reserved += len(rows)
+
+        # The journal write and fsync hold only _journal_lock, so the writer and
+        # metrics() are never blocked behind them
+        try:
+            with self._journal_lock:
+                now = time.time()
+                seqs = self._append_to_journal(rows, now)
+                # Still under _journal_lock, so rows join the queue in sequence order
+                with self._cond:
+                    self._pending.extend((seq, row, now) for seq, row in zip(seqs, rows))
+                    self._reserved -= len(rows)
+                    self.rows_enqueued += len(rows)
+                    if len(self._pending) >= self.batch_size:
+                        self._cond.notify_all()
+        except BaseException:
+            with self._cond:
+                self._reserved -= len(rows)
+                self._cond.notify_all()
+            raise
+        return len(rows)
+
+    # ---- writer side ----
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=10.0):
+        """
+        Stops the writer after a last flush attempt; whatever is left stays in the journal.
+        """
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._segment_file is not None:
+            self._segment_file.close()
+
+    def _run(self):
+        backoff = 1
+        while True:
+            with self._cond:
+                if not self._stop.is_set() and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                batch = [self._pending[i] for i in range(min(self.batch_size, len(self._pending)))]
+            if not batch:
+                if self._stop.is_set():
+                    return
+                continue
+
+            if self.flush(batch):
+                backoff = 1
+            else:
+                if self._stop.is_set():
+                    return
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = self.get_db_connection()
+        return self._conn
+
+    def _reset_connection(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def _insert(self, batch):
+        rows = [row for _, row, _ in batch]
+        conn = self._connection()
+        if conn is None:
+            raise ConnectionError("Database connection not available")
+        cursor = conn.cursor()
+        try:
+            try:
+                cursor.fast_executemany = True
+            except AttributeError:
+                pass
+            cursor.executemany(self.insert_query, rows)
+            if self.after_insert is not None:
+                self.after_insert(cursor, time.time() - batch[0][2])
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            cursor.close()
+
+    def flush(self, batch):
+        """
+        Inserts one batch. Returns True when the batch left the queue
+        (committed or dead-lettered), False to retry later.
+        """
+        start = time.perf_counter()
+        rows = [row for _, row, _ in batch]
+        for attempt in range(MAX_BATCH_RETRIES):
+            try:
+                self._insert(batch)
+                self._done(batch, time.perf_counter() - start)
+                return True
+            except Exception as e:
+                self.flush_failures += 1
+                self.last_error = str(e)
+                print(f"[WRITE-BEHIND] Flush of {len(rows)} rows failed (attempt {attempt + 1}): {e}")
+                if not is_row_error(e):
+                    self._reset_connection()
+                    return False  # database unavailable: back off, keep the rows
+
+        # The database keeps rejecting this batch: find the rows it refuses
+        for entry in batch:
+            try:
+                self._insert([entry])
+            except Exception as e:
+                if not is_row_error(e):
+                    self._reset_connection()
+                    return False
+                self._dead_letter(entry, e)
+        self._done(batch, time.perf_counter() - start)
+        return True
+
+    def _done(self, batch, seconds):
+        with self._cond:
+            for _ in batch:
+                self._pending.popleft()
+            self._cond.notify_all()
+        self._mark_committed(batch[-1][0])
+        self.rows_flushed += len(batch)
+        self.flushes += 1
+        self._flush_times.append(seconds)
+
+    def _dead_letter(self, entry, error):
+        seq, row, _ = entry
+        self.dead_letter_rows += 1
+        print(f"[WRITE-BEHIND] Row {seq} rejected by the database, moved to {DEAD_LETTER_FILE}: {error}")
+        with open(os.path.join(self.journal_dir, DEAD_LETTER_FILE), "a", encoding="utf-8") as f:
+            f.write(json.dumps({"seq": seq, "row": list(row), "error": str(error)}, default=str) + "\n")
+
+    # ---- metrics ----
+
+    def metrics(self):
+        with self._cond:
+            depth = len(self._pending)
+            oldest = self._pending[0][2] if self._pending else None
+        flush_times = sorted(self._flush_times)
+        return {
+            "journal_dir": self.journal_dir,
+            "queue_depth": depth,
+            "queue_limit": self.queue_limit,
+            "oldest_pending_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+            "rows_enqueued": self.rows_enqueued,
+            "rows_flushed": self.rows_flushed,
+            "flushes": self.flushes,
+            "flush_failures": self.flush_failures,
+            "dead_letter_rows": self.dead_letter_rows,
+            "last_flush_seconds": round(self._flush_times[-1], 4) if self._flush_times else None,
+            "avg_flush_seconds": round(sum(flush_times) / len(flush_times), 4) if flush_times else None,
+            "p95_flush_seconds": round(flush_times[int(len(flush_times) * 0.95)], 4) if flush_times else None,
+            "committed_seq": self._committed_seq,
+            "journal_segments": len(self._segments),
+            "last_error": self.last_error,
+        }
+
+
+def acquire_journal_slot(journal_root=JOURNAL_DIR):
+    """
+    Locks the first free slot folder (slot-0, slot-1, ...) for this process.
+    Returns (path, lock handle); the handle must stay open while the slot is in use.
+    """
+    os.makedirs(journal_root, exist_ok=True)
+    if not FCNTL_AVAILABLE:
+        return os.path.join(journal_root, "slot-0"), None
+    slot = 0
+    while True:
+        path = os.path.join(journal_root, f"slot-{slot}")
+        os.makedirs(path, exist_ok=True)
+        handle = open(os.path.join(path, LOCK_FILE), "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return path, handle
+        except OSError:
+            handle.close()
+            slot += 1
+
+
+_queue = None
+_slot_lock = None
+
+
+def start_write_behind(get_db_connection, insert_query, journal_root=JOURNAL_DIR, after_insert=None):
+    """
+    Starts this process's write-behind queue once and returns it.
+    """
+    global _queue, _slot_lock
+    if _queue is None:
+        journal_dir, _slot_lock = acquire_journal_slot(journal_root)
+        _queue = WriteBehindQueue(get_db_connection, insert_query, journal_dir, after_insert=after_insert).start()
+        atexit.register(_queue.stop)
+        print(f"[WRITE-BEHIND] Journaling results to {journal_dir}")
+    return _queue
+
+
+def get_write_behind():
+    return _queue
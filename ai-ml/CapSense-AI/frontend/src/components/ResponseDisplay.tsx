@@ -3,6 +3,7 @@ import React from 'react';
 interface Result {
   response: string;
   originalText: string;
+  streaming?: boolean; // response still arriving from /batch-analyze/stream (see utils/analysis-stream.js)
 }
 
 interface Props {
@@ -25,10 +26,14 @@ const ResponseDisplay: React.FC<Props> = ({ results }) => {
         <div key={index} className="p-3 border rounded mb-3 bg-white">
           <strong>Feedback {index + 1}</strong>
           <p className="mb-1"><em>User said:</em> {result.originalText}</p>
-          <p><em>AI Response:</em> {result.response}</p>
+          <p aria-busy={result.streaming ? true : undefined}>
+            <em>AI Response:</em> {result.response}
+            {result.streaming && <span className="text-muted"> ...</span>}
+          </p>
           <button
             className="btn btn-sm btn-outline-secondary"
             onClick={() => navigator.clipboard.writeText(result.response)}
+            disabled={result.streaming}
           >
             Copy
           </button>
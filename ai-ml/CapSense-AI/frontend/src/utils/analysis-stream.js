@@ -0,0 +1,83 @@
+// analysis-stream.js
+// Client for the streaming /batch-analyze/stream endpoint.
+// The server sends server-sent events: "classification" (the /batch-analyze fields
+// without the response), then "token" events while the AI response is generated,
+// then "done" with the complete /batch-analyze payload. streamAnalysis calls
+// onUpdate with a growing result after each event, so ResponseDisplay can render
+// the response as it is written (its `streaming` flag marks a response in progress).
+// Not called yet: WebApp has no analysis request of its own to replace. Whatever
+// submits texts should call streamAnalysis(text, onUpdate) and store each update
+// in its results state.
+
+// Split a text buffer into complete SSE events; returns [events, rest of the buffer]
+function parseServerSentEvents(buffer) {
+  const events = [];
+  const blocks = buffer.replace(/\r\n/g, "\n").split("\n\n");
+  const rest = blocks.pop();
+
+  for (const block of blocks) {
+    let event = "message";
+    const data = [];
+    for (const line of block.split("\n")) {
+      if (line.startsWith("event:")) {
+        event = line.slice(6).trim();
+      } else if (line.startsWith("data:")) {
+        data.push(line.slice(5).trim());
+      }
+    }
+    if (data.length > 0) {
+      events.push({ event, data: JSON.parse(data.join("\n")) });
+    }
+  }
+  return [events, rest];
+}
+
+// Analyze one text, calling onUpdate(result) as the result fills in.
+// Resolves with the final result ({..., response, streaming: false}).
+async function streamAnalysis(text, onUpdate) {
+  const response = await fetch("/batch-analyze/stream", {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json"
+    },
+    body: JSON.stringify({ text })
+  });
+
+  if (!response.ok || !response.body) {
+    const result = await response.json().catch(() => ({}));
+    throw new Error(result.error || "Analysis failed.");
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let result = { originalText: text, response: "", streaming: true };
+
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) {
+      break;
+    }
+    buffer += decoder.decode(value, { stream: true });
+    const [events, rest] = parseServerSentEvents(buffer);
+    buffer = rest;
+
+    for (const { event, data } of events) {
+      if (event === "classification") {
+        result = { ...result, ...data };
+      } else if (event === "token") {
+        result = { ...result, response: result.response + data.text };
+      } else if (event === "done") {
+        result = { ...data, streaming: false };
+      } else if (event === "error") {
+        throw new Error(data.error || "Analysis failed.");
+      }
+      onUpdate(result);
+    }
+  }
+
+  return { ...result, streaming: false };
+}
+
+export { parseServerSentEvents, streamAnalysis };
+export default streamAnalysis;
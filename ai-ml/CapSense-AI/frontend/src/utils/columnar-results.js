@@ -0,0 +1,67 @@
+
+// columnar-results.js
+// Helpers for the compact columnar batch format of /api/respond_batch (format=columnar).
+// The server sends one array per field, with sentiment and emotion as indexes into
+// small label dictionaries; decodeColumnarResults turns that back into the usual rows.
+// The optional fields (reused_from/similarity of ai_response, near_duplicate) are
+// nullable columns, null for rows without them.
+
+function isColumnar(payload) {
+  return Boolean(payload && payload.format === "columnar" && payload.columns);
+}
+
+// Rebuild the row format ([{input_text, classification, aspects, ai_response, f1_score}, ...])
+function decodeColumnarResults(payload) {
+  if (Array.isArray(payload)) {
+    return payload; // already in the row format
+  }
+  if (!isColumnar(payload)) {
+    throw new Error("Unrecognised batch result format");
+  }
+
+  const { count, columns, dictionaries } = payload;
+  const sentimentLabels = dictionaries.sentiment;
+  const emotionLabels = dictionaries.emotion;
+  const rows = new Array(count);
+
+  for (let i = 0; i < count; i++) {
+    const row = {
+      input_text: columns.input_text[i],
+      classification: {
+        sentiment: sentimentLabels[columns.sentiment[i]],
+        sentiment_confidence: columns.sentiment_confidence[i],
+        sarcasm: columns.sarcasm[i] === 1,
+        sarcasm_confidence: columns.sarcasm_confidence[i],
+        emotion: emotionLabels[columns.emotion[i]],
+        emotion_confidence: columns.emotion_confidence[i]
+      },
+      aspects: columns.aspects[i],
+      ai_response: {
+        response_text: columns.response_text[i],
+        empathy_score: columns.empathy_score[i]
+      },
+      f1_score: columns.f1_score[i]
+    };
+    if (columns.reused_from && columns.reused_from[i] !== null) {
+      row.ai_response.reused_from = columns.reused_from[i];
+      row.ai_response.similarity = columns.reused_similarity[i];
+    }
+    if (columns.near_duplicate_cluster && columns.near_duplicate_cluster[i] !== null) {
+      row.near_duplicate = {
+        cluster: columns.near_duplicate_cluster[i],
+        similarity: columns.near_duplicate_similarity[i]
+      };
+    }
+    rows[i] = row;
+  }
+  return rows;
+}
+
+// Decode one label column without building rows, e.g. for charts over a large batch
+function decodeLabelColumn(payload, name) {
+  const labels = payload.dictionaries[name];
+  return payload.columns[name].map((code) => labels[code]);
+}
+
+export { isColumnar, decodeColumnarResults, decodeLabelColumn };
+export default decodeColumnarResults;
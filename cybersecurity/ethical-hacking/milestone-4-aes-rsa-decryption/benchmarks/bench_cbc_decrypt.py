@@ -0,0 +1,90 @@
+# Benchmark: AES-CBC message decryption strategies
+#
+# Compares, on one large random ciphertext file:
+#   - the original loop (16 bytes per decrypt call, joined with +=), timed on a
+#     small slice and extrapolated because it grows quadratically
+#   - decrypt_cbc: read the whole file, decrypt in one call, then MD5
+#   - decrypt_file: mmap + 1 MiB chunks decrypted into a preallocated buffer,
+#     with MD5 updated in the same pass (keeping the plaintext or not)
+#
+# Usage (from the milestone folder):
+#   python benchmarks/bench_cbc_decrypt.py --size-mb 512
+
+from Crypto.Cipher import AES
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from aes_cbc import ZERO_IV, decrypt_cbc, decrypt_file  # noqa: E402
+
+
+# The original per-block loop from milestone4.py
+def per_block_decrypt(encrypted_message, aes_key):
+    cipher = AES.new(aes_key, AES.MODE_CBC, ZERO_IV)
+    decrypted_message = b""
+    for i in range(0, len(encrypted_message), AES.block_size):
+        chunk = encrypted_message[i:i + AES.block_size]
+        decrypted_message += cipher.decrypt(chunk)
+    return decrypted_message
+
+
+def write_random_file(path, size):
+    with open(path, 'wb') as out_file:
+        remaining = size
+        while remaining:
+            step = min(remaining, 1 << 24)
+            out_file.write(os.urandom(step))
+            remaining -= step
+
+
+def report(label, seconds, size):
+    print(f"{label:<44} {seconds:8.2f}s  {size / seconds / 1e6:10.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AES-CBC decryption benchmark")
+    parser.add_argument('--size-mb', type=int, default=512, help="size of the test ciphertext")
+    parser.add_argument('--slice-kb', type=int, default=256, help="slice used for the per-block loop")
+    parser.add_argument('--chunk-kb', type=int, default=1024, help="decrypt_file chunk size")
+    args = parser.parse_args()
+
+    size = args.size_mb * (1 << 20)
+    aes_key = os.urandom(16)
+    handle, path = tempfile.mkstemp(suffix='.emsg')
+    os.close(handle)
+    try:
+        write_random_file(path, size)
+        print(f"{args.size_mb} MB ciphertext at {path}")
+
+        # Per-block loop on a slice; the += copy makes it O(n^2), so this is a lower bound
+        with open(path, 'rb') as enc_file:
+            sample = enc_file.read(args.slice_kb * 1024)
+        start = time.perf_counter()
+        per_block_decrypt(sample, aes_key)
+        seconds = time.perf_counter() - start
+        report(f"per-block += loop ({args.slice_kb} KB slice)", seconds, len(sample))
+        print(f"{'  extrapolated to full file (linear, optimistic)':<44} {seconds * size / len(sample):8.2f}s")
+
+        start = time.perf_counter()
+        with open(path, 'rb') as enc_file:
+            hashlib.md5(decrypt_cbc(enc_file.read(), aes_key)).digest()
+        report("read + decrypt_cbc + md5", time.perf_counter() - start, size)
+
+        for keep_plaintext in (True, False):
+            start = time.perf_counter()
+            result = decrypt_file(path, aes_key, hashers={'md5': hashlib.md5()}, unpad=False,
+                                  keep_plaintext=keep_plaintext, chunk_size=args.chunk_kb * 1024)
+            result.hashers['md5'].digest()
+            report(f"decrypt_file mmap + md5 (keep_plaintext={keep_plaintext})",
+                   time.perf_counter() - start, size)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
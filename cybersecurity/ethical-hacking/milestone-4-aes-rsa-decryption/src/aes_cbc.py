@@ -0,0 +1,103 @@
+# AES-CBC message decryption for Milestone 4
+#
+# Decrypting 16 bytes per call and joining the pieces with += copies the
+# whole message again for every block. Here a buffer is decrypted in one
+# call, and files are decrypted in large block-aligned chunks straight from
+# a memory map into one preallocated bytearray (or a reusable scratch
+# buffer when the plaintext is not needed). Hashes can be updated in the
+# same pass, so a file is read, decrypted and hashed exactly once.
+
+from Crypto.Cipher import AES
+import mmap
+import os
+
+ZERO_IV = 16 * b'\x00'  # Fixed IV as specified
+DEFAULT_CHUNK_SIZE = 1 << 20  # 1 MiB, a multiple of AES.block_size
+
+
+# Length of the PKCS#7 padding at the end of a decrypted block; raises ValueError if invalid
+def pkcs7_padding_length(last_block, block_size=AES.block_size):
+    if len(last_block) == 0:
+        raise ValueError("Cannot unpad empty data")
+    pad = last_block[-1]
+    if pad < 1 or pad > block_size or pad > len(last_block):
+        raise ValueError("Invalid PKCS#7 padding")
+    if any(byte != pad for byte in last_block[-pad:]):
+        raise ValueError("Invalid PKCS#7 padding")
+    return pad
+
+
+# Remove PKCS#7 padding (no padding library, as in the original assignment)
+def pkcs7_unpad(data, block_size=AES.block_size):
+    return data[:len(data) - pkcs7_padding_length(data[-block_size:], block_size)]
+
+
+# Decrypt a whole message in a single call
+def decrypt_cbc(encrypted_message, aes_key, iv=ZERO_IV, unpad=False):
+    if len(encrypted_message) % AES.block_size:
+        raise ValueError("Ciphertext length is not a multiple of the AES block size")
+    decrypted = AES.new(aes_key, AES.MODE_CBC, iv).decrypt(encrypted_message)
+    return pkcs7_unpad(decrypted) if unpad else decrypted
+
+
+# Outcome of decrypt_file
+class DecryptResult:
+    def __init__(self, plaintext, length, padded, hashers, raw_hashers):
+        self.plaintext = plaintext      # bytearray, or None when keep_plaintext=False
+        self.length = length            # plaintext length after unpadding
+        self.padded = padded            # True if valid PKCS#7 padding was removed
+        self.hashers = hashers          # hashes of the unpadded plaintext
+        self.raw_hashers = raw_hashers  # hashes of the plaintext with its padding left on
+
+
+# Decrypt a file chunk by chunk from a memory map, hashing the plaintext in the same pass.
+# hashers: {name: hashlib object}; they receive the unpadded plaintext, and copies
+# taken just before the last block receive the raw (still padded) plaintext.
+# With unpad=True invalid padding is left in place (padded=False) rather than raising.
+def decrypt_file(file_path, aes_key, iv=ZERO_IV, hashers=None, unpad=True,
+                 keep_plaintext=True, chunk_size=DEFAULT_CHUNK_SIZE):
+    block = AES.block_size
+    chunk_size = max(block, chunk_size - chunk_size % block)
+    size = os.path.getsize(file_path)
+    if size % block:
+        raise ValueError("Ciphertext length is not a multiple of the AES block size")
+    hashers = hashers or {}
+    if size == 0:
+        return DecryptResult(bytearray() if keep_plaintext else None, 0, False, hashers, {})
+
+    cipher = AES.new(aes_key, AES.MODE_CBC, iv)
+    plaintext = bytearray(size) if keep_plaintext else None
+    target = memoryview(plaintext) if keep_plaintext else memoryview(bytearray(min(chunk_size, size)))
+
+    with open(file_path, 'rb') as enc_file:
+        with mmap.mmap(enc_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            source = memoryview(mapped)
+            for offset in range(0, size, chunk_size):
+                end = min(offset + chunk_size, size)
+                out = target[offset:end] if keep_plaintext else target[:end - offset]
+                cipher.decrypt(source[offset:end], output=out)
+                # The last block is held back: its padding is only known once it is decrypted
+                hashed = out if end < size else out[:-block]
+                for hasher in hashers.values():
+                    hasher.update(hashed)
+            final_block = bytes(out[-block:])
+            del out, hashed
+            source.release()
+    target.release()
+
+    raw_hashers = {name: hasher.copy() for name, hasher in hashers.items()}
+    for hasher in raw_hashers.values():
+        hasher.update(final_block)
+
+    pad = 0
+    if unpad:
+        try:
+            pad = pkcs7_padding_length(final_block)
+        except ValueError:
+            pad = 0
+    for hasher in hashers.values():
+        hasher.update(final_block[:block - pad])
+
+    if keep_plaintext and pad:
+        del plaintext[size - pad:]
+    return DecryptResult(plaintext, size - pad, pad > 0, hashers, raw_hashers)
@@ -0,0 +1,75 @@
+# Resumable key-search checkpoint for Milestone 4
+#
+# Records which RSA keys have been tried against every AES blob, so an
+# interrupted search over a large key set picks up where it left off. The
+# checkpoint carries a fingerprint of the search (key names, blob names and
+# expected hashes) and is ignored if any of them changed.
+
+import hashlib
+import json
+import os
+import time
+
+
+# Fingerprint of one search: the keys, the blobs and what counts as a match
+def search_fingerprint(key_names, blob_names, validator):
+    digest = hashlib.sha256()
+    for name in sorted(key_names):
+        digest.update(b'key\0' + name.encode('utf-8') + b'\0')
+    for name in sorted(blob_names):
+        digest.update(b'blob\0' + name.encode('utf-8') + b'\0')
+    for algorithm in sorted(validator.expected):
+        for expected in validator.expected[algorithm]:
+            digest.update(algorithm.encode('ascii') + b'\0' + expected)
+    return digest.hexdigest()
+
+
+class SearchCheckpoint:
+    def __init__(self, path, fingerprint, save_interval=5.0):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.save_interval = save_interval
+        self.completed = set()
+        self.previous_attempts = 0  # attempts made by earlier, interrupted runs
+        self.attempts = 0
+        self._last_save = time.monotonic()
+
+    # Load the checkpoint at path if it belongs to this search, else start empty
+    @classmethod
+    def load(cls, path, fingerprint, save_interval=5.0):
+        checkpoint = cls(path, fingerprint, save_interval)
+        try:
+            with open(path, 'r') as checkpoint_file:
+                saved = json.load(checkpoint_file)
+        except (OSError, ValueError):
+            return checkpoint
+        if isinstance(saved, dict) and saved.get('fingerprint') == fingerprint:
+            checkpoint.completed = set(saved.get('completed_keys', []))
+            checkpoint.previous_attempts = checkpoint.attempts = int(saved.get('attempts', 0))
+        return checkpoint
+
+    # Record a finished RSA key and this run's attempts so far; saves at most once per save_interval
+    def mark_done(self, key_name, attempts_this_run=0):
+        self.completed.add(key_name)
+        self.attempts = self.previous_attempts + attempts_this_run
+        if time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
+
+    # Write to a temporary file and rename, so an interruption never leaves a broken checkpoint
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump({
+                'fingerprint': self.fingerprint,
+                'completed_keys': sorted(self.completed),
+                'attempts': self.attempts,
+            }, checkpoint_file, indent=2)
+        os.replace(temp_path, self.path)
+        self._last_save = time.monotonic()
+
+    # Drop the checkpoint once the search has finished
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,90 @@
+# Expected-hash validation for Milestone 4
+#
+# The hash files are read once, up front, and kept as raw digest bytes.
+# Checking a candidate is then one hash computation and a constant-time
+# comparison (hmac.compare_digest), with no file I/O per attempt. MD5 is
+# what the assignment uses, but any hashlib algorithm works (SHA-256 etc.).
+
+import hashlib
+import hmac
+import os
+
+# Hash file extension -> hashlib algorithm name
+HASH_EXTENSIONS = {
+    '.md5': 'md5',
+    '.sha1': 'sha1',
+    '.sha256': 'sha256',
+    '.sha512': 'sha512',
+}
+
+
+# Read a digest from a hash file ("<hex>" or md5sum-style "<hex>  <filename>")
+def read_digest_file(file_path):
+    with open(file_path, 'r') as hash_file:
+        content = hash_file.read().split()
+    if not content:
+        raise ValueError(f"Hash file {file_path} is empty")
+    return bytes.fromhex(content[0])
+
+
+class HashValidator:
+    # expected: iterable of (algorithm, digest) with digest as raw bytes or hex text
+    def __init__(self, expected=()):
+        self.expected = {}
+        for algorithm, digest in expected:
+            self.add(algorithm, digest)
+
+    # Build a validator from hash files; the algorithm comes from the extension unless given
+    @classmethod
+    def from_files(cls, *file_paths, algorithm=None):
+        validator = cls()
+        for file_path in file_paths:
+            file_algorithm = algorithm or HASH_EXTENSIONS.get(os.path.splitext(file_path)[1].lower())
+            if file_algorithm is None:
+                raise ValueError(f"Cannot tell the hash algorithm of {file_path}; pass algorithm=")
+            validator.add(file_algorithm, read_digest_file(file_path))
+        return validator
+
+    def add(self, algorithm, digest):
+        algorithm = algorithm.lower()
+        hashlib.new(algorithm)  # fail early on an unknown algorithm
+        if isinstance(digest, str):
+            digest = bytes.fromhex(digest.strip())
+        self.expected.setdefault(algorithm, []).append(bytes(digest))
+
+    @property
+    def algorithms(self):
+        return list(self.expected)
+
+    # Fresh hash objects for every algorithm, for incremental (streaming) hashing
+    def new_hashers(self):
+        return {algorithm: hashlib.new(algorithm) for algorithm in self.expected}
+
+    # Check an already computed digest in constant time
+    def match_digest(self, algorithm, digest):
+        matched = False
+        for expected in self.expected.get(algorithm, ()):
+            matched |= hmac.compare_digest(expected, digest)
+        return matched
+
+    # Check finished hash objects, as returned by new_hashers()
+    def match_hashers(self, hashers):
+        return any(self.match_digest(algorithm, hasher.digest()) for algorithm, hasher in hashers.items())
+
+    # Check one candidate
+    def matches(self, data):
+        return any(
+            self.match_digest(algorithm, hashlib.new(algorithm, data).digest())
+            for algorithm in self.expected
+        )
+
+    # Check many candidates; returns a list of booleans in the same order
+    def verify_many(self, candidates):
+        return [self.matches(data) for data in candidates]
+
+    # Index of the first matching candidate, or None
+    def first_match(self, candidates):
+        for index, data in enumerate(candidates):
+            if self.matches(data):
+                return index
+        return None
@@ -0,0 +1,131 @@
+# Parallel RSA x AES key search for Milestone 4
+#
+# The search grid is every RSA private key against every encrypted AES key.
+# All encrypted AES blobs are read into memory once and the keys arrive as
+# already parsed numbers (see key_store.KeyStore), then the grid is split by
+# RSA key across a process pool: each task rebuilds one key, builds one OAEP
+# cipher and tries it on every blob of the right length.
+# As soon as a worker finds the AES key whose hash matches, a shared event
+# tells the other workers to stop and the queued tasks are cancelled.
+
+from Crypto.Cipher import PKCS1_OAEP
+from Crypto.PublicKey import RSA
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import os
+import time
+
+
+# Result of a search; aes_key is None when no key matched
+class SearchResult:
+    def __init__(self, aes_key, rsa_key_name, aes_blob_name, attempts, seconds):
+        self.aes_key = aes_key
+        self.rsa_key_name = rsa_key_name
+        self.aes_blob_name = aes_blob_name
+        self.attempts = attempts
+        self.seconds = seconds
+
+    @property
+    def attempts_per_second(self):
+        return self.attempts / self.seconds if self.seconds else 0.0
+
+
+# Read every encrypted AES key file into memory once
+def load_aes_blobs(aes_folder):
+    blobs = []
+    for entry in sorted(os.scandir(aes_folder), key=lambda e: e.name):
+        if entry.is_file():
+            with open(entry.path, 'rb') as aes_file:
+                blobs.append((entry.name, aes_file.read()))
+    return blobs
+
+
+# Read the PEM text of the RSA private keys (parsed once by key_store)
+def load_pem_texts(rsa_folder, limit=None):
+    names = sorted(f for f in os.listdir(rsa_folder) if f.endswith('.pem'))
+    if limit is not None:
+        names = names[:limit]
+    pems = []
+    for name in names:
+        with open(os.path.join(rsa_folder, name), 'r') as priv_key_file:
+            pems.append((name, priv_key_file.read()))
+    return pems
+
+
+# Worker-process globals, set once per process by _init_worker
+_blobs = None
+_validator = None
+_stop_event = None
+
+
+def _init_worker(blobs, validator, stop_event):
+    global _blobs, _validator, _stop_event
+    _blobs = blobs
+    _validator = validator
+    _stop_event = stop_event
+
+
+# Try one RSA key against every AES blob; returns (key_name, blob_name, aes_key, attempts)
+# key_numbers is (n, e, d, p, q); p and q keep decryption on the CRT path
+def _search_one_key(key_name, key_numbers):
+    if _stop_event.is_set():
+        return key_name, None, None, 0
+    try:
+        cipher_rsa = PKCS1_OAEP.new(RSA.construct(key_numbers, consistency_check=False))
+    except (ValueError, TypeError):
+        return key_name, None, None, 0
+    key_size = (key_numbers[0].bit_length() + 7) // 8
+
+    attempts = 0
+    for blob_name, encrypted_aes_key in _blobs:
+        if _stop_event.is_set():
+            break
+        if len(encrypted_aes_key) != key_size:
+            continue  # an OAEP ciphertext is exactly as long as the modulus
+        attempts += 1
+        try:
+            aes_key = cipher_rsa.decrypt(encrypted_aes_key)
+        except (ValueError, TypeError):
+            continue  # wrong key for this blob
+        if _validator.matches(aes_key):
+            _stop_event.set()
+            return key_name, blob_name, aes_key, attempts
+    return key_name, None, None, attempts
+
+
+# Search the RSA x AES grid across a process pool
+# keys: [(name, (n, e, d, p, q))], e.g. KeyStore.items()
+# validator is a hash_validator.HashValidator holding the expected AES key hash
+def search_aes_key(keys, aes_blobs, validator, workers=None, on_progress=None):
+    workers = workers or os.cpu_count() or 1
+    context = multiprocessing.get_context()
+    # Handed to the workers when they start, so checking it is a cheap shared-memory read
+    stop_event = context.Event()
+    attempts = 0
+    found = None
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(aes_blobs, validator, stop_event),
+    ) as pool:
+        futures = [pool.submit(_search_one_key, name, numbers) for name, numbers in keys]
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            key_name, blob_name, aes_key, key_attempts = future.result()
+            attempts += key_attempts
+            if on_progress:
+                on_progress(key_name, attempts, time.perf_counter() - start)
+            if aes_key is not None and found is None:
+                found = (aes_key, key_name, blob_name)
+                stop_event.set()
+                for pending in futures:
+                    pending.cancel()
+
+    seconds = time.perf_counter() - start
+    if found is None:
+        return SearchResult(None, None, None, attempts, seconds)
+    return SearchResult(found[0], found[1], found[2], attempts, seconds)
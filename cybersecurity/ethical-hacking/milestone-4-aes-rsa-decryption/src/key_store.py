@@ -0,0 +1,165 @@
+# RSA private-key store for Milestone 4
+#
+# RSA.import_key decodes the PEM/DER and then runs a consistency check on the
+# key (including primality tests on p and q), which dominates the cost of
+# loading hundreds of keys. The store parses every PEM once, in parallel,
+# and keeps only the key numbers (n, e, d, p, q). Those are pickled to a
+# cache file together with a fingerprint of the PEM files, so a repeat run
+# rebuilds the keys with RSA.construct(..., consistency_check=False) and
+# skips parsing entirely. p and q are kept, so decryption still uses the
+# CRT path. One PKCS1_OAEP cipher is cached per key, and a blob is only
+# tried against keys whose modulus size matches its length.
+
+from Crypto.Cipher import PKCS1_OAEP
+from Crypto.PublicKey import RSA
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import os
+import pickle
+
+from key_search import load_pem_texts
+
+CACHE_FORMAT = 1
+
+
+# Parse one PEM into its key numbers, or None if it is not a usable private key
+def parse_key_numbers(pem_text):
+    try:
+        key = RSA.import_key(pem_text)
+    except (ValueError, IndexError, TypeError):
+        return None
+    if not key.has_private():
+        return None
+    return key_numbers(key)
+
+
+# (n, e, d, p, q) of a private key, as plain ints (cheap to pickle and send to processes)
+def key_numbers(key):
+    return int(key.n), int(key.e), int(key.d), int(key.p), int(key.q)
+
+
+# Rebuild a key from its numbers without re-checking it; p and q keep decryption on the CRT path
+def key_from_numbers(numbers):
+    return RSA.construct(numbers, consistency_check=False)
+
+
+# Fingerprint of a list of (name, pem_text); changes whenever a key file is added, removed or edited
+def pem_fingerprint(pems):
+    digest = hashlib.sha256()
+    for name, pem_text in pems:
+        digest.update(name.encode('utf-8') + b'\0' + pem_text.encode('utf-8') + b'\0')
+    return digest.hexdigest()
+
+
+def _parse_named(named_pem):
+    name, pem_text = named_pem
+    return name, parse_key_numbers(pem_text)
+
+
+# Parse every PEM, across a process pool when there is more than a handful
+def parse_pems(pems, workers=None):
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(pems) < 8:
+        return [_parse_named(named_pem) for named_pem in pems]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_parse_named, pems, chunksize=max(1, len(pems) // (workers * 4))))
+
+
+# Read a cache file; returns {name: numbers} or None when it is missing, stale or unreadable
+# (pickle, so only point this at a cache file you wrote yourself)
+def load_key_cache(cache_path, fingerprint):
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            cached = pickle.load(cache_file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get('format') != CACHE_FORMAT:
+        return None
+    if cached.get('fingerprint') != fingerprint:
+        return None
+    return cached.get('keys')
+
+
+# Write the cache to a temporary file first, so a crash never leaves a half-written cache
+def save_key_cache(cache_path, fingerprint, numbers_by_name):
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, 'wb') as cache_file:
+        pickle.dump({'format': CACHE_FORMAT, 'fingerprint': fingerprint, 'keys': numbers_by_name},
+                    cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, cache_path)
+
+
+class KeyStore:
+    # numbers_by_name: {key name: (n, e, d, p, q)} in the order keys should be tried
+    def __init__(self, numbers_by_name, from_cache=False):
+        self.numbers = dict(numbers_by_name)
+        self.from_cache = from_cache
+        self._keys = {}
+        self._ciphers = {}
+        self._sizes = {name: (numbers[0].bit_length() + 7) // 8 for name, numbers in self.numbers.items()}
+
+    # Load the first `limit` keys of a folder, through the cache file when one is given
+    @classmethod
+    def from_folder(cls, rsa_folder, limit=None, cache_path=None, workers=None):
+        pems = load_pem_texts(rsa_folder, limit=limit)
+        fingerprint = pem_fingerprint(pems)
+        if cache_path:
+            cached = load_key_cache(cache_path, fingerprint)
+            if cached is not None:
+                return cls(cached, from_cache=True)
+
+        numbers_by_name = {name: numbers for name, numbers in parse_pems(pems, workers) if numbers is not None}
+        if cache_path:
+            try:
+                save_key_cache(cache_path, fingerprint, numbers_by_name)
+            except OSError as e:
+                print(f"Could not write key cache {cache_path}: {e}")
+        return cls(numbers_by_name)
+
+    def __len__(self):
+        return len(self.numbers)
+
+    @property
+    def names(self):
+        return list(self.numbers)
+
+    # (name, numbers) pairs, e.g. to hand to key_search.search_aes_key
+    def items(self):
+        return list(self.numbers.items())
+
+    # Modulus size in bytes; an OAEP ciphertext for this key is exactly this long
+    def size_in_bytes(self, name):
+        return self._sizes[name]
+
+    def key(self, name):
+        key = self._keys.get(name)
+        if key is None:
+            key = self._keys[name] = key_from_numbers(self.numbers[name])
+        return key
+
+    # One OAEP cipher per key, built on first use
+    def cipher(self, name):
+        cipher = self._ciphers.get(name)
+        if cipher is None:
+            cipher = self._ciphers[name] = PKCS1_OAEP.new(self.key(name))
+        return cipher
+
+    # Names of the keys (out of names, default all) whose modulus size fits the blob
+    def candidates(self, blob, names=None):
+        names = self.names if names is None else names
+        return [name for name in names if self._sizes[name] == len(blob)]
+
+    # Try one blob against N keys; yields (key name, plaintext) for every key that decrypts it
+    def try_blob(self, blob, names=None):
+        for name in self.candidates(blob, names):
+            try:
+                yield name, self.cipher(name).decrypt(blob)
+            except (ValueError, TypeError):
+                continue  # wrong key for this blob
+
+    # First (key name, plaintext) whose plaintext the validator accepts, or None
+    def find_key_for_blob(self, blob, validator, names=None):
+        for name, plaintext in self.try_blob(blob, names):
+            if validator.matches(plaintext):
+                return name, plaintext
+        return None
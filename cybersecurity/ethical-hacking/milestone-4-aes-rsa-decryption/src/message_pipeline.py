@@ -0,0 +1,122 @@
+# Streaming decrypt-and-verify pipeline for Milestone 4
+#
+# Every message file is streamed through AES-CBC decryption and the hash
+# update in fixed-size chunks (aes_cbc.decrypt_file with keep_plaintext=False),
+# so no plaintext is kept while checking. Files are checked concurrently on a
+# thread pool (PyCryptodome and hashlib release the GIL on large buffers).
+# The folder is walked lazily with os.scandir and only a bounded number of
+# files is in flight at once, so tens of thousands of messages never turn
+# into tens of thousands of queued tasks. The plaintext is decrypted again,
+# and kept, only for the file whose digest matches.
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import os
+import threading
+import time
+
+from aes_cbc import DEFAULT_CHUNK_SIZE, decrypt_file
+
+
+# The message whose hash matched
+class MessageMatch:
+    def __init__(self, file_name, path, plaintext, matched_padded):
+        self.file_name = file_name
+        self.path = path
+        self.plaintext = plaintext            # bytes, PKCS#7 padding removed when valid
+        self.matched_padded = matched_padded  # True if the digest matched with the padding left on
+
+
+# Outcome of find_secret_message; match is None when no file matched
+class PipelineResult:
+    def __init__(self, match, files_checked, bytes_processed, errors, seconds):
+        self.match = match
+        self.files_checked = files_checked
+        self.bytes_processed = bytes_processed
+        self.errors = errors  # [(file_name, error message)]
+        self.seconds = seconds
+
+    @property
+    def files_per_second(self):
+        return self.files_checked / self.seconds if self.seconds else 0.0
+
+    @property
+    def megabytes_per_second(self):
+        return self.bytes_processed / self.seconds / 1e6 if self.seconds else 0.0
+
+
+# Lazily yield (file name, path) for every file in the folder
+def iter_message_files(messages_folder):
+    with os.scandir(messages_folder) as entries:
+        for entry in entries:
+            if entry.is_file():
+                yield entry.name, entry.path
+
+
+# Stream one file through decryption and hashing; returns (matched, matched_padded, size)
+def check_message_file(path, aes_key, validator, chunk_size=DEFAULT_CHUNK_SIZE, stop_event=None):
+    if stop_event is not None and stop_event.is_set():
+        return False, False, 0
+    result = decrypt_file(path, aes_key, hashers=validator.new_hashers(),
+                          keep_plaintext=False, chunk_size=chunk_size)
+    if validator.match_hashers(result.hashers):
+        return True, False, result.length
+    if validator.match_hashers(result.raw_hashers):
+        return True, True, result.length
+    return False, False, result.length
+
+
+# Check every message in the folder against the validator and return the first match
+# validator is a hash_validator.HashValidator holding the expected message hash
+def find_secret_message(messages_folder, aes_key, validator, workers=None, max_in_flight=None,
+                        chunk_size=DEFAULT_CHUNK_SIZE, on_progress=None):
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    max_in_flight = max_in_flight or workers * 4
+    stop_event = threading.Event()
+    files = iter_message_files(messages_folder)
+    in_flight = {}
+    files_checked = 0
+    bytes_processed = 0
+    errors = []
+    found = None
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # Keep at most max_in_flight files queued or running
+            while found is None and len(in_flight) < max_in_flight:
+                next_file = next(files, None)
+                if next_file is None:
+                    break
+                file_name, path = next_file
+                future = pool.submit(check_message_file, path, aes_key, validator, chunk_size, stop_event)
+                in_flight[future] = (file_name, path)
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_name, path = in_flight.pop(future)
+                if future.cancelled():
+                    continue
+                try:
+                    matched, matched_padded, size = future.result()
+                except Exception as e:
+                    errors.append((file_name, str(e)))
+                    continue
+                files_checked += 1
+                bytes_processed += size
+                if matched and found is None:
+                    found = (file_name, path, matched_padded)
+                    stop_event.set()
+                    for pending in in_flight:
+                        pending.cancel()
+            if on_progress:
+                on_progress(files_checked, bytes_processed, time.perf_counter() - start)
+
+    match = None
+    if found is not None:
+        # Only the matching file is decrypted into memory
+        file_name, path, matched_padded = found
+        plaintext = decrypt_file(path, aes_key, chunk_size=chunk_size).plaintext
+        match = MessageMatch(file_name, path, bytes(plaintext), matched_padded)
+    return PipelineResult(match, files_checked, bytes_processed, errors, time.perf_counter() - start)
@@ -3,136 +3,113 @@
 # Milestone 4
 
 # import libraries - won't use padding library
-from Crypto.Cipher import AES, PKCS1_OAEP
-from Crypto.PublicKey import RSA
-import hashlib
+import argparse
 import os
-
-# Load RSA private key
-def load_rsa_private_key(file_path):
-    with open(file_path, 'r') as priv_key_file:
-        private_key = RSA.import_key(priv_key_file.read())
-    return private_key
-
-# Decrypt AES key using RSA
-def decrypt_aes_key_with_rsa(encrypted_aes_key, private_key):
-    cipher_rsa = PKCS1_OAEP.new(private_key)
-    return cipher_rsa.decrypt(encrypted_aes_key)
-
-# Load AES-encrypted message
-def load_encrypted_message(file_path):
-    with open(file_path, 'rb') as enc_file:
-        return enc_file.read()
-
-# Decrypt the message using AES in CBC mode with a fixed IV
-def decrypt_message_with_aes_cbc(encrypted_message, aes_key):
-    iv = 16 * b'\x00'  # Fixed IV as specified
-    cipher = AES.new(aes_key, AES.MODE_CBC, iv)
-    decrypted_message = b""
-    for i in range(0, len(encrypted_message), AES.block_size):
-        chunk = encrypted_message[i:i + AES.block_size]
-        decrypted_message += cipher.decrypt(chunk)
-    return decrypted_message
-
-# Hash the decrypted AES key using MD5
-def hash_decrypted_aes_key(aes_key):
-    return hashlib.md5(aes_key).hexdigest()
-
-# Verify hash of decrypted message
-def verify_hash(decrypted_data, hash_file_path):
-    with open(hash_file_path, 'r') as hash_file:
-        expected_hash = hash_file.read().strip()
-    computed_hash = hashlib.md5(decrypted_data).hexdigest()
-    return expected_hash == computed_hash
+import sys
+
+from checkpoint import SearchCheckpoint, search_fingerprint
+from hash_validator import HashValidator
+from key_search import load_aes_blobs, search_aes_key
+from key_store import KeyStore
+from message_pipeline import find_secret_message
+from progress import ProgressReporter
+
+# Command-line options; the defaults match the assignment's folder layout
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Find the secret message: RSA -> AES key -> AES-CBC messages.")
+    parser.add_argument('--rsa-dir', default='rsa', help="folder of RSA private keys (.pem)")
+    parser.add_argument('--aes-dir', default='aes', help="folder of RSA-encrypted AES keys")
+    parser.add_argument('--messages-dir', default='messages', help="folder of AES-encrypted messages")
+    parser.add_argument('--hashes-dir', default='hashes', help="folder holding the hash files")
+    parser.add_argument('--aes-hash', help="expected AES key hash file (default: <hashes-dir>/plain_aes_hash.md5)")
+    parser.add_argument('--message-hash',
+                        help="expected message hash file (default: <hashes-dir>/plain_master_message_hash.md5)")
+    parser.add_argument('--key-limit', type=int, default=200, help="use the first N RSA keys (0 = all)")
+    parser.add_argument('--workers', type=int, help="processes for the key search (default: all cores)")
+    parser.add_argument('--message-workers', type=int, help="threads for the message search")
+    parser.add_argument('--key-cache', default='rsa_key_cache.pkl',
+                        help="parsed RSA key cache file ('' to disable)")
+    parser.add_argument('--checkpoint', default='milestone4_checkpoint.json',
+                        help="resumable key-search checkpoint file ('' to disable)")
+    parser.add_argument('--restart', action='store_true', help="ignore an existing checkpoint")
+    parser.add_argument('--progress-interval', type=float, default=1.0, help="seconds between progress lines")
+    parser.add_argument('-q', '--quiet', action='store_true', help="only print the results")
+    return parser.parse_args(argv)
 
 # Main function
-def main():
-    # Paths to folders
-    rsa_folder = 'rsa'
-    aes_folder = 'aes'
-    messages_folder = 'messages'
-    hashes_folder = 'hashes'
+def main(argv=None):
+    args = parse_args(argv)
+    progress = ProgressReporter(args.progress_interval, args.quiet)
 
     # Files for validation
-    master_message_hash_file = os.path.join(hashes_folder, 'plain_master_message_hash.md5')
-    aes_hash_file = os.path.join(hashes_folder, 'plain_aes_hash.md5')
-
-    # Get the first 200 RSA private key files
-    rsa_files = [f for f in os.listdir(rsa_folder) if f.endswith('.pem')][:200]
-
-    correct_aes_key = None  # Placeholder for the correct AES key
-
-    # Loop 1: Iterate over RSA private key files
-    for private_key_file in rsa_files:
-        private_key_path = os.path.join(rsa_folder, private_key_file)
-        try:
-            private_key = load_rsa_private_key(private_key_path)
-            print(f"Trying RSA private key: {private_key_file}")
-        except Exception as e:
-            print(f"Error loading RSA private key {private_key_file}: {e}")
-            continue
-
-        # Loop 2: Iterate over AES key files
-        for aes_key_file in os.listdir(aes_folder):
-            aes_key_path = os.path.join(aes_folder, aes_key_file)
-
-            try:
-                with open(aes_key_path, 'rb') as aes_file:
-                    encrypted_aes_key = aes_file.read()
-            except FileNotFoundError:
-                print(f"AES key file {aes_key_file} not found.")
-                continue
-
-            # Decrypt AES key
-            try:
-                aes_key = decrypt_aes_key_with_rsa(encrypted_aes_key, private_key)
-                print(f"AES key decrypted successfully.")  # printing allows me to see where i am in process
-            except Exception as e:
-                print(f"Error decrypting AES key {aes_key_file} with RSA: {e}")
-                continue
-
-            # Validate AES key hash
-            if hash_decrypted_aes_key(aes_key) == open(aes_hash_file).read().strip():
-                print("Correct AES key found!")
-                correct_aes_key = aes_key
-                break  # Exit Loop 2 once correct AES key is found
-
-        if correct_aes_key:  # Exit Loop 1 if AES key is found
-            break
-
+    master_message_hash_file = args.message_hash or os.path.join(args.hashes_dir, 'plain_master_message_hash.md5')
+    aes_hash_file = args.aes_hash or os.path.join(args.hashes_dir, 'plain_aes_hash.md5')
+
+    # Read the expected hashes, the RSA private keys and every encrypted AES key once
+    aes_validator = HashValidator.from_files(aes_hash_file)
+    message_validator = HashValidator.from_files(master_message_hash_file)
+    key_store = KeyStore.from_folder(args.rsa_dir, limit=args.key_limit or None,
+                                     cache_path=args.key_cache or None, workers=args.workers)
+    progress.report(f"Loaded {len(key_store)} RSA keys" + (" from the key cache" if key_store.from_cache else ""),
+                    force=True)
+    aes_blobs = load_aes_blobs(args.aes_dir)
+
+    # Skip the RSA keys an interrupted run already tried against every AES key
+    checkpoint = None
+    rsa_keys = key_store.items()
+    if args.checkpoint:
+        fingerprint = search_fingerprint(key_store.names, [name for name, _ in aes_blobs], aes_validator)
+        if args.restart:
+            checkpoint = SearchCheckpoint(args.checkpoint, fingerprint)
+        else:
+            checkpoint = SearchCheckpoint.load(args.checkpoint, fingerprint)
+        rsa_keys = [(name, numbers) for name, numbers in rsa_keys if name not in checkpoint.completed]
+        if checkpoint.completed:
+            progress.report(f"Resuming: {len(checkpoint.completed)} RSA keys already searched", force=True)
+
+    # Loops 1 and 2: try every RSA key on every AES key, spread over all cores
+    progress.report(f"Searching {len(rsa_keys)} RSA keys x {len(aes_blobs)} AES keys...", force=True)
+    report_keys = progress.key_search(len(rsa_keys), done_before=len(key_store) - len(rsa_keys))
+
+    def on_key_done(key_name, attempts, seconds):
+        if checkpoint:
+            checkpoint.mark_done(key_name, attempts)
+        report_keys(key_name, attempts, seconds)
+
+    try:
+        result = search_aes_key(rsa_keys, aes_blobs, aes_validator, workers=args.workers, on_progress=on_key_done)
+    except KeyboardInterrupt:
+        if checkpoint:
+            checkpoint.save()
+            print(f"Interrupted; {len(checkpoint.completed)} RSA keys saved to {args.checkpoint}. Rerun to resume.")
+        raise SystemExit(130)
+    print(f"{result.attempts} attempts in {result.seconds:.1f}s ({result.attempts_per_second:.0f} attempts/sec)")
+    if checkpoint:
+        checkpoint.clear()
+
+    correct_aes_key = result.aes_key
     if not correct_aes_key:
         print("Correct AES key not found. Exiting.")
-        return
-
-    # Loop 3: Decrypt messages using the correct AES key
-    for message_file in os.listdir(messages_folder):
-        message_path = os.path.join(messages_folder, message_file)
-
-        try:
-            encrypted_message = load_encrypted_message(message_path)
-        except FileNotFoundError:
-            print(f"Encrypted message file {message_file} not found.")
-            continue
-
-        # Decrypt message
-        try:
-            decrypted_message = decrypt_message_with_aes_cbc(encrypted_message, correct_aes_key)
-            unpadded_message = decrypted_message  # Assuming padding is removed
-            print(f"Decrypted message from {message_file}:", unpadded_message.decode('utf-8', errors='ignore'))
-
-            # Verify message hash
-            if verify_hash(unpadded_message, master_message_hash_file):
-                print("Secret message found!")
-                print("Secret message:", unpadded_message.decode('utf-8'))
-                break  # Stop after finding the correct message
-            else:
-                print(f"Hash mismatch for message in {message_file}. Moving to the next message.")
-
-        except Exception as e:
-            print(f"Error decrypting message from {message_file}: {e}")
-            continue
-
+        return 1
+    print(f"Correct AES key found! (RSA key {result.rsa_key_name}, AES key file {result.aes_blob_name})")
+
+    # Loop 3: stream every message through decryption and hashing on a thread pool;
+    # only the message whose hash matches is kept in memory
+    progress.report("Checking messages...", force=True)
+    search = find_secret_message(args.messages_dir, correct_aes_key, message_validator,
+                                 workers=args.message_workers, on_progress=progress.message_search())
+    print(f"{search.files_checked} messages in {search.seconds:.1f}s "
+          f"({search.files_per_second:.0f} messages/sec, {search.megabytes_per_second:.1f} MB/s)")
+    for message_file, error in search.errors:
+        print(f"Error decrypting message from {message_file}: {error}")
+
+    if search.match is None:
+        print("Secret message not found.")
+        return 1
+    print(f"Secret message found! (message file {search.match.file_name})")
+    print("Secret message:", search.match.plaintext.decode('utf-8', errors='replace'))
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
 
@@ -0,0 +1,41 @@
+# Rate-limited progress output for Milestone 4
+#
+# Printing a line per attempt costs more than many of the attempts do, so
+# progress is printed at most once per interval (and never in quiet mode).
+
+import time
+
+
+class ProgressReporter:
+    def __init__(self, interval=1.0, quiet=False):
+        self.interval = interval
+        self.quiet = quiet
+        self._last = None
+
+    # Print the message if the interval has passed since the last line (or force=True)
+    def report(self, message, force=False):
+        if self.quiet:
+            return False
+        now = time.monotonic()
+        if not force and self._last is not None and now - self._last < self.interval:
+            return False
+        self._last = now
+        print(message, flush=True)
+        return True
+
+    # Progress callback for key_search.search_aes_key
+    def key_search(self, total_keys, done_before=0):
+        def on_progress(key_name, attempts, seconds):
+            on_progress.keys_done += 1
+            rate = attempts / seconds if seconds else 0.0
+            self.report(f"  {done_before + on_progress.keys_done}/{done_before + total_keys} RSA keys, "
+                        f"{attempts} attempts, {rate:.0f} attempts/sec")
+        on_progress.keys_done = 0
+        return on_progress
+
+    # Progress callback for message_pipeline.find_secret_message
+    def message_search(self):
+        def on_progress(files_checked, bytes_processed, seconds):
+            rate = files_checked / seconds if seconds else 0.0
+            self.report(f"  {files_checked} messages, {bytes_processed / 1e6:.1f} MB, {rate:.0f} messages/sec")
+        return on_progress